@@ -0,0 +1,28 @@
+"""Index scene_npc_configurations.scene_id for NPC count aggregation
+
+Revision ID: 3b8f2c6a91d4
+Revises: d70b15394242
+Create Date: 2026-10-18 17:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8f2c6a91d4'
+down_revision: Union[str, Sequence[str], None] = 'd70b15394242'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_scene_npc_configurations_scene_id'), 'scene_npc_configurations', ['scene_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_scene_npc_configurations_scene_id'), table_name='scene_npc_configurations')
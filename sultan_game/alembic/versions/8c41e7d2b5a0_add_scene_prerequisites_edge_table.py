@@ -0,0 +1,53 @@
+"""Add scene_prerequisites edge table backfilled from scenes.prerequisite_scenes
+
+Revision ID: 8c41e7d2b5a0
+Revises: 3b8f2c6a91d4
+Create Date: 2026-10-18 19:05:00.000000
+
+"""
+from typing import Sequence, Union
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41e7d2b5a0'
+down_revision: Union[str, Sequence[str], None] = '3b8f2c6a91d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    edges = op.create_table('scene_prerequisites',
+    sa.Column('scene_id', sa.String(length=36), nullable=False),
+    sa.Column('prerequisite_id', sa.String(length=36), nullable=False),
+    sa.ForeignKeyConstraint(['prerequisite_id'], ['scenes.id'], ),
+    sa.ForeignKeyConstraint(['scene_id'], ['scenes.id'], ),
+    sa.PrimaryKeyConstraint('scene_id', 'prerequisite_id')
+    )
+    op.create_index(op.f('ix_scene_prerequisites_prerequisite_id'), 'scene_prerequisites', ['prerequisite_id'], unique=False)
+
+    # 从现有的prerequisite_scenes（业务scene_id的JSON列表）回填边
+    bind = op.get_bind()
+    scenes = bind.execute(sa.text("SELECT id, scene_id, prerequisite_scenes FROM scenes")).fetchall()
+    ids = {scene_id: id_ for id_, scene_id, _ in scenes}
+    rows = []
+    for id_, _, prerequisites in scenes:
+        try:
+            keys = json.loads(prerequisites) if prerequisites else []
+        except ValueError:
+            continue
+        for key in dict.fromkeys(keys):
+            if key in ids and ids[key] != id_:
+                rows.append({'scene_id': id_, 'prerequisite_id': ids[key]})
+    if rows:
+        op.bulk_insert(edges, rows)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_scene_prerequisites_prerequisite_id'), table_name='scene_prerequisites')
+    op.drop_table('scene_prerequisites')
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 from pydantic import BaseModel
 from core.database import get_db
+from core import prompt_builder
 from models import AIConfig, AIType
 import uuid
 import time
@@ -158,6 +159,7 @@ async def update_ai_config(config_id: str, config_update: AIConfigUpdate, db: Se
     db_config.updated_at = int(time.time())
     db.commit()
     db.refresh(db_config)
+    prompt_builder.invalidate_config(config_uuid)
     
     config_dict = db_config.__dict__.copy()
     config_dict['ai_type'] = db_config.ai_type.value
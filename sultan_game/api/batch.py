@@ -0,0 +1,468 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from sqlalchemy.types import Enum as SAEnum
+from typing import Any, Dict, List, Optional
+from pydantic import ValidationError
+from core.database import get_db, SessionLocal
+from core.logging_config import get_logger, log_database_operation
+from core import dashboard, scene_graph, rewards
+from models import (
+    Scene, SceneCategory, SceneStatus, TimeOfDay,
+    NPC, NPCType, Tier, Faction,
+    Card, CardRarity, CardCategory,
+    SceneRequirement, SceneCardBinding, SceneRewardExtended, PlayerNPCReward, CardReward, SceneAIConfiguration
+)
+from api.scenes import SceneCreate
+from api.npcs import NPCCreate, validate_npc_attributes
+from api.cards import CardCreate
+import enum
+import json
+import uuid
+import time
+import zlib
+
+router = APIRouter(prefix="/batch", tags=["batch"])
+logger = get_logger(__name__)
+
+# 每批写入的行数
+IMPORT_CHUNK_SIZE = 1000
+# 响应中最多返回的错误条数
+MAX_REPORTED_ERRORS = 1000
+# 导出时每次从数据库游标取出的行数
+EXPORT_BATCH_SIZE = 500
+
+class NPCImport(NPCCreate):
+    """NPC导入：在创建接口的字段之外保留权力属性和AI行为配置，使导出的NPC可以原样导入"""
+    influence: Optional[int] = 0
+    command: Optional[int] = 0
+    category: Optional[int] = 0
+    stealth: Optional[int] = 0
+    custom_attributes: Optional[Dict[str, Any]] = {}
+    personality_traits: Optional[List[Any]] = []
+    personality_description: Optional[str] = None
+    speaking_style: Optional[Dict[str, Any]] = {}
+    emotion_thresholds: Optional[Dict[str, Any]] = {}
+    dialogue_goals: Optional[Dict[str, Any]] = {}
+
+def _scene_mapping(scene: SceneCreate, now: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "scene_id": scene.scene_id,
+        "name": scene.name,
+        "category": SceneCategory(scene.category),
+        "chapter": scene.chapter,
+        "description": scene.description,
+        "background_image": scene.background_image,
+        "background_music": scene.background_music,
+        "location": scene.location,
+        "time_of_day": TimeOfDay(scene.time_of_day) if scene.time_of_day else None,
+        "weather": scene.weather,
+        "card_count": scene.card_count,
+        "prerequisite_scenes": scene.prerequisite_scenes,
+        "days_required": scene.days_required,
+        "status": SceneStatus.DRAFT,
+        "is_active": True,
+        "created_at": now,
+        "updated_at": now
+    }
+
+def _npc_mapping(npc: NPCImport, now: int) -> dict:
+    attribute_error = validate_npc_attributes(npc)
+    if attribute_error:
+        raise ValueError(attribute_error)
+    return {
+        "id": str(uuid.uuid4()),
+        "npc_id": npc.npc_id,
+        "name": npc.name,
+        "npc_type": NPCType(npc.npc_type),
+        "tier": Tier(npc.tier),
+        "faction": Faction(npc.faction),
+        "avatar": npc.avatar,
+        "description": npc.description,
+        "appearance": npc.appearance,
+        "intelligence": npc.intelligence,
+        "strength": npc.strength,
+        "defense": npc.defense,
+        "hp_max": npc.hp_max,
+        "charisma": npc.charisma,
+        "loyalty": npc.loyalty,
+        "fear": npc.fear,
+        "influence": npc.influence,
+        "command": npc.command,
+        "category": npc.category,
+        "stealth": npc.stealth,
+        "custom_attributes": npc.custom_attributes or {},
+        "personality_traits": npc.personality_traits or [],
+        "personality_description": npc.personality_description,
+        "speaking_style": npc.speaking_style or {},
+        "emotion_thresholds": npc.emotion_thresholds or {},
+        "dialogue_goals": npc.dialogue_goals or {},
+        "is_active": True,
+        "created_at": now,
+        "updated_at": now
+    }
+
+def _card_mapping(card: CardCreate, now: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "card_id": card.card_id,
+        "name": card.name,
+        "rarity": CardRarity(card.rarity),
+        "category": CardCategory(card.category),
+        "sub_category": card.sub_category,
+        "description": card.description,
+        "flavor_text": card.flavor_text,
+        "base_cost": card.base_cost,
+        "is_consumable": card.is_consumable,
+        "max_stack": card.max_stack,
+        "use_conditions": card.use_conditions,
+        "is_active": True,
+        "created_at": now,
+        "updated_at": now
+    }
+
+# 导入类型 -> (模型, 校验schema, 业务ID字段, 行映射函数)
+IMPORTERS = {
+    "scenes": (Scene, SceneCreate, "scene_id", _scene_mapping),
+    "npcs": (NPC, NPCImport, "npc_id", _npc_mapping),
+    "cards": (Card, CardCreate, "card_id", _card_mapping),
+}
+
+class BatchImporter:
+    """
+    分块批量导入器
+    逐行校验（pydantic schema + 枚举/属性范围），每IMPORT_CHUNK_SIZE行用一次executemany写入并提交；
+    整块写入失败时逐行重试以定位出错的行
+    """
+    def __init__(self, db: Session, import_type: str):
+        self.db = db
+        self.model, self.schema, self.key_field, self.to_mapping = IMPORTERS[import_type]
+        self.key_column = getattr(self.model, self.key_field)
+        self.table_name = self.model.__tablename__
+        self.chunk = []  # [(行号, 映射)]
+        self.seen_keys = set()
+        self.imported_scenes = {}  # 本次已导入场景的 业务scene_id -> scenes.id
+        self.scene_prerequisites = {}  # 待写入场景的 scenes.id -> {前置scenes.id: 前置业务scene_id}
+        self.results = {"total": 0, "success": 0, "failed": 0, "errors": []}
+
+    def add_error(self, row_number, error, key=None):
+        self.results["failed"] += 1
+        if len(self.results["errors"]) < MAX_REPORTED_ERRORS:
+            self.results["errors"].append({"row": row_number, self.key_field: key, "error": error})
+
+    def add(self, row_number, item):
+        """校验一行数据并加入当前块"""
+        self.results["total"] += 1
+        key = item.get(self.key_field) if isinstance(item, dict) else None
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Row must be a JSON object")
+            mapping = self.to_mapping(self.schema(**item), int(time.time()))
+        except ValidationError as e:
+            self.add_error(row_number, "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+            ), key)
+            return
+        except ValueError as e:
+            self.add_error(row_number, str(e), key)
+            return
+        
+        if key in self.seen_keys:
+            self.add_error(row_number, f"Duplicate {self.key_field} in import data", key)
+            return
+        self.seen_keys.add(key)
+        self.chunk.append((row_number, mapping))
+        if len(self.chunk) >= IMPORT_CHUNK_SIZE:
+            self.flush()
+
+    def add_lines(self, lines):
+        """解析并加入一组NDJSON行 [(行号, 原始行)]"""
+        for row_number, line in lines:
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                self.results["total"] += 1
+                self.add_error(row_number, f"Invalid JSON: {e}")
+                continue
+            self.add(row_number, item)
+
+    def add_items(self, items):
+        for row_number, item in items:
+            self.add(row_number, item)
+
+    def flush(self):
+        """写入当前块"""
+        if not self.chunk:
+            return
+        chunk, self.chunk = self.chunk, []
+        
+        # 一次查询检查整块中已存在的业务ID
+        keys = [mapping[self.key_field] for _, mapping in chunk]
+        existing = {
+            row[0] for row in self.db.query(self.key_column).filter(self.key_column.in_(keys))
+        }
+        rows = []
+        for row_number, mapping in chunk:
+            if mapping[self.key_field] in existing:
+                self.add_error(row_number, f"{self.key_field} already exists", mapping[self.key_field])
+            else:
+                rows.append((row_number, mapping))
+        if self.model is Scene:
+            rows = self._resolve_scene_prerequisites(rows)
+        if not rows:
+            return
+        
+        try:
+            self._write(rows)
+            self.results["success"] += len(rows)
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.warning(f"批量写入{self.table_name}失败，逐行重试: {e}")
+            self._insert_rows_individually(rows)
+
+    def _resolve_scene_prerequisites(self, rows):
+        """
+        前置场景必须已存在于数据库，或在导入数据中出现在当前行之前（保证不成环）
+        整块的前置场景用一次查询解析
+        """
+        keys = {key for _, mapping in rows for key in mapping["prerequisite_scenes"] or []}
+        keys.difference_update(self.imported_scenes)
+        known = dict(self.db.execute(select(Scene.scene_id, Scene.id).where(Scene.scene_id.in_(keys))).all()) if keys else {}
+        known.update(self.imported_scenes)
+        
+        resolved = []
+        for row_number, mapping in rows:
+            keys = list(dict.fromkeys(mapping["prerequisite_scenes"] or []))
+            missing = [key for key in keys if key not in known]
+            if missing:
+                self.add_error(row_number, f"Prerequisite scene '{missing[0]}' not found", mapping["scene_id"])
+                continue
+            mapping["prerequisite_scenes"] = keys
+            self.scene_prerequisites[mapping["id"]] = {known[key]: key for key in keys}
+            known[mapping["scene_id"]] = mapping["id"]
+            resolved.append((row_number, mapping))
+        return resolved
+
+    def _write(self, rows):
+        """插入一组行并提交"""
+        mappings = [mapping for _, mapping in rows]
+        self.db.execute(insert(self.model), mappings)
+        if self.model is Scene:
+            scene_graph.add_new_scene_edges(self.db, [
+                (mapping["id"], mapping["scene_id"], self.scene_prerequisites[mapping["id"]])
+                for mapping in mappings
+            ])
+        dashboard.track_bulk_insert(self.db, self.model, len(rows))
+        self.db.commit()
+        if self.model is Scene:
+            for mapping in mappings:
+                self.imported_scenes[mapping["scene_id"]] = mapping["id"]
+                del self.scene_prerequisites[mapping["id"]]
+
+    def _insert_rows_individually(self, rows):
+        for row_number, mapping in rows:
+            try:
+                self._write([(row_number, mapping)])
+                self.results["success"] += 1
+            except SQLAlchemyError as e:
+                self.db.rollback()
+                self.add_error(row_number, str(e.orig if hasattr(e, "orig") else e), mapping[self.key_field])
+
+    def finish(self):
+        self.flush()
+        if self.model is not Scene and self.results["success"]:
+            # 新卡片/NPC进入随机奖励候选池
+            rewards.invalidate_pools()
+        log_database_operation("IMPORT", self.table_name, f"{self.results['success']}/{self.results['total']}")
+        return self.results
+
+async def _iter_ndjson(request: Request):
+    """逐行解析流式NDJSON请求体，返回(行号, 对象或解析错误)"""
+    buffer = b""
+    row_number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                row_number += 1
+                yield row_number, line
+    if buffer.strip():
+        yield row_number + 1, buffer
+
+@router.post("/import")
+async def batch_import(import_type: str, request: Request, db: Session = Depends(get_db)):
+    """
+    批量导入数据
+    import_type: scenes | npcs | cards
+    请求体: NDJSON流（Content-Type: application/x-ndjson，每行一个对象，边接收边写入），
+    或JSON数组
+    校验和写库在线程池中按块执行，导入大量数据时不阻塞事件循环
+    """
+    if import_type not in IMPORTERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported import type: {import_type}")
+    
+    importer = BatchImporter(db, import_type)
+    content_type = request.headers.get("content-type", "")
+    
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        lines = []
+        async for row_number, line in _iter_ndjson(request):
+            lines.append((row_number, line))
+            if len(lines) >= IMPORT_CHUNK_SIZE:
+                await run_in_threadpool(importer.add_lines, lines)
+                lines = []
+        await run_in_threadpool(importer.add_lines, lines)
+    else:
+        try:
+            data = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+        if not isinstance(data, list):
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+        await run_in_threadpool(importer.add_items, enumerate(data, start=1))
+    
+    results = await run_in_threadpool(importer.finish)
+    logger.info(f"批量导入{import_type}: 成功 {results['success']}, 失败 {results['failed']}")
+    return results
+
+# 导出类型 -> 模型
+EXPORTERS = {
+    "scenes": Scene,
+    "npcs": NPC,
+    "cards": Card,
+}
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "gzip": ("application/gzip", "ndjson.gz"),
+}
+
+def _json_default(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _build_export_conditions(model, filters: Optional[dict]):
+    """
+    把过滤字典转换为查询条件：{列名: 值} 为等值匹配，{列名: [值...]} 为IN匹配；
+    枚举列接受枚举值（如 "main_story"）
+    """
+    conditions = []
+    columns = model.__table__.columns
+    for name, value in (filters or {}).items():
+        if name not in columns:
+            raise HTTPException(status_code=400, detail=f"Unknown filter field: {name}")
+        column = columns[name]
+        values = value if isinstance(value, list) else [value]
+        if isinstance(column.type, SAEnum) and column.type.enum_class:
+            try:
+                values = [column.type.enum_class(v) for v in values]
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        if isinstance(value, list):
+            conditions.append(column.in_(values))
+        else:
+            conditions.append(column == values[0])
+    return conditions
+
+def _group_rows(db: Session, model, key: str, ids):
+    """一次IN查询取出一批父记录的子记录，按外键分组"""
+    groups = {}
+    if not ids:
+        return groups
+    table = model.__table__
+    for row in db.execute(select(table).where(table.c[key].in_(ids))).mappings():
+        groups.setdefault(row[key], []).append(dict(row))
+    return groups
+
+def _attach_scene_children(db: Session, scenes: list):
+    """
+    为一批场景附加旁白提示词、要求、卡片绑定和扩展奖励（每批固定6次查询）
+    narrator_prompt 是SceneCreate的必填字段但不是scenes表的列，取自场景AI配置，使导出行可以直接导入
+    """
+    scene_ids = [scene["id"] for scene in scenes]
+    ai_configs = _group_rows(db, SceneAIConfiguration, "scene_id", scene_ids)
+    requirements = _group_rows(db, SceneRequirement, "scene_id", scene_ids)
+    bindings = _group_rows(db, SceneCardBinding, "scene_id", scene_ids)
+    rewards = _group_rows(db, SceneRewardExtended, "scene_id", scene_ids)
+    
+    reward_ids = [reward["id"] for group in rewards.values() for reward in group]
+    npc_rewards = _group_rows(db, PlayerNPCReward, "scene_reward_id", reward_ids)
+    card_rewards = _group_rows(db, CardReward, "scene_reward_id", reward_ids)
+    for group in rewards.values():
+        for reward in group:
+            reward["npc_rewards"] = npc_rewards.get(reward["id"], [])
+            reward["card_rewards"] = card_rewards.get(reward["id"], [])
+    
+    for scene in scenes:
+        configs = ai_configs.get(scene["id"])
+        scene["narrator_prompt"] = configs[0]["narrator_prompt"] if configs else ""
+        scene["requirements"] = requirements.get(scene["id"], [])
+        scene["card_bindings"] = bindings.get(scene["id"], [])
+        scene["extended_rewards"] = rewards.get(scene["id"], [])
+
+def _iter_export(export_type: str, conditions: list):
+    """
+    逐批读取并输出NDJSON行
+    使用独立会话和yield_per服务端游标，内存占用只与EXPORT_BATCH_SIZE有关，与导出总量无关
+    """
+    model = EXPORTERS[export_type]
+    table = model.__table__
+    query = select(table).where(*conditions).order_by(table.c.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    db = SessionLocal()
+    exported = 0
+    try:
+        for partition in db.execute(query).mappings().partitions():
+            rows = [dict(row) for row in partition]
+            if export_type == "scenes":
+                _attach_scene_children(db, rows)
+            exported += len(rows)
+            yield "".join(
+                json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows
+            ).encode("utf-8")
+    finally:
+        db.close()
+        log_database_operation("EXPORT", table.name, str(exported))
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=31)  # wbits=31: gzip格式
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@router.post("/export")
+async def batch_export(export_type: str, filters: Optional[dict] = None, format: str = "ndjson"):
+    """
+    批量导出数据
+    export_type: scenes | npcs | cards（场景附带旁白提示词、要求、卡片绑定和全部扩展奖励）
+    filters: 请求体中的过滤字典，如 {"category": "main_story", "is_active": true}
+    format: ndjson | gzip
+    导出内容以流的形式直接下载，可直接作为 /api/batch/import 的NDJSON输入：
+    场景、NPC、卡片本身的字段按导入schema重新创建（业务ID不变，数据库ID、状态和时间戳重新生成）；
+    场景的要求、卡片绑定和扩展奖励只随导出提供，导入时忽略
+    """
+    if export_type not in EXPORTERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export type: {export_type}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+    
+    conditions = _build_export_conditions(EXPORTERS[export_type], filters)
+    media_type, extension = EXPORT_FORMATS[format]
+    stream = _iter_export(export_type, conditions)
+    if format == "gzip":
+        stream = _gzip_stream(stream)
+    
+    filename = f"{export_type}_{int(time.time())}.{extension}"
+    logger.info(f"批量导出{export_type}: filters={filters}, format={format}")
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 from pydantic import BaseModel
 from core.database import get_db
+from core import rewards
 from models import Card, CardRarity, CardCategory, EffectType, CardEffect
 import uuid
 import time
@@ -116,6 +117,7 @@ async def create_card(card: CardCreate, db: Session = Depends(get_db)):
     db.add(db_card)
     db.commit()
     db.refresh(db_card)
+    rewards.invalidate_pools()
     
     card_dict = db_card.__dict__.copy()
     card_dict['rarity'] = db_card.rarity.value
@@ -138,6 +140,7 @@ async def update_card(card_id: str, card_update: CardUpdate, db: Session = Depen
     db_card.updated_at = int(time.time())
     db.commit()
     db.refresh(db_card)
+    rewards.invalidate_pools()
     
     card_dict = db_card.__dict__.copy()
     card_dict['rarity'] = db_card.rarity.value
@@ -156,6 +159,7 @@ async def delete_card(card_id: str, db: Session = Depends(get_db)):
     db_card.is_active = False
     db_card.updated_at = int(time.time())
     db.commit()
+    rewards.invalidate_pools()
     
     return {"message": "Card deleted successfully"}
 
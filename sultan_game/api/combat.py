@@ -0,0 +1,139 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import Optional, List
+from pydantic import BaseModel, Field
+from core.database import get_db
+from core.combat import Combatant, resolve_combat, result_from_record
+from core import balance
+from models import CombatRecord, NPC, PlayerNPCInstance, Scene, Tier
+
+router = APIRouter(prefix="/combat", tags=["combat"])
+
+# 单次请求最多返回的回合数
+MAX_ROUNDS_PER_PAGE = 500
+
+# Pydantic schemas
+class CombatantSchema(BaseModel):
+    id: Optional[str] = None
+    name: Optional[str] = None
+    strength: Optional[int] = None
+    defense: Optional[int] = None
+    hp: Optional[int] = None
+    npc_id: Optional[str] = None              # 使用NPC模板属性（npcs.id）
+    player_npc_id: Optional[str] = None       # 使用玩家NPC实例的当前属性（player_npc_instances.id）
+
+class CombatSimulateRequest(BaseModel):
+    attacker: CombatantSchema
+    defender: CombatantSchema
+    include_rounds: bool = False
+
+class MatchupRequest(BaseModel):
+    npc_ids: Optional[List[str]] = None       # 默认所有活跃NPC
+    tier: Optional[Tier] = None
+    trials: int = Field(100, ge=1, le=10000)
+    variance: float = Field(0.1, ge=0, lt=1)  # 每次攻击伤害浮动比例，0为确定性结果
+    seed: Optional[int] = None
+
+class SceneBalanceRequest(BaseModel):
+    npc_ids: Optional[List[str]] = None       # 候选队伍成员，默认所有玩家NPC模板
+    party_size: Optional[int] = Field(None, ge=1, le=10)
+    trials: int = Field(100, ge=1, le=10000)
+    variance: float = Field(0.1, ge=0, lt=1)
+    seed: Optional[int] = None
+    save: bool = True                         # 写入SceneAnalytics
+
+def _load_combatant(db: Session, data: CombatantSchema) -> Combatant:
+    """按请求构造参战者：指定NPC时读取其属性，显式传入的属性优先"""
+    base = {}
+    if data.player_npc_id:
+        instance = db.query(PlayerNPCInstance).filter(PlayerNPCInstance.id == data.player_npc_id).first()
+        if not instance:
+            raise HTTPException(status_code=404, detail=f"Player NPC not found: {data.player_npc_id}")
+        base = {"id": instance.id, "name": instance.npc.name, "strength": instance.current_strength,
+                "defense": instance.current_defense, "hp": instance.current_hp}
+    elif data.npc_id:
+        npc = db.query(NPC).filter(NPC.id == data.npc_id).first()
+        if not npc:
+            raise HTTPException(status_code=404, detail=f"NPC not found: {data.npc_id}")
+        base = {"id": npc.id, "name": npc.name, "strength": npc.strength,
+                "defense": npc.defense, "hp": npc.hp_max}
+
+    values = {**base, **data.dict(exclude_none=True, exclude={"npc_id", "player_npc_id"})}
+    missing = [field for field in ("strength", "defense", "hp") if values.get(field) is None]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing combatant fields: {', '.join(missing)}")
+    return Combatant(
+        values.get("id") or values.get("name") or "unknown",
+        values.get("name") or values.get("id") or "unknown",
+        values["strength"], values["defense"], values["hp"]
+    )
+
+@router.post("/simulate")
+async def simulate_combat(request: CombatSimulateRequest, db: Session = Depends(get_db)):
+    """模拟一场战斗（不落库），include_rounds为true时附带逐回合日志"""
+    result = resolve_combat(_load_combatant(db, request.attacker), _load_combatant(db, request.defender))
+    response = result.summary()
+    if request.include_rounds:
+        response["combat_rounds"] = list(result.rounds(limit=MAX_ROUNDS_PER_PAGE))
+    return response
+
+@router.get("/records/{record_id}")
+async def get_combat_record(record_id: str, db: Session = Depends(get_db)):
+    """获取战斗记录摘要（不含逐回合日志）"""
+    record = db.query(CombatRecord).filter(CombatRecord.id == record_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="Combat record not found")
+
+    return {
+        "id": record.id,
+        "session_id": record.session_id,
+        "attacker_id": record.attacker_id,
+        "attacker_name": record.attacker_name,
+        "defender_id": record.defender_id,
+        "defender_name": record.defender_name,
+        "winner_id": record.winner_id,
+        "loser_id": record.loser_id,
+        "total_rounds": record.total_rounds,
+        "attacker_hp_after": record.attacker_hp_after,
+        "defender_hp_after": record.defender_hp_after,
+        "loser_removed": record.loser_removed,
+        "occurred_at": record.occurred_at
+    }
+
+@router.get("/records/{record_id}/rounds")
+async def get_combat_rounds(record_id: str, offset: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    """按需生成战斗记录的逐回合日志（根据战前状态直接计算，支持分页）"""
+    record = db.query(CombatRecord).filter(CombatRecord.id == record_id).first()
+    if not record:
+        raise HTTPException(status_code=404, detail="Combat record not found")
+
+    result = result_from_record(record)
+    limit = max(min(limit, MAX_ROUNDS_PER_PAGE), 0)
+    return {
+        "total_rounds": result.total_rounds,
+        "offset": offset,
+        "combat_rounds": list(result.rounds(offset, limit))
+    }
+
+@router.post("/balance/matchups")
+def simulate_matchups(request: MatchupRequest, db: Session = Depends(get_db)):
+    """NPC两两对战胜率矩阵（win_rates[i][j]为npcs[i]先手攻击npcs[j]的胜率；同步接口：模拟在线程池中执行）"""
+    return balance.simulate_matchups(
+        db, npc_ids=request.npc_ids, tier=request.tier,
+        trials=request.trials, variance=request.variance, seed=request.seed
+    )
+
+@router.post("/balance/scenes/{scene_id}")
+def simulate_scene_balance(scene_id: str, request: SceneBalanceRequest, db: Session = Depends(get_db)):
+    """模拟所有队伍组合挑战场景NPC阵容，并更新场景的难度/平衡评分（同步接口：模拟在线程池中执行）"""
+    if not db.query(Scene.id).filter(Scene.id == scene_id).first():
+        raise HTTPException(status_code=404, detail="Scene not found")
+
+    result = balance.simulate_scene(
+        db, scene_id, trials=request.trials, variance=request.variance,
+        party_size=request.party_size, npc_ids=request.npc_ids, seed=request.seed
+    )
+    if request.save:
+        balance.update_scene_analytics(db, result)
+        db.commit()
+    return result
@@ -0,0 +1,247 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from typing import List, Optional, Dict, Any
+from pydantic import BaseModel
+from core.database import get_db
+from core import dialogue_engine, pubsub, ai_orchestrator
+from core.dialogue_engine import SessionError
+from core.combat import Combatant
+from models import SessionStatus, SpeakerType
+
+import asyncio
+import json
+
+router = APIRouter(prefix="/dialogue", tags=["dialogue"])
+
+# 推送连接空闲时的心跳间隔（秒），防止代理断开长连接
+STREAM_HEARTBEAT = 15
+
+# Pydantic schemas
+class SessionCreate(BaseModel):
+    player_id: str
+    scene_id: str
+    scene_npcs: List[str] = []
+    player_npcs: List[str] = []
+
+class SpeechCreate(BaseModel):
+    speaker_type: SpeakerType
+    speaker_id: Optional[str] = None
+    speaker_name: Optional[str] = None
+    speech_text: str
+    is_player_choice: bool = False
+    available_options: List[Any] = []
+    selected_option: Optional[int] = None
+    hidden_effects: Dict[str, Any] = {}
+    combat_target: Optional[str] = None
+    stream_id: Optional[str] = None
+
+class SpeechPartial(BaseModel):
+    stream_id: str
+    delta: str
+    speaker_type: SpeakerType
+    speaker_id: Optional[str] = None
+    speaker_name: Optional[str] = None
+
+class RoundEnd(BaseModel):
+    story_progress: int = 0
+    dialogue_quality: int = 0
+    tension_level: int = 0
+    special_flags: List[str] = []
+    evaluation_result: str = "continue"
+    start_next: bool = True
+
+class CombatantStats(BaseModel):
+    id: str
+    name: str
+    strength: int
+    defense: int
+    hp: int
+
+class SessionCombat(BaseModel):
+    speech_id: str
+    attacker: CombatantStats
+    defender: CombatantStats
+    loser_removed: bool = True
+    scene_impact: Dict[str, Any] = {}
+
+class SessionEnd(BaseModel):
+    status: SessionStatus = SessionStatus.COMPLETED
+    final_result: Optional[str] = None
+
+def _call(function, *args, **kwargs):
+    """引擎的SessionError统一转换：会话不存在为404，其余为400"""
+    try:
+        return function(*args, **kwargs)
+    except SessionError as e:
+        status_code = 404 if "not found" in str(e) else 400
+        raise HTTPException(status_code=status_code, detail=str(e))
+
+@router.post("/sessions")
+def create_session(request: SessionCreate, db: Session = Depends(get_db)):
+    """创建对话会话并开始第一轮（同步接口：在线程池中执行，并发创建时等待数据库连接不会阻塞事件循环）"""
+    state = _call(dialogue_engine.create_session, db, request.player_id, request.scene_id,
+                  request.scene_npcs, request.player_npcs)
+    return state.to_dict()
+
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """进行中会话的当前状态（内存读取）"""
+    state = dialogue_engine.get_session(session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Active dialogue session not found")
+    with state.lock:
+        return state.to_dict()
+
+@router.post("/sessions/{session_id}/speeches")
+async def add_speech(session_id: str, request: SpeechCreate):
+    """记录一次发言（写入内存和缓冲区，不同步落库）"""
+    return _call(dialogue_engine.add_speech, session_id, request.speaker_type, request.speaker_id,
+                 request.speaker_name, request.speech_text, is_player_choice=request.is_player_choice,
+                 available_options=request.available_options, selected_option=request.selected_option,
+                 hidden_effects=request.hidden_effects, combat_target=request.combat_target,
+                 stream_id=request.stream_id)
+
+@router.post("/sessions/{session_id}/partials")
+async def stream_partial(session_id: str, request: SpeechPartial):
+    """推送AI生成中的增量文本（只推送给订阅者，完整发言仍通过speeches记录）"""
+    _call(dialogue_engine.stream_partial, session_id, request.stream_id, request.delta,
+          request.speaker_type, request.speaker_id, request.speaker_name)
+    return {"ok": True}
+
+@router.post("/sessions/{session_id}/rounds/end")
+async def end_round(session_id: str, request: RoundEnd):
+    """记录本轮评分并结束本轮，本轮数据由后台批量落库"""
+    return _call(dialogue_engine.end_round, session_id, request.story_progress, request.dialogue_quality,
+                 request.tension_level, request.special_flags, request.evaluation_result, request.start_next)
+
+@router.post("/sessions/{session_id}/npcs/{npc_id}/remove")
+async def remove_npc(session_id: str, npc_id: str):
+    """NPC退场"""
+    return _call(dialogue_engine.remove_npc, session_id, npc_id)
+
+@router.post("/sessions/{session_id}/combat")
+def session_combat(session_id: str, request: SessionCombat):
+    """在会话中结算战斗，败者退场（同步接口：校验speech_id可能查询数据库）"""
+    result = _call(
+        dialogue_engine.record_combat, session_id, request.speech_id,
+        Combatant(**request.attacker.dict()), Combatant(**request.defender.dict()),
+        loser_removed=request.loser_removed, scene_impact=request.scene_impact
+    )
+    return result.summary()
+
+@router.post("/sessions/{session_id}/orchestrate")
+async def orchestrate_step(session_id: str):
+    """
+    由场景AI智能体推进对话：生成连续的场景NPC发言，直到轮到玩家（返回话术选项）或本轮结束（评分并结束本轮）
+    该会话已有一步在执行时返回409；智能体配置无效（如循环依赖）时返回400；
+    必需的智能体失败或超时时返回502，detail中包含已完成部分的结果
+    """
+    try:
+        return await ai_orchestrator.run_step(session_id)
+    except ai_orchestrator.StepInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ai_orchestrator.AgentConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except SessionError as e:
+        status_code = 404 if "not found" in str(e) else 400
+        raise HTTPException(status_code=status_code, detail=str(e))
+    except ai_orchestrator.OrchestrationError as e:
+        raise HTTPException(status_code=502, detail={"message": str(e), "result": e.result})
+
+@router.post("/sessions/{session_id}/end")
+def end_session(session_id: str, request: SessionEnd):
+    """结束会话（同步落库并释放内存状态；同步接口，落库在线程池中执行，不阻塞事件循环）"""
+    return _call(dialogue_engine.end_session, session_id, request.status, request.final_result)
+
+def _subscribe(session_id: str, last_event_id: Optional[str]):
+    """订阅会话事件并取当前状态快照（先订阅后取快照，避免漏掉两者之间的事件）"""
+    try:
+        after = int(last_event_id) if last_event_id else None
+    except ValueError:
+        after = None
+    subscription = pubsub.broker.subscribe(session_id, after)
+    state = dialogue_engine.get_session(session_id)
+    if state is None:
+        subscription.close()
+        return None, None
+    with state.lock:
+        snapshot = state.to_dict()
+    return subscription, snapshot
+
+@router.get("/sessions/{session_id}/stream")
+async def stream_session(session_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events：实时推送会话事件
+    speech（完整发言）、token（AI增量文本）、round_end、npc_removed、combat、dice、session_end
+    断线重连时浏览器自动携带Last-Event-ID，从最近的事件历史中补发
+    """
+    subscription, snapshot = _subscribe(session_id, last_event_id)
+    if subscription is None:
+        raise HTTPException(status_code=404, detail="Active dialogue session not found")
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            yield f"event: state\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            while True:
+                try:
+                    event = await subscription.get(timeout=STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    if subscription.lagged:
+                        yield "event: lagged\ndata: {}\n\n"
+                    break
+                yield event.sse()
+                if event.event == "session_end":
+                    break
+        finally:
+            subscription.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+async def _receive_until_disconnect(websocket: WebSocket):
+    """客户端只接收推送，读取并丢弃客户端消息以便及时发现断开"""
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+@router.websocket("/sessions/{session_id}/ws")
+async def session_websocket(websocket: WebSocket, session_id: str, last_event_id: Optional[str] = None):
+    """WebSocket：推送内容与SSE相同，每条消息为{"id", "event", "data"}"""
+    subscription, snapshot = _subscribe(session_id, last_event_id)
+    if subscription is None:
+        await websocket.close(code=4404)
+        return
+
+    await websocket.accept()
+    receiver = asyncio.create_task(_receive_until_disconnect(websocket))
+    try:
+        await websocket.send_json({"id": None, "event": "state", "data": snapshot})
+        while not receiver.done():
+            try:
+                event = await subscription.get(timeout=STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                await websocket.send_json({"id": None, "event": "ping", "data": {}})
+                continue
+            if event is None:
+                if subscription.lagged:
+                    await websocket.send_json({"id": None, "event": "lagged", "data": {}})
+                break
+            await websocket.send_text(event.json())
+            if event.event == "session_end":
+                break
+        if not receiver.done():
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        subscription.close()
@@ -0,0 +1,131 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional, List
+from pydantic import BaseModel, Field
+from core.database import get_db
+from core import dice, dialogue_engine
+from models import DialogueSession, PlayerNPCInstance, SceneAIConfiguration
+
+router = APIRouter(prefix="/dice", tags=["dice"])
+
+# 管理后台默认展示的骰子数量范围（INT 1-20）
+DEFAULT_TABLE_DICE = 20
+
+# Pydantic schemas
+class DiceRollRequest(BaseModel):
+    seed: Optional[int] = None                  # 指定种子可复现结果，默认随机生成
+    player_npc_ids: Optional[List[str]] = None  # 参与投掷的玩家NPC，默认会话中未退场的玩家NPC
+    dice_bonus: int = Field(0, ge=0, le=dice.MAX_TABLE_DICE)  # 卡片提供的额外骰子
+    min_successes: int = Field(0, ge=0)         # 保底成功数
+
+def _check_face(success_face: int):
+    if not 1 <= success_face <= dice.DICE_FACES:
+        raise HTTPException(status_code=400, detail=f"success_face must be between 1 and {dice.DICE_FACES}")
+
+@router.get("/odds")
+async def get_dice_odds(
+    dice_count: int = Query(..., ge=0, le=dice.MAX_TABLE_DICE),
+    required: int = Query(..., ge=0),
+    success_face: int = dice.DEFAULT_SUCCESS_FACE,
+    min_successes: int = Query(0, ge=0)
+):
+    """单个骰子数量的成功概率和成功数分布"""
+    _check_face(success_face)
+    return {
+        "dice_count": dice_count,
+        "required": required,
+        "success_face": success_face,
+        "probability": dice.success_probability(dice_count, required, success_face, min_successes),
+        "distribution": dice.success_distribution(dice_count, success_face)
+    }
+
+@router.get("/table")
+async def get_dice_table(
+    required: int = Query(..., ge=0),
+    success_face: int = dice.DEFAULT_SUCCESS_FACE,
+    min_dice: int = Query(1, ge=0),
+    max_dice: int = Query(DEFAULT_TABLE_DICE, ge=0, le=dice.MAX_TABLE_DICE),
+    min_successes: int = Query(0, ge=0)
+):
+    """按骰子数量列出成功概率（查表，供管理后台实时展示）"""
+    _check_face(success_face)
+    return {
+        "required": required,
+        "success_face": success_face,
+        "odds": dice.odds_table(required, range(min_dice, max_dice + 1), success_face, min_successes)
+    }
+
+@router.get("/scenes/{scene_id}/odds")
+async def get_scene_dice_odds(
+    scene_id: str,
+    min_dice: int = Query(1, ge=0),
+    max_dice: int = Query(DEFAULT_TABLE_DICE, ge=0, le=dice.MAX_TABLE_DICE),
+    db: Session = Depends(get_db)
+):
+    """按场景AI配置中的成功条件（dice_required/dice_success_face）列出成功概率"""
+    ai_config = db.query(SceneAIConfiguration).filter(SceneAIConfiguration.scene_id == scene_id).first()
+    if not ai_config:
+        raise HTTPException(status_code=404, detail="Scene AI configuration not found")
+
+    settings = dice.scene_dice_settings(ai_config.success_criteria)
+    _check_face(settings["success_face"])
+    return {
+        "scene_id": scene_id,
+        **settings,
+        "odds": dice.odds_table(settings["required"], range(min_dice, max_dice + 1), settings["success_face"])
+    }
+
+@router.post("/sessions/{session_id}/roll")
+async def roll_session_dice(session_id: str, request: DiceRollRequest, db: Session = Depends(get_db)):
+    """
+    为对话会话投掷骰子：骰子数 = 参与玩家NPC当前智力之和 + 额外骰子，
+    成功条件取场景AI配置，结果（含种子）写入DialogueSession.dice_result
+    进行中的会话通过对话引擎读取和记录（随会话状态一起落库）
+    """
+    session = dialogue_engine.get_session(session_id, db) or \
+        db.query(DialogueSession).filter(DialogueSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Dialogue session not found")
+    if session.dice_result:
+        raise HTTPException(status_code=409, detail="Dice already rolled for this session")
+
+    removed = set(session.npcs_removed or [])
+    npc_ids = request.player_npc_ids or [npc_id for npc_id in (session.player_npcs or []) if npc_id not in removed]
+    instances = db.query(PlayerNPCInstance).filter(PlayerNPCInstance.id.in_(npc_ids)).all() if npc_ids else []
+    missing = set(npc_ids) - {instance.id for instance in instances}
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Player NPCs not found: {', '.join(sorted(missing))}")
+
+    ai_config = db.query(SceneAIConfiguration).filter(SceneAIConfiguration.scene_id == session.scene_id).first()
+    settings = dice.scene_dice_settings(ai_config.success_criteria if ai_config else None)
+    _check_face(settings["success_face"])
+
+    dice_count = sum(instance.current_intelligence for instance in instances) + request.dice_bonus
+    if dice_count > dice.MAX_TABLE_DICE:
+        raise HTTPException(status_code=400, detail=f"dice_count {dice_count} exceeds the maximum of {dice.MAX_TABLE_DICE}")
+    result = dice.roll(
+        dice_count, settings["required"], success_face=settings["success_face"],
+        seed=request.seed, min_successes=request.min_successes
+    )
+    result["player_npc_ids"] = [instance.id for instance in instances]
+    result["dice_bonus"] = request.dice_bonus
+
+    if isinstance(session, dialogue_engine.SessionState):
+        dialogue_engine.record_dice(session_id, result)
+    else:
+        session.dice_triggered = True
+        session.dice_result = result
+        db.commit()
+    return result
+
+@router.get("/sessions/{session_id}/verify")
+async def verify_session_dice(session_id: str, db: Session = Depends(get_db)):
+    """用记录的种子复现骰子结果，校验记录未被篡改"""
+    session = dialogue_engine.get_session(session_id, db) or \
+        db.query(DialogueSession).filter(DialogueSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Dialogue session not found")
+    if not session.dice_result:
+        raise HTTPException(status_code=404, detail="No dice result recorded for this session")
+
+    return {"session_id": session_id, "valid": dice.verify(session.dice_result), "dice_result": session.dice_result}
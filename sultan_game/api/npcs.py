@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from core.database import get_db
+from core import rewards, prompt_builder
 from models import NPC, NPCType, Tier, Faction
 import uuid
 import time
@@ -56,6 +57,22 @@ class NPCResponse(NPCBase):
     class Config:
         from_attributes = True
 
+class DropRollRequest(BaseModel):
+    seed: Optional[int] = None
+    rolls: int = Field(10000, ge=1, le=rewards.MAX_SIMULATION_ROLLS)  # 仅模拟时使用
+
+def validate_npc_attributes(npc: NPCBase) -> Optional[str]:
+    """验证NPC核心属性范围，返回错误信息，合法时返回None"""
+    if not (1 <= npc.intelligence <= 20):
+        return "Intelligence must be between 1 and 20"
+    if not (1 <= npc.strength <= 100):
+        return "Strength must be between 1 and 100"
+    if not (1 <= npc.defense <= 100):
+        return "Defense must be between 1 and 100"
+    if not (1 <= npc.hp_max <= 500):
+        return "HP must be between 1 and 500"
+    return None
+
 @router.get("/", response_model=List[NPCResponse])
 async def get_npcs(
     skip: int = 0,
@@ -113,14 +130,9 @@ async def create_npc(npc: NPCCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="NPC ID already exists")
     
     # 验证属性值范围
-    if not (1 <= npc.intelligence <= 20):
-        raise HTTPException(status_code=400, detail="Intelligence must be between 1 and 20")
-    if not (1 <= npc.strength <= 100):
-        raise HTTPException(status_code=400, detail="Strength must be between 1 and 100")
-    if not (1 <= npc.defense <= 100):
-        raise HTTPException(status_code=400, detail="Defense must be between 1 and 100")
-    if not (1 <= npc.hp_max <= 500):
-        raise HTTPException(status_code=400, detail="HP must be between 1 and 500")
+    attribute_error = validate_npc_attributes(npc)
+    if attribute_error:
+        raise HTTPException(status_code=400, detail=attribute_error)
     
     # 创建NPC
     db_npc = NPC(
@@ -153,6 +165,7 @@ async def create_npc(npc: NPCCreate, db: Session = Depends(get_db)):
     db.add(db_npc)
     db.commit()
     db.refresh(db_npc)
+    rewards.invalidate_pools()
     
     npc_dict = db_npc.__dict__.copy()
     npc_dict['npc_type'] = db_npc.npc_type.value
@@ -185,6 +198,9 @@ async def update_npc(npc_id: str, npc_update: NPCUpdate, db: Session = Depends(g
     db_npc.updated_at = int(time.time())
     db.commit()
     db.refresh(db_npc)
+    rewards.invalidate_pools()
+    rewards.invalidate_npc(npc_id)
+    prompt_builder.invalidate_npc(npc_id)
     
     npc_dict = db_npc.__dict__.copy()
     npc_dict['npc_type'] = db_npc.npc_type.value
@@ -204,6 +220,8 @@ async def delete_npc(npc_id: str, db: Session = Depends(get_db)):
     db_npc.is_active = False
     db_npc.updated_at = int(time.time())
     db.commit()
+    rewards.invalidate_pools()
+    rewards.invalidate_npc(npc_id)
     
     return {"message": "NPC deleted successfully"}
 
@@ -258,4 +276,27 @@ async def get_npc_enums():
         "npc_types": [e.value for e in NPCType],
         "tiers": [e.value for e in Tier],
         "factions": [e.value for e in Faction]
-    }
\ No newline at end of file
+    }
+
+@router.post("/{npc_id}/drops/roll")
+def roll_npc_drops(npc_id: str, request: DropRollRequest, db: Session = Depends(get_db)):
+    """结算一次NPC战败掉落（GameNPCConfig），结果带种子可复现（同步接口，在线程池中执行）"""
+    if not db.query(NPC.id).filter(NPC.id == npc_id).first():
+        raise HTTPException(status_code=404, detail="NPC not found")
+    try:
+        return rewards.roll(db, rewards.get_npc_table(db, npc_id), seed=request.seed)
+    except rewards.RewardConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/{npc_id}/drops/simulate")
+def simulate_npc_drops(npc_id: str, request: DropRollRequest, db: Session = Depends(get_db)):
+    """
+    批量模拟NPC战败掉落，返回各物品的掉落率和平均数量
+    同步接口：最多MAX_SIMULATION_ROLLS次抽取和数据库查询在线程池中执行，不阻塞事件循环上的推送流
+    """
+    if not db.query(NPC.id).filter(NPC.id == npc_id).first():
+        raise HTTPException(status_code=404, detail="NPC not found")
+    try:
+        return rewards.simulate(db, rewards.get_npc_table(db, npc_id), request.rolls, seed=request.seed)
+    except rewards.RewardConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
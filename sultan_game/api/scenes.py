@@ -1,18 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, type_coerce
+from sqlalchemy.orm import Session, joinedload, selectinload
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
-from core.database import get_db
+from pydantic import BaseModel, Field
+from core.database import get_db, EnumValue
 from core.logging_config import get_logger, log_database_operation
+from core import scene_graph, requirement_engine, prompt_builder
+from core import rewards as reward_engine
+from core.formula import FormulaError
 from models import (
     Scene, SceneCategory, SceneStatus, TimeOfDay, SceneAIConfiguration,
-    SceneRequirement, RequirementType, ComparisonOperator,
+    SceneNPCConfiguration, SceneRequirement, RequirementType, ComparisonOperator,
     SceneCardBinding, SceneRewardExtended, PlayerNPCReward, CardReward,
     Card, PlayerNPCInstance
 )
 import uuid
 import time
-import json
 
 router = APIRouter(prefix="/scenes", tags=["scenes"])
 logger = get_logger(__name__)
@@ -82,20 +85,62 @@ class SceneConfigResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# 场景响应所需的列（列投影，读取接口不再加载完整的Scene ORM对象）
+# 枚举列通过EnumValue直接解码为字符串值，prerequisite_scenes由JSONText列类型解码
+SCENE_RESPONSE_COLUMNS = (
+    Scene.id, Scene.scene_id, Scene.name,
+    type_coerce(Scene.category, EnumValue(SceneCategory)).label("category"),
+    Scene.chapter, Scene.description, Scene.background_image, Scene.background_music,
+    Scene.location,
+    type_coerce(Scene.time_of_day, EnumValue(TimeOfDay)).label("time_of_day"),
+    Scene.weather, Scene.card_count, Scene.prerequisite_scenes, Scene.days_required,
+    type_coerce(Scene.status, EnumValue(SceneStatus)).label("status"),
+    Scene.is_active, Scene.created_at, Scene.updated_at
+)
+SCENE_RESPONSE_FIELDS = tuple(column.key for column in SCENE_RESPONSE_COLUMNS) + ("npc_count",)
+
+def _scene_response_query(db: Session):
+    """
+    场景响应查询：列投影 + NPC数量
+    NPC数量来自按scene_id GROUP BY的聚合子查询，外连接到场景上，
+    无论分页大小都只需一次数据库往返
+    """
+    npc_counts = db.query(
+        SceneNPCConfiguration.scene_id,
+        func.count(SceneNPCConfiguration.id).label("npc_count")
+    ).group_by(SceneNPCConfiguration.scene_id).subquery()
+    
+    return db.query(
+        *SCENE_RESPONSE_COLUMNS,
+        func.coalesce(npc_counts.c.npc_count, 0)
+    ).outerjoin(npc_counts, npc_counts.c.scene_id == Scene.id)
+
+def _scene_to_response(row) -> dict:
+    """将_scene_response_query返回的Row转换为SceneResponse字段字典"""
+    scene_dict = dict(zip(SCENE_RESPONSE_FIELDS, row))
+    scene_dict['status'] = scene_dict['status'] or 'draft'
+    scene_dict['prerequisite_scenes'] = scene_dict['prerequisite_scenes'] or []
+    return scene_dict
+
+def _load_scene_response(db: Session, scene_id: str) -> Optional[dict]:
+    """按主键读取单个场景的响应数据"""
+    row = _scene_response_query(db).filter(Scene.id == scene_id).first()
+    return _scene_to_response(row) if row else None
+
 @router.get("/list-all")
 async def get_all_scenes_list(db: Session = Depends(get_db)):
     """获取所有场景的简要信息，用于前置场景选择"""
-    scenes = db.query(Scene).filter(Scene.is_active == True).all()
+    scenes = db.query(
+        Scene.scene_id, Scene.name,
+        type_coerce(Scene.category, EnumValue(SceneCategory)).label("category")
+    ).filter(Scene.is_active == True).all()
     
-    result = []
-    for scene in scenes:
-        result.append({
-            "scene_id": scene.scene_id,
-            "name": scene.name,
-            "category": scene.category.value if scene.category else None
-        })
-    
-    return result
+    return [scene._asdict() for scene in scenes]
+
+@router.get("/prerequisite-graph")
+async def get_prerequisite_graph(db: Session = Depends(get_db)):
+    """获取整张前置场景关系图 {scene_id: [前置scene_id...]}，用于场景地图渲染"""
+    return scene_graph.get_graph(db)
 
 @router.get("/", response_model=List[SceneResponse])
 async def get_scenes(
@@ -106,46 +151,35 @@ async def get_scenes(
     db: Session = Depends(get_db)
 ):
     """获取场景列表"""
-    query = db.query(Scene).filter(Scene.is_active == True)
+    query = _scene_response_query(db).filter(Scene.is_active == True)
     
     if category:
-        query = query.filter(Scene.category == category)
+        query = query.filter(Scene.category == SceneCategory(category))
     
     if status:
         query = query.filter(Scene.status == SceneStatus(status))
     
     scenes = query.offset(skip).limit(limit).all()
     
-    # 为每个场景添加NPC数量
-    result = []
-    for scene in scenes:
-        scene_dict = scene.__dict__.copy()
-        scene_dict['npc_count'] = 0  # 暂时简化，不计算NPC数量
-        scene_dict['status'] = scene.status.value if scene.status else 'draft'
-        scene_dict['category'] = scene.category.value if scene.category else None
-        scene_dict['time_of_day'] = scene.time_of_day.value if scene.time_of_day else None
-        scene_dict['prerequisite_scenes'] = json.loads(scene_dict.get('prerequisite_scenes', '[]'))
-        scene_dict['id'] = str(scene.id)  # 转换为字符串
-        result.append(SceneResponse(**scene_dict))
-    
-    return result
+    # 返回字典，由response_model统一校验一次
+    return [_scene_to_response(scene) for scene in scenes]
+
+@router.get("/eligibility")
+async def get_player_scene_eligibility(player_id: str, db: Session = Depends(get_db)):
+    """一个玩家对所有活跃场景的进入条件评估 {scene_id: {eligible, failed, warnings}}"""
+    results = requirement_engine.evaluate_player(db, player_id)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    return results
 
 @router.get("/{scene_id}", response_model=SceneResponse)
 async def get_scene(scene_id: str, db: Session = Depends(get_db)):
     """获取单个场景详情"""
-    scene = db.query(Scene).filter(Scene.id == scene_id).first()
+    scene = _load_scene_response(db, scene_id)
     if not scene:
         raise HTTPException(status_code=404, detail="Scene not found")
     
-    scene_dict = scene.__dict__.copy()
-    scene_dict['npc_count'] = 0  # 暂时简化，不计算NPC数量
-    scene_dict['status'] = scene.status.value if scene.status else 'draft'
-    scene_dict['category'] = scene.category.value if scene.category else None
-    scene_dict['time_of_day'] = scene.time_of_day.value if scene.time_of_day else None
-    scene_dict['prerequisite_scenes'] = json.loads(scene_dict.get('prerequisite_scenes', '[]'))
-    scene_dict['id'] = str(scene.id)  # 转换为字符串
-    
-    return SceneResponse(**scene_dict)
+    return scene
 
 @router.post("/", response_model=SceneResponse)
 async def create_scene(scene: SceneCreate, db: Session = Depends(get_db)):
@@ -172,7 +206,6 @@ async def create_scene(scene: SceneCreate, db: Session = Depends(get_db)):
             time_of_day=TimeOfDay(scene.time_of_day) if scene.time_of_day else None,
             weather=scene.weather,
             card_count=scene.card_count,
-            prerequisite_scenes=json.dumps(scene.prerequisite_scenes),
             days_required=scene.days_required,
             status=SceneStatus.DRAFT,
             is_active=True,
@@ -181,6 +214,11 @@ async def create_scene(scene: SceneCreate, db: Session = Depends(get_db)):
         )
         
         db.add(db_scene)
+        db.flush()
+        try:
+            scene_graph.set_prerequisites(db, db_scene, scene.prerequisite_scenes)
+        except scene_graph.PrerequisiteError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         db.commit()
         db.refresh(db_scene)
         
@@ -206,14 +244,7 @@ async def create_scene(scene: SceneCreate, db: Session = Depends(get_db)):
     #     db.add(ai_config)
     #     db.commit()
     
-    scene_dict = db_scene.__dict__.copy()
-    scene_dict['npc_count'] = 0
-    scene_dict['status'] = 'draft'
-    scene_dict['category'] = scene.category
-    scene_dict['prerequisite_scenes'] = json.loads(scene_dict.get('prerequisite_scenes', '[]'))
-    scene_dict['id'] = str(db_scene.id)
-    
-    return SceneResponse(**scene_dict)
+    return _load_scene_response(db, db_scene.id)
 
 @router.put("/{scene_id}", response_model=SceneResponse)
 async def update_scene(scene_id: str, scene_update: SceneUpdate, db: Session = Depends(get_db)):
@@ -226,22 +257,20 @@ async def update_scene(scene_id: str, scene_update: SceneUpdate, db: Session = D
     for field, value in scene_update.dict(exclude_unset=True).items():
         if field == "status":
             setattr(db_scene, field, SceneStatus(value))
+        elif field == "prerequisite_scenes":
+            try:
+                scene_graph.set_prerequisites(db, db_scene, value)
+            except scene_graph.PrerequisiteError as e:
+                db.rollback()
+                raise HTTPException(status_code=400, detail=str(e))
         else:
             setattr(db_scene, field, value)
     
     db_scene.updated_at = int(time.time())
     db.commit()
-    db.refresh(db_scene)
-    
-    scene_dict = db_scene.__dict__.copy()
-    scene_dict['npc_count'] = 0  # 暂时简化，不计算NPC数量
-    scene_dict['status'] = db_scene.status.value if db_scene.status else 'draft'
-    scene_dict['category'] = db_scene.category.value if db_scene.category else None
-    scene_dict['time_of_day'] = db_scene.time_of_day.value if db_scene.time_of_day else None
-    scene_dict['prerequisite_scenes'] = json.loads(scene_dict.get('prerequisite_scenes', '[]'))
-    scene_dict['id'] = str(db_scene.id)  # 转换为字符串
+    prompt_builder.invalidate(scene_id)
     
-    return SceneResponse(**scene_dict)
+    return _load_scene_response(db, scene_id)
 
 @router.delete("/{scene_id}")
 async def delete_scene(scene_id: str, db: Session = Depends(get_db)):
@@ -305,11 +334,12 @@ async def get_scene_npcs(scene_id: str, db: Session = Depends(get_db)):
     if not scene:
         raise HTTPException(status_code=404, detail="Scene not found")
     
-    # 查询真实的场景NPC绑定关系
-    from models import SceneNPCConfiguration, NPC
-    scene_npcs = db.query(SceneNPCConfiguration).filter(
+    # 查询真实的场景NPC绑定关系，NPC随同一条JOIN语句加载
+    scene_npcs = db.query(SceneNPCConfiguration).options(
+        joinedload(SceneNPCConfiguration.npc, innerjoin=True)
+    ).filter(
         SceneNPCConfiguration.scene_id == scene_id
-    ).join(NPC, SceneNPCConfiguration.npc_id == NPC.id).all()
+    ).all()
     
     # 返回场景NPC配置列表
     result = []
@@ -317,7 +347,7 @@ async def get_scene_npcs(scene_id: str, db: Session = Depends(get_db)):
         result.append({
             "id": scene_npc.id,
             "npc_id": scene_npc.npc_id,
-            "name": scene_npc.npc.name if hasattr(scene_npc, 'npc') else "Unknown NPC",
+            "name": scene_npc.npc.name,
             "role": scene_npc.role,
             "behavior": scene_npc.special_behavior,
             "speaking_priority": scene_npc.speaking_order_priority,
@@ -392,6 +422,7 @@ async def save_scene_rewards(scene_id: str, rewards: dict, db: Session = Depends
     scene.updated_at = int(time.time())
     db.commit()
     db.refresh(reward_config)
+    reward_engine.invalidate(scene_id)
     
     return {"message": "Scene rewards saved successfully", "data": rewards}
 
@@ -522,6 +553,7 @@ async def save_scene_requirements(
             db.add(db_requirement)
     
     db.commit()
+    requirement_engine.invalidate(scene_id)
     
     return {"message": "Scene attribute requirements saved successfully"}
 
@@ -545,16 +577,18 @@ async def get_scene_card_bindings(scene_id: str, db: Session = Depends(get_db)):
     if not scene:
         raise HTTPException(status_code=404, detail="Scene not found")
     
-    bindings = db.query(SceneCardBinding).filter(
+    bindings = db.query(SceneCardBinding).options(
+        joinedload(SceneCardBinding.card, innerjoin=True)
+    ).filter(
         SceneCardBinding.scene_id == scene_id
-    ).join(Card, SceneCardBinding.card_id == Card.id).all()
+    ).all()
     
     result = []
     for binding in bindings:
         result.append({
             "id": binding.id,
             "card_id": binding.card_id,
-            "card_name": binding.card.name if hasattr(binding, 'card') else "Unknown Card",
+            "card_name": binding.card.name,
             "binding_type": binding.binding_type,
             "max_uses_per_scene": binding.max_uses_per_scene,
             "cooldown_rounds": binding.cooldown_rounds,
@@ -784,6 +818,7 @@ async def save_scene_extended_rewards(
     scene.updated_at = int(time.time())
     db.commit()
     db.refresh(reward_config)
+    reward_engine.invalidate(scene_id)
     
     return {"message": "Scene extended rewards saved successfully"}
 
@@ -810,17 +845,20 @@ async def get_available_cards(db: Session = Depends(get_db)):
 @router.get("/available-player-npcs")
 async def get_available_player_npcs(db: Session = Depends(get_db)):
     """获取可用玩家NPC列表"""
-    npcs = db.query(PlayerNPCInstance).all()
+    # 基础NPC通过selectinload批量加载（固定一条额外的IN查询）
+    npcs = db.query(PlayerNPCInstance).options(
+        selectinload(PlayerNPCInstance.npc)
+    ).all()
     
     result = []
     for npc in npcs:
         result.append({
             "id": npc.id,
-            "name": npc.current_name,
+            "name": npc.npc.name if npc.npc else "Unknown NPC",
             "tier": npc.npc.tier.value if npc.npc else "unknown",
             "faction": npc.npc.faction.value if npc.npc else "unknown",
-            "level": npc.current_level,
-            "status": npc.status
+            "level": npc.level,
+            "status": "alive" if npc.is_alive else "dead"
         })
     
     return result
@@ -841,7 +879,7 @@ async def get_scene_display_config(scene_id: str, db: Session = Depends(get_db))
     
     return {
         "card_count": scene.card_count or 0,
-        "prerequisite_scenes": json.loads(scene.prerequisite_scenes or '[]'),
+        "prerequisite_scenes": scene.prerequisite_scenes or [],
         "days_required": scene.days_required or 0
     }
 
@@ -856,19 +894,14 @@ async def save_scene_display_config(
     if not scene:
         raise HTTPException(status_code=404, detail="Scene not found")
     
-    # 验证前置场景ID的有效性
-    if config.prerequisite_scenes:
-        for prereq_scene_id in config.prerequisite_scenes:
-            prereq_scene = db.query(Scene).filter(Scene.scene_id == prereq_scene_id).first()
-            if not prereq_scene:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Prerequisite scene '{prereq_scene_id}' not found"
-                )
+    # 验证前置场景（一次查询 + 环检测）并更新前置关系索引
+    try:
+        scene_graph.set_prerequisites(db, scene, config.prerequisite_scenes)
+    except scene_graph.PrerequisiteError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # 更新场景展示配置
     scene.card_count = config.card_count
-    scene.prerequisite_scenes = json.dumps(config.prerequisite_scenes)
     scene.days_required = config.days_required
     scene.updated_at = int(time.time())
     
@@ -879,7 +912,73 @@ async def save_scene_display_config(
         "message": "Scene display configuration saved successfully",
         "data": {
             "card_count": scene.card_count,
-            "prerequisite_scenes": json.loads(scene.prerequisite_scenes or '[]'),
+            "prerequisite_scenes": scene.prerequisite_scenes or [],
             "days_required": scene.days_required
         }
-    }
\ No newline at end of file
+    }
+# === 前置场景关系查询 ===
+
+def _ensure_scene_exists(db: Session, scene_id: str):
+    if not db.query(Scene.id).filter(Scene.id == scene_id).first():
+        raise HTTPException(status_code=404, detail="Scene not found")
+
+@router.get("/{scene_id}/unlocks")
+async def get_scene_unlocks(
+    scene_id: str,
+    completed: Optional[List[str]] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """
+    完成该场景后解锁的场景
+    传入completed（已完成场景的业务scene_id列表，与prerequisite-graph一致；也接受场景ID）时只返回所有前置都已满足的场景
+    """
+    _ensure_scene_exists(db, scene_id)
+    return scene_graph.get_unlocks(scene_id, completed=completed, db=db)
+
+@router.get("/{scene_id}/ancestors")
+async def get_scene_ancestors(scene_id: str, db: Session = Depends(get_db)):
+    """该场景的完整前置链（按可完成顺序排列）"""
+    _ensure_scene_exists(db, scene_id)
+    return scene_graph.get_ancestors(scene_id, db=db)
+
+@router.get("/{scene_id}/eligibility")
+async def get_scene_eligibility(
+    scene_id: str,
+    player_ids: Optional[List[str]] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """多个玩家（默认所有活跃玩家）对该场景的进入条件评估 {player_id: {eligible, failed, warnings}}"""
+    _ensure_scene_exists(db, scene_id)
+    return requirement_engine.evaluate_scene(db, scene_id, player_ids)
+
+# === 奖励结算 ===
+
+class RewardRollRequest(BaseModel):
+    seed: Optional[int] = None                 # 指定种子可复现结果
+    context: Optional[Dict[str, Any]] = None   # dynamic_reward_formula的求值变量
+
+class RewardSimulationRequest(RewardRollRequest):
+    rolls: int = Field(10000, ge=1, le=reward_engine.MAX_SIMULATION_ROLLS)
+
+@router.post("/{scene_id}/rewards/roll")
+def roll_scene_rewards(scene_id: str, request: RewardRollRequest, db: Session = Depends(get_db)):
+    """结算一次场景成功奖励（随机卡片/NPC按别名表抽取，结果带种子可复现；同步接口，在线程池中执行）"""
+    _ensure_scene_exists(db, scene_id)
+    try:
+        return reward_engine.roll(db, reward_engine.get_scene_table(db, scene_id), seed=request.seed, context=request.context)
+    except (FormulaError, reward_engine.RewardConfigError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/{scene_id}/rewards/simulate")
+def simulate_scene_rewards(scene_id: str, request: RewardSimulationRequest, db: Session = Depends(get_db)):
+    """
+    批量模拟场景奖励，返回各物品的掉落率和平均数量
+    同步接口：最多MAX_SIMULATION_ROLLS次抽取和数据库查询在线程池中执行，不阻塞事件循环上的推送流
+    """
+    _ensure_scene_exists(db, scene_id)
+    try:
+        return reward_engine.simulate(
+            db, reward_engine.get_scene_table(db, scene_id), request.rolls, seed=request.seed, context=request.context
+        )
+    except (FormulaError, reward_engine.RewardConfigError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,68 @@
+"""
+公式引擎性能基准
+测量 core.formula 编译（冷/缓存命中）和求值的吞吐量（每毫秒求值次数）
+
+用法（在 sultan_game 目录下）：
+    python benchmarks/bench_formula.py --evaluations 200000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.formula import compile_formula
+
+FORMULAS = [
+    "strength + 5",
+    "intelligence * 1.5 + charisma / 2",
+    "max(10, npc.strength * 1.5) if game_day > 3 else 5",
+    "clamp(reputation / 10, 0, 20) + party.count * 2",
+    "strength >= 12 and factions.minister > 20 or flags.has_seal == 1",
+    "floor(sqrt(hp) * 2) - abs(loyalty - 50) // 10",
+]
+
+CONTEXT = {
+    "strength": 14, "intelligence": 12, "charisma": 40, "loyalty": 55, "hp": 120,
+    "reputation": 85, "game_day": 6,
+    "npc": {"strength": 14},
+    "party": {"count": 3},
+    "factions": {"minister": 25},
+    "flags": {"has_seal": 1},
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="公式引擎性能基准")
+    parser.add_argument("--evaluations", type=int, default=200000, help="每个公式的求值次数")
+    args = parser.parse_args()
+
+    compile_formula.cache_clear()
+    start = time.perf_counter()
+    for source in FORMULAS:
+        compile_formula(source)
+    cold = (time.perf_counter() - start) / len(FORMULAS)
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        for source in FORMULAS:
+            compile_formula(source)
+    cached = (time.perf_counter() - start) / (1000 * len(FORMULAS))
+
+    print(f"编译: 首次 {cold * 1e6:.1f}us/公式, 缓存命中 {cached * 1e6:.2f}us/公式")
+    print(f"{'公式':<70} {'结果':>10} {'次/毫秒':>10}")
+    total_time = 0
+    for source in FORMULAS:
+        evaluate = compile_formula(source).evaluate
+        result = evaluate(CONTEXT)
+        start = time.perf_counter()
+        for _ in range(args.evaluations):
+            evaluate(CONTEXT)
+        elapsed = time.perf_counter() - start
+        total_time += elapsed
+        print(f"{source:<70} {str(result):>10} {args.evaluations / elapsed / 1000:>10.0f}")
+    print(f"平均: {args.evaluations * len(FORMULAS) / total_time / 1000:.0f} 次/毫秒")
+
+if __name__ == "__main__":
+    main()
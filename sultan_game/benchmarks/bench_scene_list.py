@@ -0,0 +1,122 @@
+"""
+场景列表序列化性能基准
+对比旧实现（加载完整ORM对象 + __dict__.copy() + 逐行枚举修正 + 逐行json.loads前置场景 + 构造SceneResponse）
+与列投影实现（api.scenes._scene_response_query + _scene_to_response）每秒处理的行数
+两种实现都经过一次response_model校验，与FastAPI返回时的开销一致
+
+prerequisite_scenes现在是JSONText列（结果处理阶段解码），旧实现读取的是Text列中的原始JSON字符串，
+所以基准用映射到同一张表、该列为原始Text的LegacyScene复现旧的读取路径
+
+用法（在 sultan_game 目录下）：
+    python benchmarks/bench_scene_list.py --rows 10000 --repeat 5
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+from typing import List
+from pydantic import TypeAdapter
+from sqlalchemy import Text, create_engine, type_coerce
+from sqlalchemy.orm import column_property, declarative_base, sessionmaker
+from core.database import Base
+from models import Scene, SceneCategory, SceneStatus, TimeOfDay
+from api.scenes import SceneResponse, _scene_response_query, _scene_to_response
+
+# 模拟FastAPI response_model对返回值的校验
+response_adapter = TypeAdapter(List[SceneResponse])
+
+class LegacyScene(declarative_base()):
+    """旧的Scene映射：prerequisite_scenes为原始JSON字符串（Text列），由调用方逐行json.loads"""
+    __table__ = Scene.__table__
+    __mapper_args__ = {"exclude_properties": ["prerequisite_scenes"]}
+    prerequisite_scenes = column_property(type_coerce(Scene.__table__.c.prerequisite_scenes, Text))
+
+def seed(session, rows):
+    """写入测试场景"""
+    now = int(time.time())
+    categories = list(SceneCategory)
+    session.bulk_insert_mappings(Scene, [
+        {
+            "id": f"scene-{i:08d}",
+            "scene_id": f"bench_scene_{i}",
+            "name": f"基准场景{i}",
+            "category": categories[i % len(categories)],
+            "chapter": i % 10 + 1,
+            "description": "用于性能测试的场景描述" * 4,
+            "location": "王宫",
+            "time_of_day": TimeOfDay.NIGHT,
+            "card_count": i % 5,
+            "prerequisite_scenes": [f"bench_scene_{i - 1}"] if i else [],
+            "days_required": i % 7,
+            "status": SceneStatus.ACTIVE,
+            "is_active": True,
+            "created_at": now,
+            "updated_at": now
+        }
+        for i in range(rows)
+    ])
+    session.commit()
+
+def legacy_list(session, limit):
+    """旧实现：完整ORM对象 + __dict__.copy() + 逐行修正（含json.loads） + 构造SceneResponse"""
+    scenes = session.query(LegacyScene).filter(LegacyScene.is_active == True).limit(limit).all()
+    result = []
+    for scene in scenes:
+        scene_dict = scene.__dict__.copy()
+        scene_dict['npc_count'] = 0
+        scene_dict['status'] = scene.status.value if scene.status else 'draft'
+        scene_dict['category'] = scene.category.value if scene.category else None
+        scene_dict['time_of_day'] = scene.time_of_day.value if scene.time_of_day else None
+        scene_dict['prerequisite_scenes'] = json.loads(scene_dict.get('prerequisite_scenes') or '[]')
+        scene_dict['id'] = str(scene.id)
+        result.append(SceneResponse(**scene_dict))
+    return result
+
+def projected_list(session, limit):
+    """新实现：列投影（含聚合NPC数量） + 单次字典构造"""
+    rows = _scene_response_query(session).filter(Scene.is_active == True).limit(limit).all()
+    return [_scene_to_response(row) for row in rows]
+
+def measure(name, func, session_factory, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        session = session_factory()
+        try:
+            start = time.perf_counter()
+            response_adapter.validate_python(func(session, rows))
+            elapsed = time.perf_counter() - start
+        finally:
+            session.close()
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<12} {rows / best:>12,.0f} rows/s  (best of {repeat}: {best * 1000:.1f} ms)")
+    return rows / best
+
+def main():
+    parser = argparse.ArgumentParser(description="场景列表序列化性能基准")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    bench_engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=bench_engine)
+    session_factory = sessionmaker(bind=bench_engine)
+
+    session = session_factory()
+    seed(session, args.rows)
+    session.close()
+
+    before = measure("legacy", legacy_list, session_factory, args.rows, args.repeat)
+    after = measure("projection", projected_list, session_factory, args.rows, args.repeat)
+    print(f"speedup      {after / before:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+对话回合压测
+在后台线程中启动本地模拟模型服务（benchmarks/stub_llm.py）和后端，写入测试用的玩家/场景/NPC/AI配置，
+然后由N个并发玩家驱动完整的DialogueSession：每轮循环调用 /orchestrate，轮到玩家时提交第一个话术选项，
+直到评分AI结束本轮。统计每轮耗时的p50/p95/p99、编排请求耗时和吞吐量。
+
+用法（在 sultan_game 目录下）：
+    python benchmarks/load_dialogue.py --players 20 --rounds 5 --latency-ms 300 --stddev-ms 100
+    python benchmarks/load_dialogue.py --players 50 --error-rate 0.02 --output load.json
+
+--backend-url / --llm-url 可指向已运行的服务（后端需使用同一个DATABASE_URL，测试数据直接写入数据库）
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.gettempdir()) / 'sultan_load_test.db'}")
+
+import httpx
+import uvicorn
+import stub_llm
+
+AGENTS = (
+    ("narrator", "旁白。场景：{scene_name}，背景：{scene_background}。"),
+    ("npc", "你扮演{npc_name}，性格：{personality}。"),
+    ("option_generator", "你为玩家生成话术选项。"),
+    ("evaluator", "你是场景的评分AI，骰子阈值{dice_threshold}。"),
+)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve(app, port):
+    """在后台线程中运行uvicorn，返回服务地址"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+def seed(players, scenes, npcs_per_scene):
+    """写入测试数据，返回 [(player_id, scene_id, scene_npc_ids)]"""
+    from core.database import SessionLocal
+    from models import (
+        Player, Scene, SceneCategory, SceneStatus, SceneAIConfiguration, NPC, NPCType, Tier, Faction,
+        AIConfig, AIType, SceneAIConfig
+    )
+
+    run = uuid.uuid4().hex[:8]
+    now = int(time.time())
+    db = SessionLocal()
+    try:
+        configs = [
+            AIConfig(id=uuid.uuid4(), config_id=f"load_{run}_{ai_type}", name=f"压测{ai_type}", ai_type=AIType(ai_type),
+                     base_prompt=prompt, model_config={"model": "stub", "temperature": 0.7}, is_active=True,
+                     created_at=now, updated_at=now)
+            for ai_type, prompt in AGENTS
+        ]
+        db.add_all(configs)
+
+        scene_rows = []
+        for index in range(scenes):
+            scene = Scene(id=str(uuid.uuid4()), scene_id=f"load_{run}_{index}", name=f"压测场景{index}",
+                          category=SceneCategory.MAIN_STORY, description="百官齐聚，暗流涌动", status=SceneStatus.ACTIVE,
+                          is_active=True, created_at=now, updated_at=now)
+            npcs = [NPC(id=str(uuid.uuid4()), npc_id=f"load_{run}_{index}_{i}", name=f"大臣{i}", npc_type=NPCType.GAME_NPC,
+                        tier=Tier.SILVER, faction=Faction.MINISTER, intelligence=5, strength=30, defense=30, hp_max=100,
+                        personality_traits=["谨慎", "深沉"], is_active=True, created_at=now, updated_at=now)
+                    for i in range(npcs_per_scene)]
+            db.add(scene)
+            db.add_all(npcs)
+            db.add(SceneAIConfiguration(id=str(uuid.uuid4()), scene_id=scene.id, narrator_prompt="描述朝堂的气氛变化",
+                                        evaluator_thresholds={"dice_trigger": 75, "tension_trigger": 85}))
+            for order, config in enumerate(configs):
+                db.add(SceneAIConfig(id=uuid.uuid4(), scene_id=uuid.UUID(scene.id), ai_config_id=config.id,
+                                     execution_order=order, is_required=True, scene_specific_config={},
+                                     trigger_conditions={}))
+            scene_rows.append((scene.id, [npc.id for npc in npcs]))
+
+        player_rows = [Player(id=str(uuid.uuid4()), username=f"load_{run}_{i}") for i in range(players)]
+        db.add_all(player_rows)
+        db.commit()
+        return [(player.id, *scene_rows[i % scenes]) for i, player in enumerate(player_rows)]
+    finally:
+        db.close()
+
+class Stats:
+    def __init__(self):
+        self.rounds = []      # 每轮耗时（秒）
+        self.steps = []       # 每次 /orchestrate 耗时（秒）
+        self.errors = Counter()
+        self.abandoned = 0
+
+async def play(client, player_id, scene_id, scene_npcs, rounds, max_retries, stats):
+    """一个玩家：创建会话，完成rounds轮后结束会话"""
+    player_npc = f"player_npc_{player_id[:8]}"
+    response = await client.post("/api/dialogue/sessions", json={
+        "player_id": player_id, "scene_id": scene_id, "scene_npcs": scene_npcs, "player_npcs": [player_npc]
+    })
+    if response.status_code != 200:
+        stats.errors[f"create {response.status_code}"] += 1
+        stats.abandoned += 1
+        return
+    session_id = response.json()["id"]
+    max_steps = 2 * (len(scene_npcs) + 1) + 2
+    completed_rounds = 0
+
+    for _ in range(rounds):
+        started = time.perf_counter()
+        retries = steps = 0
+        complete = False
+        while steps < max_steps:
+            steps += 1
+            step_started = time.perf_counter()
+            response = await client.post(f"/api/dialogue/sessions/{session_id}/orchestrate")
+            stats.steps.append(time.perf_counter() - step_started)
+            if response.status_code != 200:
+                stats.errors[f"orchestrate {response.status_code}"] += 1
+                retries += 1
+                if retries > max_retries:
+                    break
+                continue
+            result = response.json()
+            if result["round_complete"]:
+                complete = True
+                break
+            if result["player_turn"]:
+                options = result["options"] or ["……"]
+                response = await client.post(f"/api/dialogue/sessions/{session_id}/speeches", json={
+                    "speaker_type": "player_npc", "speaker_id": result["player_turn"], "speech_text": str(options[0]),
+                    "is_player_choice": True, "available_options": options, "selected_option": 0
+                })
+                if response.status_code != 200:
+                    stats.errors[f"speech {response.status_code}"] += 1
+                    break
+        if not complete:
+            stats.abandoned += 1
+            break
+        stats.rounds.append(time.perf_counter() - started)
+        completed_rounds += 1
+
+    status = "completed" if completed_rounds == rounds else "abandoned"
+    await client.post(f"/api/dialogue/sessions/{session_id}/end", json={"status": status, "final_result": "load_test"})
+
+def percentile(values, q):
+    """最近秩百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else None,
+        **{f"p{q}_ms": round(percentile(values, q) * 1000, 1) if values else None for q in (50, 95, 99)},
+        "max_ms": round(max(values) * 1000, 1) if values else None,
+    }
+
+async def drive(args, assignments, backend_url):
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.players * 2, max_keepalive_connections=args.players * 2)
+    async with httpx.AsyncClient(base_url=backend_url, timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(play(client, player_id, scene_id, scene_npcs, args.rounds, args.max_retries, stats)
+                               for player_id, scene_id, scene_npcs in assignments))
+        elapsed = time.perf_counter() - started
+    return stats, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="对话回合压测（模拟模型服务）")
+    parser.add_argument("--players", type=int, default=10, help="并发玩家数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个会话的轮数")
+    parser.add_argument("--scenes", type=int, default=1)
+    parser.add_argument("--npcs", type=int, default=3, help="每个场景的场景NPC数")
+    parser.add_argument("--max-retries", type=int, default=3, help="编排失败时每轮的重试次数")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求的超时（秒）")
+    parser.add_argument("--backend-url", help="已运行的后端地址，默认在本进程中启动")
+    parser.add_argument("--llm-url", help="已运行的模拟模型服务地址（.../v1），默认在本进程中启动")
+    parser.add_argument("--output", help="结果写入JSON文件")
+    stub_llm.add_arguments(parser)
+    args = parser.parse_args()
+
+    llm_url = args.llm_url or serve(stub_llm.create_app(stub_llm.profile_from_args(args)), free_port()) + "/v1"
+    os.environ["LLM_BASE_URL"] = llm_url
+    # 后端在设置LLM_BASE_URL之后导入
+    import main as backend
+    backend_url = args.backend_url or serve(backend.app, free_port())
+
+    assignments = seed(args.players, args.scenes, args.npcs)
+    stats, elapsed = asyncio.run(drive(args, assignments, backend_url))
+
+    report = {
+        "players": args.players,
+        "rounds_per_session": args.rounds,
+        "llm": {"distribution": args.latency, "latency_ms": args.latency_ms, "stddev_ms": args.stddev_ms,
+                "token_interval_ms": args.token_interval_ms, "error_rate": args.error_rate,
+                "rate_limit_rate": args.rate_limit_rate},
+        "elapsed_s": round(elapsed, 2),
+        "rounds_per_s": round(len(stats.rounds) / elapsed, 2) if elapsed else None,
+        "round_latency": summarize(stats.rounds),
+        "orchestrate_latency": summarize(stats.steps),
+        "errors": dict(stats.errors),
+        "abandoned_sessions": stats.abandoned,
+    }
+    for label in ("round_latency", "orchestrate_latency"):
+        data = report[label]
+        print(f"{label:<20} n={data['count']:<6} p50={data['p50_ms']}ms  p95={data['p95_ms']}ms  "
+              f"p99={data['p99_ms']}ms  max={data['max_ms']}ms")
+    print(f"throughput           {report['rounds_per_s']} rounds/s  ({len(stats.rounds)} rounds in {report['elapsed_s']}s)")
+    if stats.errors or stats.abandoned:
+        print(f"errors               {dict(stats.errors)}  abandoned={stats.abandoned}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
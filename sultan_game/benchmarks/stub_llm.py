@@ -0,0 +1,176 @@
+"""
+本地模拟大模型服务（OpenAI兼容的 /v1/chat/completions，支持流式输出）
+用于开发、CI和压测时替代真实模型：首token延迟按指定分布采样，流式输出时逐token间隔发送，
+可按比例注入错误（500）和限流（429）。
+
+响应内容按请求类型生成（匹配core.prompt_builder的默认要求）：
+要求返回JSON对象评分时返回评分JSON，要求JSON数组时返回话术选项，其余返回一段发言。
+
+用法（在 sultan_game 目录下）：
+    python benchmarks/stub_llm.py --port 8100 --latency lognormal --latency-ms 800 --stddev-ms 300 \\
+        --token-interval-ms 20 --error-rate 0.01
+    LLM_BASE_URL=http://127.0.0.1:8100/v1 uvicorn main:app --port 8001
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+SPEECH_TOKENS = ["陛下", "，", "臣", "以为", "此事", "关系", "社稷", "安危", "，", "不可", "轻率", "决断", "。",
+                 "还请", "三思", "而后", "行", "。"]
+OPTIONS = ["恭敬地附和宰相的意见", "提出折中的方案", "直言反对并陈述理由", "沉默观察众人的反应"]
+
+class LatencyProfile:
+    """模拟服务的延迟和错误配置"""
+
+    def __init__(self, distribution="lognormal", latency_ms=500.0, stddev_ms=200.0, token_interval_ms=15.0,
+                 tokens=24, error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"distribution must be one of {', '.join(DISTRIBUTIONS)}")
+        self.distribution = distribution
+        self.latency_ms = latency_ms
+        self.stddev_ms = stddev_ms
+        self.token_interval_ms = token_interval_ms
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def first_token_delay(self):
+        """首token延迟（秒）"""
+        mean, stddev = self.latency_ms, self.stddev_ms
+        with self._lock:
+            if self.distribution == "fixed":
+                value = mean
+            elif self.distribution == "uniform":
+                value = self.random.uniform(max(0.0, mean - stddev), mean + stddev)
+            elif self.distribution == "normal":
+                value = self.random.gauss(mean, stddev)
+            elif self.distribution == "exponential":
+                value = self.random.expovariate(1 / mean) if mean > 0 else 0.0
+            else:
+                # 按均值和标准差换算对数正态分布的参数
+                sigma2 = math.log(1 + (stddev / mean) ** 2) if mean > 0 else 0.0
+                value = self.random.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2)) if mean > 0 else 0.0
+        return max(0.0, value) / 1000
+
+    def failure(self):
+        """按比例返回注入的错误状态码，正常时返回None"""
+        with self._lock:
+            roll = self.random.random()
+        if roll < self.error_rate:
+            return 500
+        if roll < self.error_rate + self.rate_limit_rate:
+            return 429
+        return None
+
+    def content_tokens(self, messages):
+        instruction = messages[-1].get("content", "") if messages else ""
+        with self._lock:
+            if "JSON对象" in instruction:
+                return [json.dumps({
+                    "story_progress": self.random.randint(0, 20),
+                    "dialogue_quality": self.random.randint(40, 90),
+                    "tension_level": self.random.randint(10, 80),
+                    "special_flags": [],
+                    "evaluation_result": "continue",
+                }, ensure_ascii=False)]
+            if "JSON数组" in instruction:
+                return [json.dumps(self.random.sample(OPTIONS, 3), ensure_ascii=False)]
+            return [SPEECH_TOKENS[i % len(SPEECH_TOKENS)] for i in range(self.tokens)]
+
+def _prompt_tokens(messages):
+    # 粗略估算：中文约1.5字符一个token
+    return int(sum(len(message.get("content") or "") for message in messages) / 1.5)
+
+def create_app(profile: LatencyProfile):
+    app = FastAPI(title="Stub LLM")
+    app.state.profile = profile
+    app.state.requests = 0
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        messages = body.get("messages") or []
+        model = body.get("model", "stub")
+
+        status = profile.failure()
+        await asyncio.sleep(profile.first_token_delay())
+        if status is not None:
+            return JSONResponse(status_code=status, content={"error": {"message": "injected failure", "code": status}})
+
+        tokens = profile.content_tokens(messages)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = {"prompt_tokens": _prompt_tokens(messages), "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            await asyncio.sleep(profile.token_interval_ms * (len(tokens) - 1) / 1000)
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def events():
+            for index, token in enumerate(tokens):
+                if index:
+                    await asyncio.sleep(profile.token_interval_ms / 1000)
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            if (body.get("stream_options") or {}).get("include_usage"):
+                final["usage"] = usage
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+def add_arguments(parser):
+    parser.add_argument("--latency", choices=DISTRIBUTIONS, default="lognormal", help="首token延迟分布")
+    parser.add_argument("--latency-ms", type=float, default=500, help="首token延迟均值")
+    parser.add_argument("--stddev-ms", type=float, default=200, help="首token延迟标准差（uniform为半宽）")
+    parser.add_argument("--token-interval-ms", type=float, default=15, help="流式输出的token间隔")
+    parser.add_argument("--tokens", type=int, default=24, help="发言的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--seed", type=int, default=None)
+
+def profile_from_args(args):
+    return LatencyProfile(args.latency, args.latency_ms, args.stddev_ms, args.token_interval_ms, args.tokens,
+                          args.error_rate, args.rate_limit_rate, args.seed)
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地模拟大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)  # 与后端的默认端口8001错开
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(profile_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
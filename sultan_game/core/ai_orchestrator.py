@@ -0,0 +1,603 @@
+"""
+AI智能体编排
+按场景的SceneAIConfig执行一步对话：从当前发言者开始，为连续的场景NPC生成发言，直到轮到玩家NPC
+（此时生成玩家话术选项）或本轮结束（此时由评分AI评分并结束本轮）。
+
+调度规则：
+- 智能体只等待它依赖的智能体，互不依赖的并发执行（如NPC发言与玩家话术生成同时进行）
+- 默认依赖：只依赖 TYPE_DEPENDENCIES 中的类型且 execution_order 更小的智能体；
+  scene_specific_config.depends_on 可显式指定依赖的config_id或AI类型。
+  NPC发言按发言顺序记录，NPC智能体对（间接）等待它的发言的智能体的依赖与发言顺序矛盾，本步忽略；
+  显式依赖构成循环时抛出AgentConfigError
+- is_required 的智能体失败（超时/报错）时，依赖它的智能体跳过，本步结果为失败；
+  非必需智能体失败时，依赖方忽略它继续执行
+- trigger_conditions 不满足的智能体本步不执行
+- 每个智能体的超时取 scene_specific_config.timeout / model_config.timeout / AI_AGENT_TIMEOUT，
+  整步的超时为各智能体超时之和加 STEP_TIMEOUT_GRACE，超时未完成的智能体被取消并记为timeout
+
+对话历史取自 core.dialogue_context 的上下文窗口，按每个智能体的token预算截取。
+NPC发言并发生成，但按发言顺序依次记录；旁白和NPC的输出以增量文本实时推送（core.pubsub）。
+temperature为0的话术选项/评分调用经过 core.response_cache。
+每次模型调用记录为AIResponse（含response_time_ms和缓存命中情况）。
+"""
+
+from sqlalchemy.orm import contains_eager
+from core.database import SessionLocal
+from core import dialogue_context, dialogue_engine, llm_client, prompt_builder, pubsub, response_cache
+from core.dialogue_engine import SessionError
+from core.logging_config import get_logger
+from models import (
+    AIConfig, AIType, SceneAIConfig, AISession, AIResponse, SpeakerType
+)
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+
+logger = get_logger(__name__)
+
+DEFAULT_AGENT_TIMEOUT = float(os.getenv("AI_AGENT_TIMEOUT", "30"))
+# 整步超时在各智能体超时之和之外的余量（秒），覆盖缓存读写和发言记录
+STEP_TIMEOUT_GRACE = 5.0
+
+# 默认依赖的AI类型
+TYPE_DEPENDENCIES = {
+    AIType.NARRATOR: (),
+    AIType.NPC: (AIType.NARRATOR,),
+    AIType.OPTION_GENERATOR: (AIType.NARRATOR,),
+    AIType.EVALUATOR: (AIType.NARRATOR, AIType.NPC, AIType.OPTION_GENERATOR),
+}
+
+# 评分AI返回的JSON中用于结束本轮的字段
+EVALUATION_FIELDS = ("story_progress", "dialogue_quality", "tension_level", "special_flags", "evaluation_result")
+
+class OrchestrationError(RuntimeError):
+    """必需的智能体执行失败，result为本步的执行结果"""
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+class StepInProgressError(SessionError):
+    """同一会话已有一步编排正在执行"""
+
+class AgentConfigError(ValueError):
+    """场景AI智能体配置无效（如depends_on构成循环依赖）"""
+
+class Agent:
+    """一个场景中的AI智能体（SceneAIConfig + AIConfig）"""
+    __slots__ = ("id", "ai_config_id", "config_id", "name", "ai_type", "execution_order", "is_required",
+                 "trigger_conditions", "depends_on", "system_prompt", "base_prompt", "character_config",
+                 "overrides", "settings", "timeout", "version", "updated_at")
+
+    def __init__(self, link: SceneAIConfig):
+        config = link.ai_config
+        overrides = link.scene_specific_config or {}
+        self.id = str(link.id)
+        self.ai_config_id = config.id
+        self.config_id = config.config_id
+        self.name = config.name
+        self.ai_type = config.ai_type
+        self.execution_order = link.execution_order or 0
+        self.is_required = link.is_required is not False
+        self.trigger_conditions = link.trigger_conditions or {}
+        self.depends_on = overrides.get("depends_on")
+        self.system_prompt = config.system_prompt
+        self.base_prompt = config.base_prompt
+        self.character_config = config.character_config or {}
+        self.overrides = overrides
+        self.version = config.version
+        self.updated_at = config.updated_at
+        self.settings = {**(config.model_config or {}), **overrides.get("model_config", {})}
+        self.timeout = float(overrides.get("timeout", self.settings.get("timeout", DEFAULT_AGENT_TIMEOUT)))
+
+def load_agents(db, scene_id):
+    """场景中启用的智能体，按execution_order排序（1次查询）"""
+    links = db.query(SceneAIConfig).join(SceneAIConfig.ai_config).options(
+        contains_eager(SceneAIConfig.ai_config)
+    ).filter(
+        SceneAIConfig.scene_id == uuid.UUID(scene_id), AIConfig.is_active == True
+    ).order_by(SceneAIConfig.execution_order).all()
+    return [Agent(link) for link in links]
+
+def _turn_waits(agents, assignments, npc_turns):
+    """
+    按发言顺序产生的隐式等待 {agent.id: {等待的agent.id}}：
+    NPC智能体的发言等待它最后一个发言之前的所有发言记录完成，评分AI等待所有发言
+    """
+    owners = {npc_id: agent_id for agent_id, turns in assignments.items() for npc_id in turns}
+    waits = {}
+    for agent in agents:
+        if agent.ai_type == AIType.NPC and assignments.get(agent.id):
+            last = max(npc_turns.index(npc_id) for npc_id in assignments[agent.id])
+            waits[agent.id] = {owners[npc_id] for npc_id in npc_turns[:last] if npc_id in owners} - {agent.id}
+        elif agent.ai_type == AIType.EVALUATOR:
+            waits[agent.id] = set(owners.values())
+    return waits
+
+def _reaches(graph, start, target):
+    seen, stack = set(), [start]
+    while stack:
+        node = stack.pop()
+        if node == target:
+            return True
+        if node not in seen:
+            seen.add(node)
+            stack.extend(graph.get(node, ()))
+    return False
+
+def resolve_dependencies(agents, assignments=None, npc_turns=()):
+    """
+    返回 {agent.id: [依赖的agent.id]}，存在循环依赖时抛出AgentConfigError
+    assignments（{NPC智能体id: [负责的npc_id]}）和npc_turns（本步的发言顺序）给出时，
+    忽略NPC智能体对（间接）等待它的发言的智能体的依赖，否则两者互相等待，本步永远不会结束
+    """
+    dependencies = {}
+    for agent in agents:
+        if agent.depends_on is not None:
+            targets = set(agent.depends_on)
+            dependencies[agent.id] = [other.id for other in agents if other is not agent and
+                                      (other.config_id in targets or other.ai_type.value in targets)]
+        else:
+            types = TYPE_DEPENDENCIES[agent.ai_type]
+            dependencies[agent.id] = [other.id for other in agents if other.ai_type in types and
+                                      other.execution_order < agent.execution_order]
+
+    if assignments:
+        waits = _turn_waits(agents, assignments, list(npc_turns))
+        names = {agent.id: agent.config_id for agent in agents}
+        for agent in agents:
+            if agent.ai_type != AIType.NPC:
+                continue
+            for dep_id in list(dependencies[agent.id]):
+                graph = {agent_id: set(deps) | waits.get(agent_id, set())
+                         for agent_id, deps in dependencies.items()}
+                if _reaches(graph, dep_id, agent.id):
+                    logger.warning(f"忽略与发言顺序矛盾的依赖: {names[agent.id]} -> {names[dep_id]}")
+                    dependencies[agent.id].remove(dep_id)
+
+    # 拓扑排序检查循环依赖
+    remaining = {agent_id: set(deps) for agent_id, deps in dependencies.items()}
+    while remaining:
+        ready = [agent_id for agent_id, deps in remaining.items() if not deps]
+        if not ready:
+            names = sorted(agent.config_id for agent in agents if agent.id in remaining)
+            raise AgentConfigError(f"Circular agent dependency: {', '.join(names)}")
+        for agent_id in ready:
+            del remaining[agent_id]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return dependencies
+
+def is_triggered(agent, round_number, tension_level):
+    """
+    trigger_conditions: {"min_round", "max_round", "every_n_rounds", "min_tension", "max_tension"}
+    """
+    conditions = agent.trigger_conditions
+    if round_number < conditions.get("min_round", 0):
+        return False
+    if "max_round" in conditions and round_number > conditions["max_round"]:
+        return False
+    every = conditions.get("every_n_rounds")
+    if every and (round_number - 1) % every:
+        return False
+    if tension_level < conditions.get("min_tension", 0):
+        return False
+    if "max_tension" in conditions and tension_level > conditions["max_tension"]:
+        return False
+    return True
+
+class Step:
+    """本步需要处理的发言：连续的场景NPC发言，以及随后轮到的玩家NPC（None表示本轮随之结束）"""
+    __slots__ = ("session_id", "scene_id", "round_id", "round_number", "tension_level", "round_start",
+                 "npc_turns", "player_turn", "scene_npcs")
+
+    def __init__(self, state):
+        self.session_id = state.id
+        self.scene_id = state.scene_id
+        self.round_id = state.round.id
+        self.round_number = state.round.round_number
+        self.tension_level = state.total_tension_level
+        self.round_start = state.round.speeches_count == 0
+        self.scene_npcs = set(state.scene_npcs)
+        self.npc_turns = []
+        self.player_turn = None
+        for npc_id in state.round.speaking_order[state.current_speaker_index:]:
+            if npc_id not in self.scene_npcs:
+                self.player_turn = npc_id
+                break
+            self.npc_turns.append(npc_id)
+
+    def applies(self, agent):
+        if agent.ai_type == AIType.NARRATOR:
+            return self.round_start
+        if agent.ai_type == AIType.NPC:
+            return bool(self.npc_targets(agent))
+        if agent.ai_type == AIType.OPTION_GENERATOR:
+            return self.player_turn is not None
+        return self.player_turn is None  # 评分AI在本轮结束时执行
+
+    def npc_targets(self, agent):
+        # character_config.npc_id 指定专属NPC，否则为通用NPC智能体
+        npc_id = agent.character_config.get("npc_id")
+        return [turn for turn in self.npc_turns if npc_id is None or turn == npc_id]
+
+class Call:
+    """一次模型调用"""
+    __slots__ = ("agent", "target", "messages", "context_tokens", "cache", "cache_key", "completion", "error",
+                 "elapsed_ms", "speech_id", "data")
+
+    def __init__(self, agent, target, messages, context_tokens=None):
+        self.agent = agent
+        self.target = target
+        self.messages = messages
+        self.context_tokens = context_tokens
+        self.cache = None  # "hit" / "miss" / "bypass"，None表示不适用
+        self.cache_key = None
+        self.completion = None
+        self.error = None
+        self.elapsed_ms = None
+        self.speech_id = None
+        self.data = {}
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def summary(self):
+        return {
+            "target": self.target,
+            "ok": self.ok,
+            "error": self.error,
+            "response_time_ms": self.elapsed_ms,
+            "tokens_used": self.completion.tokens_used if self.completion else None,
+            "context_tokens": self.context_tokens,
+            "cache": self.cache,
+            "speech_id": self.speech_id,
+        }
+
+def _parse_json(text, expected):
+    match = re.search(r"\{.*\}|\[.*\]", text, re.S)
+    if not match:
+        raise ValueError("no JSON found in response")
+    value = json.loads(match.group(0))
+    if not isinstance(value, expected):
+        raise ValueError(f"expected {expected.__name__}")
+    return value
+
+def _parse_options(text):
+    """话术选项：JSON数组，或每行一个选项"""
+    try:
+        return _parse_json(text, list)
+    except ValueError:
+        return [line.strip(" -*\t") for line in text.splitlines() if line.strip(" -*\t")]
+
+def _parse_evaluation(text):
+    data = _parse_json(text, dict)
+    evaluation = {key: data[key] for key in EVALUATION_FIELDS if key in data}
+    for key in ("story_progress", "dialogue_quality", "tension_level"):
+        if key in evaluation:
+            evaluation[key] = int(evaluation[key])
+    return evaluation
+
+class Orchestrator:
+    """执行一步编排，complete可替换为其他模型调用实现（签名同llm_client.complete）"""
+
+    def __init__(self, state, step, agents, templates, complete, memory=None):
+        self.state = state
+        self.step = step
+        self.memory = memory  # dialogue_context.ContextMemory，None时只以依赖的智能体本步的输出作为对话历史
+        self.context_tokens = {}  # agent.id -> 最近一次组装的对话历史token数
+        self.agents = {agent.id: agent for agent in agents}
+        self.templates = templates  # (agent.id, npc_id) -> PromptTemplate
+        self.complete = complete
+        self.calls = []
+        self.results = {}     # agent.id -> "ok" / "failed" / "skipped" / "timeout"
+        self.outputs = {}     # agent.id -> [(ai_type, text)]
+        self.options = None
+        self.evaluation = None
+        self.round_complete = False
+        # 每个NPC发言分配给一个智能体：专属NPC智能体优先，其次按execution_order
+        self.assignments = {}
+        claimed = set()
+        npc_agents = sorted((agent for agent in agents if agent.ai_type == AIType.NPC),
+                            key=lambda agent: agent.character_config.get("npc_id") is None)
+        for agent in npc_agents:
+            self.assignments[agent.id] = [npc_id for npc_id in step.npc_targets(agent) if npc_id not in claimed]
+            claimed.update(self.assignments[agent.id])
+        self.dependencies = resolve_dependencies(agents, self.assignments, step.npc_turns)
+        # NPC发言按顺序记录：第i个发言等待第i-1个记录完成；没有智能体负责的发言直接视为未记录
+        loop = asyncio.get_running_loop()
+        self._turns = {npc_id: loop.create_future() for npc_id in step.npc_turns}
+        for npc_id in self._turns.keys() - claimed:
+            self._turns[npc_id].set_result(False)
+
+    async def _call(self, agent, target, messages, on_delta=None):
+        call = Call(agent, target, messages, self.context_tokens.get(agent.id))
+        self.calls.append(call)
+        started = time.perf_counter()
+        # 非流式的确定性调用先查响应缓存，结果校验通过后才写入（见_run）
+        call.cache = response_cache.policy(agent.settings, agent.overrides) if on_delta is None else None
+        if call.cache == "bypass":
+            response_cache.record_bypass()
+        elif call.cache == "cache":
+            call.cache_key = response_cache.cache_key(messages, agent.settings)
+            call.completion = await response_cache.get(call.cache_key)
+            call.cache = "hit" if call.completion is not None else "miss"
+        try:
+            if call.completion is None:
+                call.completion = await asyncio.wait_for(self.complete(messages, agent.settings, on_delta),
+                                                         agent.timeout)
+        except asyncio.TimeoutError:
+            call.error = f"timeout after {agent.timeout:g}s"
+        except llm_client.LLMError as e:
+            call.error = str(e)
+        call.elapsed_ms = int((time.perf_counter() - started) * 1000)
+        if call.error:
+            logger.warning(f"AI智能体调用失败 {agent.config_id} ({target}): {call.error}")
+        return call
+
+    def _streamer(self, stream_id, speaker_type, speaker_id, speaker_name):
+        def on_delta(delta):
+            dialogue_engine.stream_partial(self.step.session_id, stream_id, delta, speaker_type,
+                                           speaker_id, speaker_name)
+        return on_delta
+
+    def _context(self, agent):
+        """
+        本次调用的运行时变量：对话历史取会话的上下文窗口（按智能体的token预算截取），
+        依赖的智能体本步的发言在它们完成时已经记录进窗口
+        """
+        if self.memory is not None:
+            history, self.context_tokens[agent.id] = self.memory.render(dialogue_context.token_budget(agent))
+            last_utterance = self.memory.last_utterance()
+        else:
+            inputs = []
+            for dep_id in self.dependencies[agent.id]:
+                inputs.extend(self.outputs.get(dep_id, ()))
+            history = "\n".join(f"{speaker}: {text}" for speaker, text in inputs)
+            last_utterance = inputs[-1][1] if inputs else ""
+        return {
+            "dialogue_history": history,
+            "last_utterance": last_utterance,
+            "round_number": self.step.round_number,
+            "tension_level": self.step.tension_level,
+            "player_turn": self.step.player_turn if agent.ai_type == AIType.OPTION_GENERATOR else None,
+        }
+
+    async def _run_narrator(self, agent):
+        template = self.templates[(agent.id, None)]
+        stream_id = str(uuid.uuid4())
+        call = await self._call(agent, None, template.render(self._context(agent)),
+                                self._streamer(stream_id, SpeakerType.NARRATOR, None, template.speaker_name))
+        if call.ok:
+            speech = dialogue_engine.add_speech(self.step.session_id, SpeakerType.NARRATOR, None,
+                                                template.speaker_name, call.completion.text, stream_id=stream_id)
+            call.speech_id = speech["id"]
+            self.outputs[agent.id] = [(template.speaker_name, call.completion.text)]
+        return [call]
+
+    async def _run_npc_turn(self, agent, npc_id, context):
+        template = self.templates[(agent.id, npc_id)]
+        name = template.speaker_name
+        stream_id = str(uuid.uuid4())
+        recorded = False
+        try:
+            call = await self._call(agent, npc_id, template.render(context),
+                                    self._streamer(stream_id, SpeakerType.SCENE_NPC, npc_id, name))
+            index = self.step.npc_turns.index(npc_id)
+            previous_ok = await self._turns[self.step.npc_turns[index - 1]] if index else True
+            if previous_ok and call.ok:
+                speech = dialogue_engine.add_speech(self.step.session_id, SpeakerType.SCENE_NPC, npc_id, name,
+                                                    call.completion.text, stream_id=stream_id)
+                call.speech_id = speech["id"]
+                recorded = True
+        finally:
+            # 出错或被取消时也要释放等待本发言的后续发言和评分AI
+            if not self._turns[npc_id].done():
+                self._turns[npc_id].set_result(recorded)
+        return call
+
+    async def _run_npcs(self, agent):
+        context = self._context(agent)
+        calls = await asyncio.gather(*(self._run_npc_turn(agent, npc_id, context)
+                                       for npc_id in self.assignments[agent.id]))
+        self.outputs[agent.id] = [(self.templates[(agent.id, call.target)].speaker_name, call.completion.text)
+                                  for call in calls if call.ok]
+        return list(calls)
+
+    async def _run_options(self, agent):
+        template = self.templates[(agent.id, None)]
+        call = await self._call(agent, self.step.player_turn, template.render(self._context(agent)))
+        if call.ok:
+            call.data = {"options": _parse_options(call.completion.text)}
+            self.options = call.data["options"]
+            pubsub.broker.publish(self.step.session_id, "options",
+                                  {"player_npc_id": self.step.player_turn, "options": self.options})
+        return [call]
+
+    async def _run_evaluator(self, agent):
+        # 等待所有NPC发言记录完成，确认本轮确实结束
+        if not all([await future for future in self._turns.values()]):
+            return None
+        template = self.templates[(agent.id, None)]
+        call = await self._call(agent, None, template.render(self._context(agent)))
+        if call.ok:
+            try:
+                self.evaluation = call.data = _parse_evaluation(call.completion.text)
+            except (TypeError, ValueError) as e:
+                call.error = f"invalid evaluator response: {e}"
+        if call.ok and self.state.current_speaker is None:
+            dialogue_engine.end_round(self.step.session_id, **self.evaluation)
+            self.round_complete = True
+        return [call]
+
+    async def _run(self, agent_id, tasks):
+        agent = self.agents[agent_id]
+        for dep_id in self.dependencies[agent_id]:
+            await tasks[dep_id]
+            if self.results[dep_id] != "ok" and self.agents[dep_id].is_required:
+                self.results[agent_id] = "skipped"
+                if agent.ai_type == AIType.NPC:
+                    # 释放等待这些发言的后续发言和评分AI
+                    for npc_id in self.assignments[agent.id]:
+                        self._turns[npc_id].set_result(False)
+                return
+
+        runner = {
+            AIType.NARRATOR: self._run_narrator,
+            AIType.NPC: self._run_npcs,
+            AIType.OPTION_GENERATOR: self._run_options,
+            AIType.EVALUATOR: self._run_evaluator,
+        }[agent.ai_type]
+        calls = await runner(agent)
+        if calls is None:
+            self.results[agent_id] = "skipped"
+        else:
+            self.results[agent_id] = "ok" if all(call.ok for call in calls) else "failed"
+            for call in calls:
+                if call.cache == "miss" and call.ok:
+                    await response_cache.put(call.cache_key, call.completion, response_cache.ttl_for(agent.settings))
+
+    async def run(self, timeout=None):
+        """执行所有智能体，超过timeout秒时取消未完成的智能体并记为timeout"""
+        tasks = {}
+        for agent_id, agent in self.agents.items():
+            tasks[agent_id] = asyncio.ensure_future(self._run(agent_id, tasks))
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks.values()), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"AI编排超时 {self.step.session_id}: {timeout:g}s")
+            for agent_id in self.agents.keys() - self.results.keys():
+                self.results[agent_id] = "timeout"
+        finally:
+            # 某个智能体出错（如会话已结束时add_speech抛出SessionError）时，其余智能体不能在本步结束后继续执行
+            pending = [task for task in tasks.values() if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def result(self, elapsed_ms):
+        failed = [agent_id for agent_id, status in self.results.items()
+                  if status != "ok" and self.agents[agent_id].is_required]
+        return {
+            "session_id": self.step.session_id,
+            "round_id": self.step.round_id,
+            "round_number": self.step.round_number,
+            "ok": not failed,
+            "elapsed_ms": elapsed_ms,
+            "agents": [{
+                "config_id": agent.config_id,
+                "ai_type": agent.ai_type.value,
+                "execution_order": agent.execution_order,
+                "is_required": agent.is_required,
+                "depends_on": [self.agents[dep_id].config_id for dep_id in self.dependencies[agent_id]],
+                "status": self.results.get(agent_id),
+                "calls": [call.summary() for call in self.calls if call.agent is agent],
+            } for agent_id, agent in self.agents.items()],
+            "player_turn": self.step.player_turn,
+            "options": self.options,
+            "evaluation": self.evaluation,
+            "round_complete": self.round_complete,
+            "session": self.state.to_dict(),
+        }
+
+def _prepare(step):
+    db = SessionLocal()
+    try:
+        agents = [agent for agent in load_agents(db, step.scene_id)
+                  if step.applies(agent) and is_triggered(agent, step.round_number, step.tension_level)]
+        requests = [(agent, npc_id) for agent in agents if agent.ai_type == AIType.NPC
+                    for npc_id in step.npc_targets(agent)]
+        requests += [(agent, None) for agent in agents if agent.ai_type != AIType.NPC]
+        memory = dialogue_context.ensure_loaded(db, step.session_id)
+        return agents, prompt_builder.get_templates(db, step.scene_id, requests), memory
+    finally:
+        db.close()
+
+def record_responses(session_id, calls, memory=None):
+    """
+    把本步的模型调用写入AIResponse（每个AIConfig对应一个AISession），
+    AISession.context_memory 保存上下文窗口的摘要状态和该智能体的token预算
+    """
+    if not calls:
+        return
+    db = SessionLocal()
+    try:
+        dialogue_session_id = uuid.UUID(session_id)
+        config_ids = {call.agent.ai_config_id for call in calls}
+        sessions = {
+            ai_session.ai_config_id: ai_session for ai_session in db.query(AISession).filter(
+                AISession.dialogue_session_id == dialogue_session_id, AISession.ai_config_id.in_(config_ids)
+            )
+        }
+        now = int(time.time())
+        for config_id in config_ids - sessions.keys():
+            sessions[config_id] = AISession(id=uuid.uuid4(), dialogue_session_id=dialogue_session_id,
+                                            ai_config_id=config_id, total_responses=0)
+            db.add(sessions[config_id])
+
+        snapshot = memory.snapshot() if memory is not None else None
+        for call in calls:
+            ai_session = sessions[call.agent.ai_config_id]
+            ai_session.total_responses = (ai_session.total_responses or 0) + 1
+            ai_session.last_response_time = now
+            if snapshot is not None:
+                ai_session.context_memory = {**snapshot, "token_budget": dialogue_context.token_budget(call.agent)}
+            completion = call.completion
+            db.add(AIResponse(
+                id=uuid.uuid4(),
+                ai_session_id=ai_session.id,
+                speech_id=uuid.UUID(call.speech_id) if call.speech_id else None,
+                request_prompt="\n\n".join(message["content"] for message in call.messages),
+                request_context={"target": call.target, "ai_type": call.agent.ai_type.value,
+                                 "attempts": completion.attempts if completion else None,
+                                 "context_tokens": call.context_tokens,
+                                 "cache": call.cache},
+                response_text=completion.text if completion else None,
+                response_data={**call.data, "error": call.error} if call.error else call.data,
+                evaluation_scores=call.data if call.agent.ai_type == AIType.EVALUATOR else {},
+                model_used=(completion.model if completion else None) or call.agent.settings.get("model"),
+                tokens_used=completion.tokens_used if completion else None,
+                response_time_ms=call.elapsed_ms,
+                created_at=now,
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+_running = set()  # 正在执行编排的会话（只在事件循环中访问）
+
+async def run_step(session_id, complete=None):
+    """
+    执行一步编排，返回本步结果
+    会话不存在时抛出SessionError，该会话已有一步在执行时抛出StepInProgressError，
+    智能体配置无效时抛出AgentConfigError，必需的智能体失败或超时时抛出OrchestrationError（result中含部分结果）
+    """
+    started = time.perf_counter()
+    state = dialogue_engine.get_session(session_id)
+    if state is None:
+        raise SessionError(f"Active dialogue session not found: {session_id}")
+    # 同一会话同时只执行一步：并发的两步会从同一发言者开始，生成重复的发言
+    if session_id in _running:
+        raise StepInProgressError(f"An orchestration step is already running for session {session_id}")
+    with state.lock:
+        if state.round.is_complete:
+            raise SessionError("Current round is complete; start the next round first")
+        step = Step(state)
+
+    _running.add(session_id)
+    try:
+        agents, templates, memory = await asyncio.to_thread(_prepare, step)
+        orchestrator = Orchestrator(state, step, agents, templates, complete or llm_client.complete, memory)
+        await orchestrator.run(sum(agent.timeout for agent in agents) + STEP_TIMEOUT_GRACE)
+        await asyncio.to_thread(record_responses, session_id, orchestrator.calls, memory)
+    finally:
+        _running.discard(session_id)
+
+    result = orchestrator.result(int((time.perf_counter() - started) * 1000))
+    if not result["ok"]:
+        raise OrchestrationError("Required AI agent failed", result)
+    return result
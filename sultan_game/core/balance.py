@@ -0,0 +1,313 @@
+"""
+战斗/场景平衡模拟器（NumPy批量）
+规则与 core.combat 一致（先手方先攻，伤害 = max(STR - DEF, 10)），可选伤害浮动 variance：
+每次攻击伤害乘以 U(1 - variance, 1 + variance)。所有对局的HP保存在数组中同时推进，
+variance为0时直接使用闭式结果
+
+- matchup_matrix: 所有NPC两两对战的胜率矩阵
+- simulate_party_vs_lineup: 玩家队伍的所有组合依次与场景NPC阵容车轮战（败者退场，胜者保留剩余HP）
+- simulate_scene / update_scene_analytics: 读取场景阵容并把难度/平衡评分写入SceneAnalytics
+"""
+
+from itertools import combinations
+from math import comb
+from core.combat import MIN_DAMAGE
+from models import NPC, NPCType, SceneNPCConfiguration, SceneEntryRequirement, SceneAnalytics
+import numpy as np
+import time
+
+# 每批同时模拟的对局数上限（控制内存）
+BATCH_SIMULATIONS = 2_000_000
+# 队伍组合数超过该值时随机抽样
+MAX_COMPOSITIONS = 2000
+
+def _duel(a_str, a_def, a_hp, b_str, b_def, b_hp, variance, rng):
+    """
+    批量单挑（一维数组），a先手
+    返回 (a是否获胜, a剩余HP, b剩余HP)
+    """
+    a_dmg = np.maximum(a_str - b_def, MIN_DAMAGE).astype(np.float64)
+    b_dmg = np.maximum(b_str - a_def, MIN_DAMAGE).astype(np.float64)
+    a_hp = np.asarray(a_hp, dtype=np.float64)
+    b_hp = np.asarray(b_hp, dtype=np.float64)
+
+    if not variance:
+        a_hits = np.maximum(np.ceil(b_hp / a_dmg), 0)
+        b_hits = np.maximum(np.ceil(a_hp / b_dmg), 0)
+        a_wins = (a_hp > 0) & (a_hits <= b_hits)
+        a_after = np.where(a_wins, np.maximum(a_hp - np.maximum(a_hits - 1, 0) * b_dmg, 0), 0)
+        b_after = np.where(a_wins, 0, np.maximum(b_hp - b_hits * a_dmg, 0))
+        return a_wins, a_after, b_after
+
+    a_hp = a_hp.copy()
+    b_hp = b_hp.copy()
+    low, high = 1 - variance, 1 + variance
+    active = np.flatnonzero((a_hp > 0) & (b_hp > 0))
+    while active.size:
+        b_hp[active] -= a_dmg[active] * rng.uniform(low, high, active.size)
+        active = active[b_hp[active] > 0]
+        a_hp[active] -= b_dmg[active] * rng.uniform(low, high, active.size)
+        active = active[a_hp[active] > 0]
+    a_wins = a_hp > 0
+    return a_wins, np.maximum(a_hp, 0), np.maximum(b_hp, 0)
+
+def matchup_matrix(strength, defense, hp, trials=100, variance=0.1, seed=None):
+    """
+    NPC两两对战胜率矩阵：result[i, j] 为 i 先手攻击 j 时 i 的胜率
+    """
+    strength = np.asarray(strength, dtype=np.int64)
+    defense = np.asarray(defense, dtype=np.int64)
+    hp = np.asarray(hp, dtype=np.int64)
+    n = strength.size
+    trials = trials if variance else 1
+    rng = np.random.default_rng(seed)
+    result = np.empty((n, n), dtype=np.float64)
+
+    block = max(1, BATCH_SIMULATIONS // max(n * trials, 1))
+    for start in range(0, n, block):
+        rows = np.arange(start, min(start + block, n))
+        shape = (rows.size, n, trials)
+        a = np.broadcast_to(rows[:, None, None], shape).ravel()
+        b = np.broadcast_to(np.arange(n)[None, :, None], shape).ravel()
+        wins, _, _ = _duel(strength[a], defense[a], hp[a], strength[b], defense[b], hp[b], variance, rng)
+        result[rows] = wins.reshape(shape).mean(axis=2)
+    return result
+
+def _compositions(pool_size, party_size, rng):
+    """所有队伍组合（超过MAX_COMPOSITIONS时随机抽样）"""
+    if comb(pool_size, party_size) <= MAX_COMPOSITIONS:
+        return np.array(list(combinations(range(pool_size), party_size)), dtype=np.int64).reshape(-1, party_size)
+    seen = set()
+    while len(seen) < MAX_COMPOSITIONS:
+        seen.add(tuple(sorted(rng.choice(pool_size, party_size, replace=False).tolist())))
+    return np.array(sorted(seen), dtype=np.int64)
+
+def simulate_party_vs_lineup(party_stats, lineup_stats, party_size, trials=100, variance=0.1, seed=None):
+    """
+    所有队伍组合对场景阵容的车轮战胜率
+    party_stats / lineup_stats: (n, 3) 数组，列为 strength, defense, hp
+    每次试验随机打乱队伍出场顺序；场景NPC按阵容顺序出场。玩家方每场单挑先手
+    返回 (组合数组 (C, party_size), 每个组合的胜率 (C,))
+    """
+    party_stats = np.asarray(party_stats, dtype=np.int64).reshape(-1, 3)
+    lineup_stats = np.asarray(lineup_stats, dtype=np.int64).reshape(-1, 3)
+    rng = np.random.default_rng(seed)
+    party_size = min(party_size, len(party_stats))
+    if party_size <= 0:
+        return np.empty((0, 0), dtype=np.int64), np.empty(0)
+    compositions = _compositions(len(party_stats), party_size, rng)
+    if len(lineup_stats) == 0:
+        return compositions, np.ones(len(compositions))
+
+    lineup_size = len(lineup_stats)
+    win_rates = np.empty(len(compositions))
+    block = max(1, BATCH_SIMULATIONS // max(trials * party_size, 1))
+    for start in range(0, len(compositions), block):
+        chunk = compositions[start:start + block]
+        # 每次试验的出场顺序 (S, party_size)
+        order = rng.permuted(np.repeat(chunk, trials, axis=0), axis=1)
+        simulations = len(order)
+        rows = np.arange(simulations)
+        p_pos = np.zeros(simulations, dtype=np.int64)
+        e_pos = np.zeros(simulations, dtype=np.int64)
+        p_hp = party_stats[order[:, 0], 2].astype(np.float64)
+        e_hp = np.full(simulations, lineup_stats[0, 2], dtype=np.float64)
+
+        active = rows
+        while active.size:
+            fighters = party_stats[order[active, p_pos[active]]]
+            enemies = lineup_stats[e_pos[active]]
+            p_wins, p_after, e_after = _duel(
+                fighters[:, 0], fighters[:, 1], p_hp[active],
+                enemies[:, 0], enemies[:, 1], e_hp[active],
+                variance, rng
+            )
+            p_hp[active] = p_after
+            e_hp[active] = e_after
+
+            # 败者退场，下一名出场者满HP
+            winners, losers = active[p_wins], active[~p_wins]
+            e_pos[winners] += 1
+            p_pos[losers] += 1
+            next_enemy = winners[e_pos[winners] < lineup_size]
+            e_hp[next_enemy] = lineup_stats[e_pos[next_enemy], 2]
+            next_party = losers[p_pos[losers] < party_size]
+            p_hp[next_party] = party_stats[order[next_party, p_pos[next_party]], 2]
+
+            active = active[(p_pos[active] < party_size) & (e_pos[active] < lineup_size)]
+
+        win_rates[start:start + len(chunk)] = (e_pos >= lineup_size).reshape(len(chunk), trials).mean(axis=1)
+    return compositions, win_rates
+
+def _modifier(modifiers, *keys):
+    """场景属性修饰值，格式如 {"strength": "+10"} 或 {"strength": 10}，无法解析时忽略"""
+    for key in keys:
+        if key in modifiers:
+            try:
+                return int(modifiers[key])
+            except (TypeError, ValueError):
+                return 0
+    return 0
+
+def _npc_stats(npc, modifiers=None):
+    modifiers = modifiers or {}
+    return [
+        npc.strength + _modifier(modifiers, "strength"),
+        npc.defense + _modifier(modifiers, "defense"),
+        npc.hp_max + _modifier(modifiers, "hp_max", "hp"),
+    ]
+
+def load_player_npc_pool(db, npc_ids=None):
+    """玩家可获取的NPC模板（或指定的NPC）"""
+    query = db.query(NPC).filter(NPC.is_active == True)
+    if npc_ids:
+        query = query.filter(NPC.id.in_(npc_ids))
+    else:
+        query = query.filter(NPC.npc_type == NPCType.PLAYER_NPC)
+    return query.order_by(NPC.npc_id).all()
+
+def score_scene(win_rates):
+    """
+    由各组合胜率计算评分（1-10）
+    难度：平均胜率越低越难；平衡：平均胜率接近50%、且不同组合之间有差异时更高
+    """
+    if len(win_rates) == 0:
+        return 5.0, 5.0, []
+    mean = float(np.mean(win_rates))
+    spread = float(np.std(win_rates))
+    difficulty = round(1 + 9 * (1 - mean), 2)
+    balance = round(max(1.0, 10 * (1 - abs(mean - 0.5) * 2) * 0.7 + 10 * min(spread * 2, 1) * 0.3), 2)
+
+    suggestions = []
+    if mean > 0.85:
+        suggestions.append("场景NPC阵容偏弱：几乎所有队伍组合都能获胜，可提高阵容属性或增加NPC")
+    elif mean < 0.15:
+        suggestions.append("场景NPC阵容偏强：几乎所有队伍组合都会失败，可降低阵容属性或减少NPC")
+    if spread < 0.05 and 0.15 <= mean <= 0.85:
+        suggestions.append("不同队伍组合胜率差异很小，队伍搭配对结果影响不大")
+    return difficulty, balance, suggestions
+
+def simulate_scene(db, scene_id, trials=100, variance=0.1, party_size=None, npc_ids=None, seed=None):
+    """模拟所有队伍组合挑战场景NPC阵容"""
+    configurations = db.query(SceneNPCConfiguration).filter(
+        SceneNPCConfiguration.scene_id == scene_id
+    ).order_by(SceneNPCConfiguration.speaking_order_priority).all()
+    lineup = [config for config in configurations if config.npc is not None]
+    pool = load_player_npc_pool(db, npc_ids)
+
+    if party_size is None:
+        entry = db.query(SceneEntryRequirement).filter(SceneEntryRequirement.scene_id == scene_id).first()
+        party_size = (entry.max_player_npcs if entry and entry.max_player_npcs else 3)
+
+    compositions, win_rates = simulate_party_vs_lineup(
+        [_npc_stats(npc) for npc in pool],
+        [_npc_stats(config.npc, config.attribute_modifiers) for config in lineup],
+        party_size, trials=trials, variance=variance, seed=seed
+    )
+    difficulty, balance, suggestions = score_scene(win_rates)
+
+    ranked = np.argsort(-win_rates, kind="stable") if len(win_rates) else []
+    def describe(index):
+        return {"npc_ids": [pool[i].npc_id for i in compositions[index]], "win_rate": round(float(win_rates[index]), 4)}
+
+    return {
+        "scene_id": scene_id,
+        "lineup": [config.npc.npc_id for config in lineup],
+        "party_size": int(compositions.shape[1]) if compositions.size else 0,
+        "compositions": int(len(compositions)),
+        "trials": trials,
+        "mean_win_rate": round(float(np.mean(win_rates)), 4) if len(win_rates) else None,
+        "best_compositions": [describe(i) for i in ranked[:5]],
+        "worst_compositions": [describe(i) for i in ranked[::-1][:5]],
+        "difficulty_rating": difficulty,
+        "balance_score": balance,
+        "suggested_adjustments": suggestions,
+    }
+
+def update_scene_analytics(db, result):
+    """把模拟结果写入场景最新的SceneAnalytics记录（没有则新建，未提交）"""
+    now = int(time.time())
+    analytics = db.query(SceneAnalytics).filter(
+        SceneAnalytics.scene_id == result["scene_id"]
+    ).order_by(SceneAnalytics.analysis_period_end.desc()).first()
+    if analytics is None:
+        analytics = SceneAnalytics(scene_id=result["scene_id"], analysis_period_start=now, analysis_period_end=now)
+        db.add(analytics)
+    analytics.difficulty_rating = result["difficulty_rating"]
+    analytics.balance_score = result["balance_score"]
+    analytics.suggested_adjustments = result["suggested_adjustments"]
+    return analytics
+
+def simulate_matchups(db, npc_ids=None, tier=None, trials=100, variance=0.1, seed=None):
+    """NPC两两对战胜率矩阵（默认所有活跃NPC）"""
+    query = db.query(NPC).filter(NPC.is_active == True)
+    if npc_ids:
+        query = query.filter(NPC.id.in_(npc_ids))
+    if tier:
+        query = query.filter(NPC.tier == tier)
+    npcs = query.order_by(NPC.tier, NPC.npc_id).all()
+    stats = np.array([_npc_stats(npc) for npc in npcs], dtype=np.int64).reshape(-1, 3)
+    matrix = matchup_matrix(stats[:, 0], stats[:, 1], stats[:, 2], trials=trials, variance=variance, seed=seed)
+    return {
+        "npcs": [{"id": npc.id, "npc_id": npc.npc_id, "name": npc.name, "tier": npc.tier.value} for npc in npcs],
+        "win_rates": np.round(matrix, 4).tolist(),
+        # 综合胜率：作为先手和后手的平均
+        "overall": np.round((matrix.mean(axis=1) + (1 - matrix).mean(axis=0)) / 2, 4).tolist() if len(npcs) else [],
+    }
+
+def main():
+    """
+    命令行入口（在 sultan_game 目录下）：
+        python -m core.balance matchups --trials 200 --output matchups.json
+        python -m core.balance scenes --save          # 所有场景，写入SceneAnalytics
+    """
+    import argparse
+    import json
+    from core.database import SessionLocal
+    from models import Scene
+
+    parser = argparse.ArgumentParser(description="战斗/场景平衡模拟")
+    parser.add_argument("mode", choices=["matchups", "scenes"])
+    parser.add_argument("--scene-id", action="append", dest="scene_ids", help="只模拟指定场景（可重复）")
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--variance", type=float, default=0.1, help="每次攻击伤害浮动比例，0为确定性结果")
+    parser.add_argument("--party-size", type=int)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--save", action="store_true", help="把场景评分写入SceneAnalytics")
+    parser.add_argument("--output", help="结果写入JSON文件")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        if args.mode == "matchups":
+            result = simulate_matchups(db, trials=args.trials, variance=args.variance, seed=args.seed)
+            overall = sorted(zip(result["npcs"], result["overall"]), key=lambda item: -item[1])
+            for npc, rate in overall:
+                print(f"{npc['npc_id']:<30} {npc['tier']:<10} {rate:>7.2%}")
+        else:
+            scene_ids = args.scene_ids or [scene_id for scene_id, in db.query(Scene.id).all()]
+            result = []
+            for scene_id in scene_ids:
+                scene_result = simulate_scene(
+                    db, scene_id, trials=args.trials, variance=args.variance,
+                    party_size=args.party_size, seed=args.seed
+                )
+                if args.save:
+                    update_scene_analytics(db, scene_result)
+                result.append(scene_result)
+                mean = scene_result["mean_win_rate"]
+                print(f"{scene_id}  阵容{len(scene_result['lineup'])}人  组合{scene_result['compositions']}  "
+                      f"胜率{'-' if mean is None else f'{mean:.2%}'}  难度{scene_result['difficulty_rating']}  "
+                      f"平衡{scene_result['balance_score']}")
+            if args.save:
+                db.commit()
+        print(f"耗时 {time.perf_counter() - start:.2f}s")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
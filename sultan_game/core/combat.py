@@ -0,0 +1,147 @@
+"""
+战斗引擎
+实现设计文档中的 combat_loop：双方轮流攻击（发起方先手），伤害 = max(攻击方STR - 防守方DEF, 10)，直到一方HP归零。
+每次攻击的伤害是常数，所以用算术直接得出需要的攻击次数、胜负和战后HP（O(1)），
+逐回合日志（combat_rounds）只在客户端需要时按需生成
+"""
+
+from models import CombatRecord
+import time
+
+# 每次攻击的最低伤害
+MIN_DAMAGE = 10
+
+def calculate_damage(attacker_str, defender_def):
+    """单次攻击伤害"""
+    return max(attacker_str - defender_def, MIN_DAMAGE)
+
+def _hits_to_kill(hp, damage):
+    """把hp打到0需要的攻击次数（向上取整）"""
+    return max(-(-hp // damage), 0)
+
+class Combatant:
+    """参战者快照"""
+    __slots__ = ("id", "name", "strength", "defense", "hp")
+
+    def __init__(self, id, name, strength, defense, hp):
+        self.id = id
+        self.name = name
+        self.strength = strength
+        self.defense = defense
+        self.hp = hp
+
+class CombatResult:
+    """
+    战斗结果（闭式计算）
+    total_rounds为攻击次数，与combat_loop返回的rounds列表长度一致
+    """
+
+    def __init__(self, attacker: Combatant, defender: Combatant):
+        self.attacker = attacker
+        self.defender = defender
+        self.attacker_damage = calculate_damage(attacker.strength, defender.defense)  # 发起方每次造成的伤害
+        self.defender_damage = calculate_damage(defender.strength, attacker.defense)  # 防守方每次造成的伤害
+
+        attacker_hits = _hits_to_kill(defender.hp, self.attacker_damage)
+        defender_hits = _hits_to_kill(attacker.hp, self.defender_damage)
+
+        # 发起方先手：先打满所需次数的一方获胜，打平时先手获胜
+        self.attacker_wins = attacker.hp > 0 and attacker_hits <= defender_hits
+        if self.attacker_wins:
+            self.total_rounds = max(2 * attacker_hits - 1, 0)
+            self.attacker_hp_after = max(attacker.hp - max(attacker_hits - 1, 0) * self.defender_damage, 0)
+            self.defender_hp_after = 0
+        else:
+            self.total_rounds = 2 * defender_hits
+            self.attacker_hp_after = 0
+            self.defender_hp_after = max(defender.hp - defender_hits * self.attacker_damage, 0)
+
+    @property
+    def winner(self):
+        return self.attacker if self.attacker_wins else self.defender
+
+    @property
+    def loser(self):
+        return self.defender if self.attacker_wins else self.attacker
+
+    def round_at(self, index):
+        """第index次攻击（从0开始）的日志，直接计算无需回放"""
+        if not 0 <= index < self.total_rounds:
+            raise IndexError(index)
+        attacker_turn = index % 2 == 0
+        hits = index // 2 + 1  # 本次攻击方已累计的攻击次数
+        if attacker_turn:
+            attacker, defender, damage = self.attacker, self.defender, self.attacker_damage
+        else:
+            attacker, defender, damage = self.defender, self.attacker, self.defender_damage
+        return {
+            "round": index + 1,
+            "attacker": attacker.name,
+            "defender": defender.name,
+            "damage": damage,
+            "defender_hp_remaining": max(defender.hp - hits * damage, 0)
+        }
+
+    def rounds(self, offset=0, limit=None):
+        """按需生成逐回合日志"""
+        end = self.total_rounds if limit is None else min(self.total_rounds, offset + limit)
+        for index in range(max(offset, 0), end):
+            yield self.round_at(index)
+
+    def summary(self):
+        return {
+            "winner_id": self.winner.id,
+            "winner_name": self.winner.name,
+            "loser_id": self.loser.id,
+            "loser_name": self.loser.name,
+            "total_rounds": self.total_rounds,
+            "attacker_damage": self.attacker_damage,
+            "defender_damage": self.defender_damage,
+            "attacker_hp_after": self.attacker_hp_after,
+            "defender_hp_after": self.defender_hp_after
+        }
+
+def resolve_combat(attacker: Combatant, defender: Combatant) -> CombatResult:
+    """结算一场战斗"""
+    return CombatResult(attacker, defender)
+
+def result_from_record(record: CombatRecord) -> CombatResult:
+    """从战斗记录的战前状态重建结果（用于按需生成回合日志）"""
+    return CombatResult(
+        Combatant(record.attacker_id, record.attacker_name, record.attacker_str, record.attacker_def, record.attacker_hp_before),
+        Combatant(record.defender_id, record.defender_name, record.defender_str, record.defender_def, record.defender_hp_before)
+    )
+
+def create_combat_record(db, session_id, round_id, speech_id, attacker: Combatant, defender: Combatant,
+                         loser_removed=True, scene_impact=None):
+    """
+    结算战斗并写入CombatRecord（未提交）
+    combat_rounds不落库，需要时由result_from_record(record).rounds()生成
+    """
+    result = resolve_combat(attacker, defender)
+    record = CombatRecord(
+        session_id=session_id,
+        round_id=round_id,
+        speech_id=speech_id,
+        attacker_id=attacker.id,
+        attacker_name=attacker.name,
+        defender_id=defender.id,
+        defender_name=defender.name,
+        attacker_hp_before=attacker.hp,
+        attacker_str=attacker.strength,
+        attacker_def=attacker.defense,
+        defender_hp_before=defender.hp,
+        defender_str=defender.strength,
+        defender_def=defender.defense,
+        combat_rounds=[],
+        total_rounds=result.total_rounds,
+        winner_id=result.winner.id,
+        loser_id=result.loser.id,
+        attacker_hp_after=result.attacker_hp_after,
+        defender_hp_after=result.defender_hp_after,
+        loser_removed=loser_removed,
+        scene_impact=scene_impact or {},
+        occurred_at=int(time.time())
+    )
+    db.add(record)
+    return record, result
@@ -0,0 +1,179 @@
+"""
+仪表板统计模块
+各表的数量只在启动（及定期校准）时COUNT一次，之后由Session提交事件增量维护；
+最近活动保存在内存环形缓冲区中。仪表板接口的开销为O(1)
+"""
+
+from collections import deque
+from sqlalchemy import event, func, inspect, select
+from core.database import SessionLocal
+from models import Scene, NPC, Card, AIConfig, Player, ScenePlaySession
+import os
+import threading
+import time
+
+# 计数定期与数据库校准的间隔（秒），用于纠正多进程部署或绕过ORM的写入造成的偏差
+STATS_RESYNC_SECONDS = int(os.getenv("STATS_RESYNC_SECONDS", "3600"))
+# 保留的最近活动条数
+ACTIVITY_BUFFER_SIZE = int(os.getenv("ACTIVITY_BUFFER_SIZE", "100"))
+
+# 统计项 -> (模型, 是否只统计is_active=True)
+COUNTED_MODELS = {
+    "scenes": (Scene, True),
+    "npcs": (NPC, True),
+    "cards": (Card, True),
+    "ai_configs": (AIConfig, True),
+    "active_players": (Player, True),
+    "total_sessions": (ScenePlaySession, False),
+}
+
+# 记录活动的模型 -> (显示名称, 活动类型前缀)
+ACTIVITY_MODELS = {
+    Scene: ("场景", "scene"),
+    NPC: ("NPC", "npc"),
+    Card: ("卡片", "card"),
+    AIConfig: ("AI智能体", "ai_config"),
+}
+
+_MODEL_STAT_KEYS = {model: key for key, (model, _) in COUNTED_MODELS.items()}
+
+_lock = threading.Lock()
+_counts = {}
+_synced_at = 0
+_activities = deque(maxlen=ACTIVITY_BUFFER_SIZE)
+
+def _count_query():
+    """所有统计项合并为一条查询"""
+    columns = []
+    for key, (model, active_only) in COUNTED_MODELS.items():
+        query = select(func.count()).select_from(model)
+        if active_only:
+            query = query.where(model.is_active == True)
+        columns.append(query.scalar_subquery().label(key))
+    return select(*columns)
+
+def resync_counts(db=None):
+    """从数据库重新统计各表数量"""
+    global _synced_at
+    session = db or SessionLocal()
+    try:
+        row = session.execute(_count_query()).one()
+    finally:
+        if db is None:
+            session.close()
+    with _lock:
+        _counts.clear()
+        _counts.update(row._asdict())
+        _synced_at = time.time()
+
+def get_stats():
+    """获取仪表板统计数据"""
+    if not _counts or time.time() - _synced_at > STATS_RESYNC_SECONDS:
+        resync_counts()
+    with _lock:
+        return dict(_counts)
+
+def get_activities(limit=20):
+    """获取最近活动（最新的在前）"""
+    with _lock:
+        return list(_activities)[-limit:][::-1] if limit > 0 else []
+
+def record_activity(activity_type, description, user="admin"):
+    """记录一条活动"""
+    with _lock:
+        _activities.append({
+            "timestamp": int(time.time()),
+            "description": description,
+            "type": activity_type,
+            "user": user
+        })
+
+def _is_counted(obj, active_only, active=None):
+    if not active_only:
+        return True
+    return bool(obj.is_active if active is None else active)
+
+def _collect_changes(session):
+    """收集本次flush中统计相关的变化：计数增量和活动"""
+    deltas = {}
+    activities = []
+    
+    for obj in session.new:
+        key = _MODEL_STAT_KEYS.get(type(obj))
+        if key and _is_counted(obj, COUNTED_MODELS[key][1]):
+            deltas[key] = deltas.get(key, 0) + 1
+        if type(obj) in ACTIVITY_MODELS:
+            label, prefix = ACTIVITY_MODELS[type(obj)]
+            activities.append((f"{prefix}_created", f"创建了新{label}'{obj.name}'"))
+    
+    for obj in session.dirty:
+        if not session.is_modified(obj):
+            continue
+        key = _MODEL_STAT_KEYS.get(type(obj))
+        deactivated = False
+        if key and COUNTED_MODELS[key][1]:
+            history = inspect(obj).attrs.is_active.history
+            if history.has_changes():
+                before = bool(history.deleted[0]) if history.deleted else None
+                after = bool(obj.is_active)
+                if before is not None and before != after:
+                    deltas[key] = deltas.get(key, 0) + (1 if after else -1)
+                    deactivated = not after
+        if type(obj) in ACTIVITY_MODELS:
+            label, prefix = ACTIVITY_MODELS[type(obj)]
+            if deactivated:
+                activities.append((f"{prefix}_deleted", f"删除了{label}'{obj.name}'"))
+            else:
+                activities.append((f"{prefix}_updated", f"更新了{label}'{obj.name}'的配置"))
+    
+    for obj in session.deleted:
+        key = _MODEL_STAT_KEYS.get(type(obj))
+        if key and _is_counted(obj, COUNTED_MODELS[key][1]):
+            deltas[key] = deltas.get(key, 0) - 1
+        if type(obj) in ACTIVITY_MODELS:
+            label, prefix = ACTIVITY_MODELS[type(obj)]
+            activities.append((f"{prefix}_deleted", f"删除了{label}'{obj.name}'"))
+    
+    return deltas, activities
+
+def _add_pending(session, deltas, activities):
+    pending = session.info.setdefault("dashboard_pending", {"deltas": {}, "activities": []})
+    for key, delta in deltas.items():
+        pending["deltas"][key] = pending["deltas"].get(key, 0) + delta
+    pending["activities"].extend(activities)
+
+def track_bulk_insert(session, model, count):
+    """
+    记录绕过ORM对象的批量插入（不会触发flush事件），在会话提交时计入统计
+    """
+    key = _MODEL_STAT_KEYS.get(model)
+    if not key or count <= 0:
+        return
+    activities = []
+    if model in ACTIVITY_MODELS:
+        label, prefix = ACTIVITY_MODELS[model]
+        activities.append((f"{prefix}_imported", f"批量导入了{count}个{label}"))
+    _add_pending(session, {key: count}, activities)
+
+@event.listens_for(SessionLocal, "after_flush")
+def _after_flush(session, flush_context):
+    deltas, activities = _collect_changes(session)
+    if deltas or activities:
+        _add_pending(session, deltas, activities)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session):
+    pending = session.info.pop("dashboard_pending", None)
+    if not pending:
+        return
+    with _lock:
+        # 尚未初始化时不累加，首次读取时会完整统计
+        if _counts:
+            for key, delta in pending["deltas"].items():
+                _counts[key] = _counts.get(key, 0) + delta
+    for activity_type, description in pending["activities"]:
+        record_activity(activity_type, description)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("dashboard_pending", None)
@@ -1,7 +1,13 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import TypeDecorator, Text, String
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
 import os
+import time
 
 # 使用SQLite作为开发数据库，生产环境使用PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sultan_game.db")
@@ -12,13 +18,144 @@ if DATABASE_URL.startswith("sqlite"):
 else:
     engine = create_engine(DATABASE_URL)
 
+# 慢查询阈值（毫秒）
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+class JSONText(TypeDecorator):
+    """
+    以JSON字符串存储在Text列中的类型
+    写入时自动json.dumps，读取时在结果行处理阶段json.loads一次，
+    兼容已有的JSON字符串数据
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return json.dumps(value, ensure_ascii=False)
+
+    def process_result_value(self, value, dialect):
+        if value is None or value == "":
+            return None
+        if value == "[]":
+            return []
+        return json.loads(value)
+
+class EnumValue(TypeDecorator):
+    """
+    只读的枚举值列类型，配合type_coerce用于列投影查询
+    Enum列在数据库中保存的是枚举名（如 MAIN_STORY），这里直接映射为枚举值字符串（如 main_story），
+    省去逐行构造枚举对象再取.value
+    """
+    impl = String
+    cache_ok = True
+
+    def __init__(self, enum_class):
+        super().__init__()
+        self.enum_class = enum_class
+        self._values = {member.name: member.value for member in enum_class}
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._values.get(value, value)
+
+class QueryCounter:
+    """
+    统计代码块内执行的SQL语句数量（测试模式使用，用于发现N+1查询）
+    
+    用法:
+        with QueryCounter() as counter:
+            ...
+        counter.count / counter.statements
+    """
+    def __init__(self, bind=None):
+        self.bind = bind if bind is not None else engine
+        self.count = 0
+        self.statements = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.bind, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event.remove(self.bind, "before_cursor_execute", self._on_execute)
+        return False
+
+@contextmanager
+def assert_max_queries(limit, bind=None):
+    """
+    断言代码块内执行的SQL语句不超过limit条，超出时抛出AssertionError并列出所有语句
+    接口的语句数应与返回行数无关
+    """
+    with QueryCounter(bind) as counter:
+        yield counter
+    if counter.count > limit:
+        statements = "\n".join(counter.statements)
+        raise AssertionError(f"Expected at most {limit} SQL statements, got {counter.count}:\n{statements}")
+
+class RequestQueryStats:
+    """单个API请求内的SQL统计：语句数、总耗时、慢查询"""
+    __slots__ = ("count", "total_time", "slow_statements")
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slow_statements = []
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        if elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+            self.slow_statements.append((statement, elapsed))
+
+# 当前请求的SQL统计，由log_requests中间件在请求开始时设置
+_request_query_stats = ContextVar("request_query_stats", default=None)
+
+def start_request_query_stats():
+    """
+    为当前请求开始SQL统计
+    返回(stats, token)，请求结束后调用reset_request_query_stats(token)
+    """
+    stats = RequestQueryStats()
+    return stats, _request_query_stats.set(stats)
+
+def reset_request_query_stats(token):
+    """结束当前请求的SQL统计"""
+    _request_query_stats.reset(token)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = _request_query_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        logging.getLogger("database").warning(f"Slow query {elapsed * 1000:.1f}ms: {statement}")
+
+@event.listens_for(engine, "handle_error")
+def _handle_error(exception_context):
+    # 语句执行失败时after_cursor_execute不会触发，弹出对应的开始时间
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
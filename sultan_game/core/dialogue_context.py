@@ -0,0 +1,250 @@
+"""
+对话上下文窗口与token预算
+每个会话在内存中保留最近的发言（滚动窗口，最多 CONTEXT_WINDOW_TOKENS）和更早发言的摘要：
+发言超出窗口时，最早的发言压缩进摘要（按轮合并，每条发言只保留首句），摘要超出 CONTEXT_SUMMARY_TOKENS
+时丢弃最早的轮次。窗口和摘要都是增量更新的，每次发言只处理被挤出的那几条。
+
+智能体调用时按其AIConfig的token预算（scene_specific_config.context_tokens / model_config.context_tokens /
+CONTEXT_TOKEN_BUDGET）取 摘要 + 尽可能多的最近发言，放不下的窗口内发言同样只保留首句，
+所以每次调用的提示词长度不随轮数增长。
+
+窗口由 dialogue_engine.add_speech 更新；服务重启后首次编排时从数据库重建
+（AISession.context_memory 中保存的摘要 + 最近的发言）。
+"""
+
+from collections import deque
+from sqlalchemy import func
+from models import AISession, DialogueRound, DialogueSpeech
+import math
+import os
+import re
+import threading
+import uuid
+
+CONTEXT_WINDOW_TOKENS = int(os.getenv("CONTEXT_WINDOW_TOKENS", "3000"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "600"))
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+GIST_CHARS = 40  # 摘要中每条发言保留的最大字符数
+RELOAD_SPEECHES = 200  # 重建窗口时最多读取的发言数
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_SENTENCE_END = re.compile(r"[。！？!?\n]")
+
+def estimate_tokens(text):
+    """粗略估算token数：中文字符和全角标点各算1个，其余约4个字符1个"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+# 摘要段落的标题行
+_HEADERS = ("【此前对话摘要】", "（更早的对话已省略）", "【最近对话】")
+_HEADER_TOKENS = sum(estimate_tokens(header) + 1 for header in _HEADERS)
+
+def gist(text):
+    """发言的首句，超过GIST_CHARS时截断"""
+    text = text.strip()
+    match = _SENTENCE_END.search(text)
+    if match:
+        text = text[:match.end()].strip()
+    return text if len(text) <= GIST_CHARS else text[:GIST_CHARS] + "…"
+
+class _Entry:
+    __slots__ = ("id", "round_number", "speaker", "text", "tokens")
+
+    def __init__(self, id, round_number, speaker, text):
+        self.id = id
+        self.round_number = round_number
+        self.speaker = speaker or "?"
+        self.text = text
+        self.tokens = estimate_tokens(self.line())
+
+    def line(self):
+        return f"{self.speaker}: {self.text}"
+
+def _summary_lines(entries, lines=None):
+    """把发言按轮合并为摘要行 [[round_number, text]]，追加到lines"""
+    lines = lines if lines is not None else []
+    for entry in entries:
+        part = f"{entry.speaker}：{gist(entry.text)}"
+        if lines and lines[-1][0] == entry.round_number:
+            lines[-1][1] += f"；{part}"
+        else:
+            lines.append([entry.round_number, f"第{entry.round_number}轮 {part}"])
+    return lines
+
+class ContextMemory:
+    """一个会话的滚动窗口和摘要"""
+
+    def __init__(self, loaded=True):
+        self.recent = deque()
+        self.recent_tokens = 0
+        self.summary = []  # [[round_number, text]]，每轮一行
+        self.summary_tokens = 0
+        self.summarized = 0  # 已压缩进摘要的发言数
+        self.truncated = False  # 是否丢弃过最早的摘要
+        self.loaded = loaded  # False表示服务重启后尚未从数据库重建
+        self.lock = threading.Lock()
+
+    def append(self, entry):
+        with self.lock:
+            self._append(entry)
+
+    def _append(self, entry):
+        self.recent.append(entry)
+        self.recent_tokens += entry.tokens
+        evicted = []
+        while self.recent_tokens > CONTEXT_WINDOW_TOKENS and len(self.recent) > 1:
+            oldest = self.recent.popleft()
+            self.recent_tokens -= oldest.tokens
+            evicted.append(oldest)
+        if evicted:
+            self._compact(evicted)
+
+    def _compact(self, entries):
+        # 只重新计算最后一行（可能被追加）和新增的行
+        start = max(0, len(self.summary) - 1)
+        if self.summary:
+            self.summary_tokens -= estimate_tokens(self.summary[-1][1])
+        _summary_lines(entries, self.summary)
+        self.summary_tokens += sum(estimate_tokens(text) for _, text in self.summary[start:])
+        self.summarized += len(entries)
+        while self.summary_tokens > CONTEXT_SUMMARY_TOKENS and len(self.summary) > 1:
+            _, text = self.summary.pop(0)
+            self.summary_tokens -= estimate_tokens(text)
+            self.truncated = True
+
+    def render(self, budget):
+        """
+        在budget个token内组装对话历史，返回 (文本, 使用的token数)
+        优先放最近的发言（至少留四分之一给摘要），其余窗口内发言和摘要按首句压缩，越新越优先
+        """
+        with self.lock:
+            recent = list(self.recent)
+            summary = [list(line) for line in self.summary]
+            truncated = self.truncated
+
+        reserve = budget // 4 if summary or len(recent) > 1 else 0
+        used = 0
+        split = len(recent)
+        while split > 0 and used + recent[split - 1].tokens <= budget - reserve:
+            split -= 1
+            used += recent[split].tokens
+        if split == len(recent) and recent:
+            # 最近一条发言单独就超出预算时截断后保留
+            split -= 1
+            last = recent[split]
+            room = max(1, budget - reserve - estimate_tokens(last.speaker) - 3)
+            recent[split] = _Entry(last.id, last.round_number, last.speaker, last.text[:room] + "…")
+            used += recent[split].tokens
+
+        summary = _summary_lines(recent[:split], summary)
+        kept = []
+        used += _HEADER_TOKENS
+        for _, text in reversed(summary):
+            tokens = estimate_tokens(text) + 1
+            if used + tokens > budget:
+                truncated = True
+                break
+            kept.append(text)
+            used += tokens
+        kept.reverse()
+
+        parts = []
+        if kept:
+            parts.append(_HEADERS[0])
+            if truncated:
+                parts.append(_HEADERS[1])
+            parts.extend(kept)
+            parts.append(_HEADERS[2])
+        parts.extend(entry.line() for entry in recent[split:])
+        text = "\n".join(parts)
+        return text, estimate_tokens(text)
+
+    def last_utterance(self):
+        with self.lock:
+            return self.recent[-1].text if self.recent else ""
+
+    def snapshot(self):
+        """保存到AISession.context_memory的摘要状态"""
+        with self.lock:
+            return {
+                "summary": [list(line) for line in self.summary],
+                "summarized_speeches": self.summarized,
+                "truncated": self.truncated,
+                "window_speeches": len(self.recent),
+                "window_tokens": self.recent_tokens,
+            }
+
+_memories = {}
+_lock = threading.Lock()
+
+def _get(session_id, create=True):
+    with _lock:
+        memory = _memories.get(session_id)
+        if memory is None and create:
+            # 会话不是在本进程中创建的（服务重启后恢复），需要从数据库重建
+            memory = _memories[session_id] = ContextMemory(loaded=False)
+        return memory
+
+def start(session_id):
+    """新会话：空窗口，无需从数据库重建"""
+    with _lock:
+        _memories[session_id] = ContextMemory()
+
+def record(session_id, speech_id, round_number, speaker_name, speech_text):
+    _get(session_id).append(_Entry(speech_id, round_number, speaker_name, speech_text))
+
+def discard(session_id):
+    with _lock:
+        _memories.pop(session_id, None)
+
+def ensure_loaded(db, session_id):
+    """服务重启后首次使用时，从AISession.context_memory和最近的发言重建窗口"""
+    memory = _get(session_id)
+    if memory.loaded:
+        return memory
+
+    states = [row.context_memory for row in db.query(AISession.context_memory).filter(
+        AISession.dialogue_session_id == uuid.UUID(session_id))]
+    saved = max((state for state in states if state and state.get("summary") is not None),
+                key=lambda state: state.get("summarized_speeches", 0), default=None)
+    total = db.query(func.count(DialogueSpeech.id)).filter(DialogueSpeech.session_id == session_id).scalar()
+    rows = db.query(DialogueSpeech.id, DialogueRound.round_number, DialogueSpeech.speaker_name,
+                    DialogueSpeech.speech_text).join(
+        DialogueRound, DialogueSpeech.round_id == DialogueRound.id
+    ).filter(DialogueSpeech.session_id == session_id).order_by(
+        DialogueRound.round_number.desc(), DialogueSpeech.speech_order.desc()
+    ).limit(RELOAD_SPEECHES).all()
+
+    with memory.lock:
+        if memory.loaded:
+            return memory
+        pending = list(memory.recent)
+        seen = {entry.id for entry in pending}
+        memory.recent.clear()
+        memory.recent_tokens = 0
+        if saved:
+            memory.summary = [list(line) for line in saved["summary"]]
+            memory.summary_tokens = sum(estimate_tokens(text) for _, text in memory.summary)
+            memory.summarized = saved.get("summarized_speeches", 0)
+            memory.truncated = saved.get("truncated", False)
+        # 已在摘要中的发言不再放入窗口
+        rows.reverse()
+        if saved:
+            unsummarized = max(0, total - memory.summarized)
+            rows = rows[len(rows) - unsummarized:] if unsummarized else []
+        for row in rows:
+            if row.id not in seen:
+                memory._append(_Entry(row.id, row.round_number, row.speaker_name, row.speech_text))
+        for entry in pending:
+            memory._append(entry)
+        memory.loaded = True
+    return memory
+
+def get_memory(session_id):
+    return _get(session_id, create=False)
+
+def token_budget(agent):
+    """智能体每次调用的对话历史token预算"""
+    return int(agent.overrides.get("context_tokens", agent.settings.get("context_tokens", DEFAULT_TOKEN_BUDGET)))
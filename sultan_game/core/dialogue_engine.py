@@ -0,0 +1,739 @@
+"""
+对话会话引擎
+进行中会话的状态（发言顺序、当前发言者、评分、退场NPC）保存在内存中，发言/轮次/战斗记录写入
+write-behind缓冲区：每轮结束时交给后台线程批量落库（每个模型一次executemany），也会按时间间隔和
+缓冲区大小定期刷新，所以玩家每次发言不产生同步的数据库往返。
+
+会话、轮次的ID在内存中生成，发言在落库前即可引用；服务重启时从数据库恢复进行中的会话
+（最多丢失最后一次刷新之后、尚未落库的发言，刷新间隔由 DIALOGUE_FLUSH_INTERVAL 控制）。
+超过 DIALOGUE_IDLE_TTL 秒没有任何状态变化、也没有推送订阅者的会话由后台线程刷新落库后移出内存
+（会话在数据库中仍为进行中，再次访问时按需恢复），同时关闭其推送主题并释放上下文窗口；
+该线程也定期清理 core.response_cache 中的过期条目。
+
+每次状态变化同时发布到 core.pubsub（主题为会话ID），AI生成过程中的增量文本通过 stream_partial
+发布，供SSE/WebSocket实时推送。
+
+用法:
+    state = create_session(db, player_id, scene_id, scene_npcs=[...], player_npcs=[...])
+    add_speech(state.id, SpeakerType.SCENE_NPC, npc_id, "宰相", "……")
+    end_round(state.id, story_progress=10, tension_level=20)
+    end_session(state.id, SessionStatus.COMPLETED, "success")
+"""
+
+from sqlalchemy import insert, update, func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from core.database import SessionLocal
+from core import dialogue_context, pubsub, response_cache
+from core.combat import Combatant, resolve_combat
+from core.logging_config import get_logger
+from contextlib import contextmanager
+from models import (
+    DialogueSession, DialogueRound, DialogueSpeech, SessionStatus, SpeakerType, CombatRecord,
+    Player, Scene
+)
+import atexit
+import os
+import random
+import threading
+import time
+import uuid
+
+logger = get_logger(__name__)
+
+# 后台刷新间隔（秒）和触发立即刷新的缓冲发言数
+FLUSH_INTERVAL = float(os.getenv("DIALOGUE_FLUSH_INTERVAL", "2"))
+MAX_BUFFERED_SPEECHES = int(os.getenv("DIALOGUE_MAX_BUFFERED_SPEECHES", "500"))
+# 空闲会话移出内存的时间（秒，0为不移出）和检查间隔
+IDLE_TTL = float(os.getenv("DIALOGUE_IDLE_TTL", "1800"))
+IDLE_SWEEP_INTERVAL = 60  # 空闲会话和过期响应缓存的检查间隔（秒）
+
+class SessionError(ValueError):
+    """会话不存在、已结束或操作不合法"""
+
+class RoundState:
+    """当前轮次"""
+    __slots__ = ("id", "round_number", "speaking_order", "speeches_count", "is_complete",
+                 "story_progress", "dialogue_quality", "tension_level", "special_flags",
+                 "evaluation_result", "started_at", "completed_at")
+
+    def __init__(self, id, round_number, speaking_order, started_at=None):
+        self.id = id
+        self.round_number = round_number
+        self.speaking_order = speaking_order
+        self.speeches_count = 0
+        self.is_complete = False
+        self.story_progress = 0
+        self.dialogue_quality = 0
+        self.tension_level = 0
+        self.special_flags = []
+        self.evaluation_result = None
+        self.started_at = started_at or int(time.time())
+        self.completed_at = None
+
+    def row(self, session_id):
+        return {
+            "id": self.id,
+            "session_id": session_id,
+            "round_number": self.round_number,
+            "speaking_order": list(self.speaking_order),
+            "participants_count": len(self.speaking_order),
+            "is_complete": self.is_complete,
+            "speeches_count": self.speeches_count,
+            "story_progress": self.story_progress,
+            "dialogue_quality": self.dialogue_quality,
+            "tension_level": self.tension_level,
+            "special_flags": list(self.special_flags),
+            "evaluation_result": self.evaluation_result,
+            "started_at": self.started_at,
+            "completed_at": self.completed_at,
+        }
+
+class SessionState:
+    """进行中会话的内存状态"""
+    __slots__ = ("id", "player_id", "scene_id", "status", "scene_npcs", "player_npcs", "npcs_removed",
+                 "current_speaker_index", "waiting_for_player", "total_speeches",
+                 "total_story_progress", "total_tension_level", "combat_occurred",
+                 "final_result", "dice_triggered", "dice_result", "started_at", "ended_at",
+                 "round", "round_ids", "speech_ids", "last_activity", "lock")
+
+    def __init__(self, id, player_id, scene_id, scene_npcs=None, player_npcs=None, started_at=None):
+        self.id = id
+        self.player_id = player_id
+        self.scene_id = scene_id
+        self.status = SessionStatus.ACTIVE
+        self.scene_npcs = list(scene_npcs or [])
+        self.player_npcs = list(player_npcs or [])
+        self.npcs_removed = []
+        self.current_speaker_index = 0
+        self.waiting_for_player = False
+        self.total_speeches = 0
+        self.total_story_progress = 0
+        self.total_tension_level = 0
+        self.combat_occurred = False
+        self.final_result = None
+        self.dice_triggered = False
+        self.dice_result = {}
+        self.started_at = started_at or int(time.time())
+        self.ended_at = None
+        self.round = None
+        self.round_ids = []
+        self.speech_ids = set()  # 本进程中记录的发言ID（战斗记录引用发言时校验）
+        self.last_activity = time.monotonic()  # 最近一次状态变化或推送，空闲检查使用
+        self.lock = threading.RLock()
+
+    @property
+    def active_participants(self):
+        removed = set(self.npcs_removed)
+        return [npc_id for npc_id in self.scene_npcs + self.player_npcs if npc_id not in removed]
+
+    @property
+    def current_speaker(self):
+        order = self.round.speaking_order if self.round else []
+        return order[self.current_speaker_index] if self.current_speaker_index < len(order) else None
+
+    def row(self):
+        return {
+            "id": self.id,
+            "player_id": self.player_id,
+            "scene_id": self.scene_id,
+            "status": self.status,
+            "current_round": self.round.round_number if self.round else 0,
+            "total_speeches": self.total_speeches,
+            "scene_npcs": list(self.scene_npcs),
+            "player_npcs": list(self.player_npcs),
+            "active_participants": self.active_participants,
+            "current_speaking_order": list(self.round.speaking_order) if self.round else [],
+            "current_speaker_index": self.current_speaker_index,
+            "waiting_for_player": self.waiting_for_player,
+            "total_story_progress": self.total_story_progress,
+            "total_tension_level": self.total_tension_level,
+            "combat_occurred": self.combat_occurred,
+            "npcs_removed": list(self.npcs_removed),
+            "final_result": self.final_result,
+            "dice_triggered": self.dice_triggered,
+            "dice_result": dict(self.dice_result or {}),
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+        }
+
+    def to_dict(self):
+        data = self.row()
+        data["status"] = self.status.value
+        data["current_speaker"] = self.current_speaker
+        data["round_id"] = self.round.id if self.round else None
+        data["round_complete"] = self.round.is_complete if self.round else False
+        return data
+
+class _Buffer:
+    """待落库的数据：会话/轮次按ID保存最新快照，发言和战斗记录按顺序追加"""
+    __slots__ = ("sessions", "rounds", "speeches", "combats")
+
+    def __init__(self):
+        self.sessions = {}
+        self.rounds = {}
+        self.speeches = []
+        self.combats = []
+
+    def __bool__(self):
+        return bool(self.sessions or self.rounds or self.speeches or self.combats)
+
+    def merge_older(self, older):
+        """把刷新失败的旧数据放回缓冲区（新的快照优先，追加记录保持顺序）"""
+        self.sessions = {**older.sessions, **self.sessions}
+        self.rounds = {**older.rounds, **self.rounds}
+        self.speeches = older.speeches + self.speeches
+        self.combats = older.combats + self.combats
+
+_sessions = {}
+_registry_lock = threading.Lock()
+_buffer = _Buffer()
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_persisted = set()  # 已落库的会话/轮次ID（决定INSERT还是UPDATE）
+_flush_requested = threading.Event()
+_flusher = None
+_stopping = threading.Event()
+_random = random.Random()
+
+# ---- 缓冲区 ----
+
+def _stage(state, round_state=None, speech=None, combat=None):
+    """把会话（和轮次）最新状态及新增记录放入缓冲区，调用方持有state.lock"""
+    state.last_activity = time.monotonic()
+    with _buffer_lock:
+        _buffer.sessions[state.id] = state.row()
+        for current in (round_state, state.round):
+            if current is not None:
+                _buffer.rounds[current.id] = current.row(state.id)
+        if speech is not None:
+            _buffer.speeches.append(speech)
+        if combat is not None:
+            _buffer.combats.append(combat)
+        overflow = len(_buffer.speeches) >= MAX_BUFFERED_SPEECHES
+    if overflow:
+        request_flush()
+
+def _publish(state, event, data):
+    """推送给订阅该会话的客户端，调用方持有state.lock以保证事件顺序"""
+    state.last_activity = time.monotonic()
+    pubsub.broker.publish(state.id, event, data)
+
+def _split(rows):
+    inserts = [row for row in rows if row["id"] not in _persisted]
+    updates = [row for row in rows if row["id"] in _persisted]
+    return inserts, updates
+
+def _batches(pending):
+    """按外键依赖顺序（会话 -> 轮次 -> 发言 -> 战斗记录）返回 [(model, statement, rows)]"""
+    session_inserts, session_updates = _split(pending.sessions.values())
+    round_inserts, round_updates = _split(pending.rounds.values())
+    return [
+        (DialogueSession, insert, session_inserts), (DialogueRound, insert, round_inserts),
+        (DialogueSpeech, insert, pending.speeches), (CombatRecord, insert, pending.combats),
+        (DialogueSession, update, session_updates), (DialogueRound, update, round_updates),
+    ]
+
+def _mark_persisted(model, statement, rows):
+    if statement is insert and model in (DialogueSession, DialogueRound):
+        _persisted.update(row["id"] for row in rows)
+
+def _flush_rows(db, batches):
+    """
+    批量写入因约束错误失败后逐行写入：违反约束的行记录日志后丢弃，不再放回缓冲区，
+    否则同一批数据每次刷新都会失败，之后的数据都无法落库
+    """
+    dropped = 0
+    for index, (model, statement, rows) in enumerate(batches):
+        for position, row in enumerate(rows):
+            try:
+                db.execute(statement(model), [row])
+                db.commit()
+            except IntegrityError as e:
+                db.rollback()
+                dropped += 1
+                logger.error(f"丢弃无法写入的{model.__tablename__}记录 {row.get('id')}: {e.orig}")
+                continue
+            except SQLAlchemyError:
+                db.rollback()
+                # 数据库不可用：未写入的行放回缓冲区
+                remaining = _Buffer()
+                for later_model, later_statement, later_rows in [(model, statement, rows[position:])] + \
+                        batches[index + 1:]:
+                    _requeue(remaining, later_model, later_statement, later_rows)
+                with _buffer_lock:
+                    _buffer.merge_older(remaining)
+                raise
+            _mark_persisted(model, statement, [row])
+    return dropped
+
+def _requeue(buffer, model, statement, rows):
+    if model is DialogueSession:
+        buffer.sessions.update((row["id"], row) for row in rows)
+    elif model is DialogueRound:
+        buffer.rounds.update((row["id"], row) for row in rows)
+    elif model is DialogueSpeech:
+        buffer.speeches.extend(rows)
+    else:
+        buffer.combats.extend(rows)
+
+def flush():
+    """
+    把缓冲区批量写入数据库（一个事务）
+    数据库不可用时数据放回缓冲区等待下次刷新；违反约束时改为逐行写入并丢弃出错的行
+    """
+    global _buffer
+    with _flush_lock:
+        with _buffer_lock:
+            pending, _buffer = _buffer, _Buffer()
+        if not pending:
+            return 0
+
+        batches = _batches(pending)
+        db = SessionLocal()
+        try:
+            for model, statement, rows in batches:
+                if rows:
+                    db.execute(statement(model), rows)
+            db.commit()
+        except IntegrityError as e:
+            db.rollback()
+            logger.error(f"对话数据批量刷新违反约束，改为逐行写入: {e.orig}")
+            _flush_rows(db, batches)
+            return len(pending.speeches)
+        except SQLAlchemyError as e:
+            db.rollback()
+            with _buffer_lock:
+                _buffer.merge_older(pending)
+            logger.error(f"对话数据刷新失败，将在下次刷新时重试: {e}")
+            raise
+        finally:
+            db.close()
+
+        for model, statement, rows in batches:
+            _mark_persisted(model, statement, rows)
+        return len(pending.speeches)
+
+def request_flush():
+    """通知后台线程尽快刷新；后台线程未启动时直接同步刷新"""
+    if _flusher is not None and _flusher.is_alive():
+        _flush_requested.set()
+    else:
+        flush()
+
+def _flush_loop():
+    last_sweep = time.monotonic()
+    while not _stopping.is_set():
+        _flush_requested.wait(FLUSH_INTERVAL)
+        _flush_requested.clear()
+        try:
+            flush()
+            if time.monotonic() - last_sweep >= IDLE_SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                response_cache.purge_expired()
+                if IDLE_TTL > 0:
+                    evict_idle()
+        except SQLAlchemyError:
+            pass  # 已记录日志，数据保留在缓冲区
+
+def start():
+    """启动后台刷新线程并恢复进行中的会话（应用启动时调用一次）"""
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    recover()
+    _stopping.clear()
+    _flusher = threading.Thread(target=_flush_loop, name="dialogue-flusher", daemon=True)
+    _flusher.start()
+    atexit.register(shutdown)
+
+def shutdown():
+    """停止后台线程并刷新剩余数据"""
+    global _flusher
+    _stopping.set()
+    _flush_requested.set()
+    if _flusher is not None:
+        _flusher.join(timeout=FLUSH_INTERVAL + 5)
+        _flusher = None
+    flush()
+
+# ---- 会话状态 ----
+
+def _new_round(state):
+    """开始新的一轮：所有未退场的参与者按随机顺序各发言一次"""
+    order = state.active_participants
+    _random.shuffle(order)
+    number = state.round.round_number + 1 if state.round else 1
+    state.round = RoundState(str(uuid.uuid4()), number, order)
+    state.round_ids.append(state.round.id)
+    state.current_speaker_index = 0
+    state.waiting_for_player = bool(order) and order[0] in state.player_npcs
+
+def _register(state):
+    with _registry_lock:
+        return _sessions.setdefault(state.id, state)
+
+def _restore(session, round_row, speeches_in_round):
+    state = SessionState(session.id, session.player_id, session.scene_id,
+                         session.scene_npcs, session.player_npcs, session.started_at)
+    state.npcs_removed = list(session.npcs_removed or [])
+    state.current_speaker_index = session.current_speaker_index or 0
+    state.waiting_for_player = bool(session.waiting_for_player)
+    state.total_speeches = session.total_speeches or 0
+    state.total_story_progress = session.total_story_progress or 0
+    state.total_tension_level = session.total_tension_level or 0
+    state.combat_occurred = bool(session.combat_occurred)
+    state.dice_triggered = bool(session.dice_triggered)
+    state.dice_result = session.dice_result or {}
+    _persisted.add(session.id)
+    if round_row is not None:
+        current = RoundState(round_row.id, round_row.round_number, list(round_row.speaking_order or []),
+                             round_row.started_at)
+        current.is_complete = bool(round_row.is_complete)
+        # 以实际落库的发言数为准（未落库的发言已丢失）
+        current.speeches_count = speeches_in_round
+        current.story_progress = round_row.story_progress or 0
+        current.dialogue_quality = round_row.dialogue_quality or 0
+        current.tension_level = round_row.tension_level or 0
+        current.special_flags = list(round_row.special_flags or [])
+        current.evaluation_result = round_row.evaluation_result
+        state.round = current
+        state.round_ids.append(current.id)
+        _persisted.add(current.id)
+    return state
+
+def _load(db, session_ids=None):
+    """从数据库加载进行中的会话（固定3次查询）"""
+    query = db.query(DialogueSession).filter(DialogueSession.status == SessionStatus.ACTIVE)
+    if session_ids is not None:
+        query = query.filter(DialogueSession.id.in_(session_ids))
+    sessions = query.all()
+    if not sessions:
+        return []
+    ids = [session.id for session in sessions]
+
+    latest = db.query(DialogueRound.session_id, func.max(DialogueRound.round_number).label("round_number")).filter(
+        DialogueRound.session_id.in_(ids)
+    ).group_by(DialogueRound.session_id).subquery()
+    rounds = {
+        row.session_id: row for row in db.query(DialogueRound).join(
+            latest, (DialogueRound.session_id == latest.c.session_id) & (DialogueRound.round_number == latest.c.round_number)
+        )
+    }
+    round_ids = [row.id for row in rounds.values()]
+    counts = dict(db.query(DialogueSpeech.round_id, func.count(DialogueSpeech.id)).filter(
+        DialogueSpeech.round_id.in_(round_ids)
+    ).group_by(DialogueSpeech.round_id).all()) if round_ids else {}
+
+    states = []
+    for session in sessions:
+        round_row = rounds.get(session.id)
+        states.append(_register(_restore(session, round_row, counts.get(round_row.id, 0) if round_row else 0)))
+    return states
+
+def recover():
+    """服务启动时恢复所有进行中的会话"""
+    db = SessionLocal()
+    try:
+        states = _load(db)
+    finally:
+        db.close()
+    if states:
+        logger.info(f"恢复进行中的对话会话: {len(states)}")
+    return states
+
+def get_session(session_id, db=None):
+    """获取进行中会话的内存状态，不在内存中时尝试从数据库恢复；不存在或已结束时返回None"""
+    with _registry_lock:
+        state = _sessions.get(session_id)
+    if state is not None:
+        return state
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        states = _load(db, [session_id])
+    finally:
+        if own_session:
+            db.close()
+    return states[0] if states else None
+
+def _require(session_id):
+    state = get_session(session_id)
+    if state is None:
+        raise SessionError(f"Active dialogue session not found: {session_id}")
+    return state
+
+@contextmanager
+def _locked(session_id):
+    """
+    取会话并持有state.lock；取得锁之前会话已被evict_idle移出内存时重新加载，
+    否则在旧状态上写入的记录会以已落库的ID再次INSERT而被丢弃
+    """
+    while True:
+        state = _require(session_id)
+        with state.lock:
+            with _registry_lock:
+                registered = _sessions.get(state.id) is state
+            if registered:
+                yield state
+                return
+
+def create_session(db, player_id, scene_id, scene_npcs=None, player_npcs=None):
+    """创建会话并开始第一轮（只校验玩家和场景存在，会话本身写入缓冲区）"""
+    if not db.query(Player.id).filter(Player.id == player_id).first():
+        raise SessionError(f"Player not found: {player_id}")
+    if not db.query(Scene.id).filter(Scene.id == scene_id).first():
+        raise SessionError(f"Scene not found: {scene_id}")
+
+    state = SessionState(str(uuid.uuid4()), player_id, scene_id, scene_npcs, player_npcs)
+    with state.lock:
+        _new_round(state)
+        _stage(state)
+    dialogue_context.start(state.id)
+    return _register(state)
+
+def add_speech(session_id, speaker_type, speaker_id, speaker_name, speech_text, is_player_choice=False,
+               available_options=None, selected_option=None, hidden_effects=None, combat_target=None,
+               stream_id=None):
+    """
+    记录一次发言并轮到下一位发言者（只写内存和缓冲区）
+    参与者发言需按当前发言顺序；旁白和评分AI可随时发言，不占用发言顺序
+    stream_id: 之前通过stream_partial推送增量文本时使用的ID，客户端据此用完整发言替换增量文本
+    """
+    speaker_type = SpeakerType(speaker_type)
+    with _locked(session_id) as state:
+        if state.status != SessionStatus.ACTIVE:
+            raise SessionError("Dialogue session has ended")
+        takes_turn = speaker_type in (SpeakerType.SCENE_NPC, SpeakerType.PLAYER_NPC)
+        if takes_turn:
+            if state.round.is_complete or state.current_speaker is None:
+                raise SessionError("All participants have spoken this round; end the round first")
+            if speaker_id != state.current_speaker:
+                raise SessionError(f"It is {state.current_speaker}'s turn to speak")
+
+        state.round.speeches_count += 1
+        state.total_speeches += 1
+        speech = {
+            "id": str(uuid.uuid4()),
+            "round_id": state.round.id,
+            "session_id": state.id,
+            "speaker_type": speaker_type,
+            "speaker_id": speaker_id,
+            "speaker_name": speaker_name,
+            "speech_text": speech_text,
+            "speech_order": state.round.speeches_count,
+            "is_player_choice": is_player_choice,
+            "available_options": available_options or [],
+            "selected_option": selected_option,
+            "hidden_effects": hidden_effects or {},
+            "combat_target": combat_target,
+            "combat_triggered": False,
+            "created_at": int(time.time()),
+        }
+        if takes_turn:
+            state.current_speaker_index += 1
+            next_speaker = state.current_speaker
+            state.waiting_for_player = next_speaker is not None and next_speaker in state.player_npcs
+        state.speech_ids.add(speech["id"])
+        _stage(state, speech=speech)
+        dialogue_context.record(state.id, speech["id"], state.round.round_number, speaker_name, speech_text)
+        _publish(state, "speech", {**speech, "stream_id": stream_id, "current_speaker": state.current_speaker,
+                                   "waiting_for_player": state.waiting_for_player})
+    return speech
+
+def stream_partial(session_id, stream_id, delta, speaker_type, speaker_id=None, speaker_name=None):
+    """
+    推送AI输出的增量文本（不落库、不占用发言顺序）
+    生成完成后以相同stream_id调用add_speech记录完整发言
+    """
+    speaker_type = SpeakerType(speaker_type)
+    with _locked(session_id) as state:
+        if state.status != SessionStatus.ACTIVE:
+            raise SessionError("Dialogue session has ended")
+        _publish(state, "token", {
+            "stream_id": stream_id,
+            "round_id": state.round.id,
+            "speaker_type": speaker_type,
+            "speaker_id": speaker_id,
+            "speaker_name": speaker_name,
+            "delta": delta,
+        })
+
+def end_round(session_id, story_progress=0, dialogue_quality=0, tension_level=0, special_flags=None,
+              evaluation_result="continue", start_next=True):
+    """
+    记录本轮评分并结束本轮，本轮数据交给后台批量落库
+    start_next为True时立即开始下一轮
+    """
+    with _locked(session_id) as state:
+        if state.status != SessionStatus.ACTIVE:
+            raise SessionError("Dialogue session has ended")
+        finished = state.round
+        finished.story_progress = story_progress
+        finished.dialogue_quality = dialogue_quality
+        finished.tension_level = tension_level
+        finished.special_flags = list(special_flags or [])
+        finished.evaluation_result = evaluation_result
+        finished.is_complete = True
+        finished.completed_at = int(time.time())
+        state.total_story_progress += story_progress
+        state.total_tension_level = max(state.total_tension_level, tension_level)
+        if start_next:
+            _new_round(state)
+        _stage(state, round_state=finished)
+        data = state.to_dict()
+        _publish(state, "round_end", {"round": finished.row(state.id), "session": data})
+    request_flush()
+    return data
+
+def remove_npc(session_id, npc_id):
+    """NPC退场：从参与者和本轮剩余发言顺序中移除"""
+    with _locked(session_id) as state:
+        if npc_id not in state.npcs_removed:
+            state.npcs_removed.append(npc_id)
+        order = state.round.speaking_order
+        if npc_id in order:
+            index = order.index(npc_id)
+            order.pop(index)
+            if index < state.current_speaker_index:
+                state.current_speaker_index -= 1
+        next_speaker = state.current_speaker
+        state.waiting_for_player = next_speaker is not None and next_speaker in state.player_npcs
+        _stage(state)
+        data = state.to_dict()
+        _publish(state, "npc_removed", {"npc_id": npc_id, "session": data})
+    return data
+
+def _require_speech(state, speech_id):
+    """战斗记录的speech_id是非空外键，必须是本会话的发言（服务重启前的发言从数据库确认）"""
+    with state.lock:
+        if speech_id in state.speech_ids:
+            return
+    db = SessionLocal()
+    try:
+        found = db.query(DialogueSpeech.id).filter(
+            DialogueSpeech.id == speech_id, DialogueSpeech.session_id == state.id
+        ).first() is not None
+    finally:
+        db.close()
+    if not found:
+        raise SessionError(f"Speech {speech_id} does not belong to this dialogue session")
+    with state.lock:
+        state.speech_ids.add(speech_id)
+
+def record_combat(session_id, speech_id, attacker: Combatant, defender: Combatant, loser_removed=True,
+                  scene_impact=None):
+    """
+    在会话中结算一场战斗：战斗记录写入缓冲区，loser_removed时败者退场
+    返回core.combat的CombatResult
+    """
+    state = _require(session_id)
+    _require_speech(state, speech_id)
+    result = resolve_combat(attacker, defender)
+    with _locked(session_id) as state:
+        state.combat_occurred = True
+        combat = {
+            "id": str(uuid.uuid4()),
+            "session_id": state.id,
+            "round_id": state.round.id,
+            "speech_id": speech_id,
+            "attacker_id": attacker.id,
+            "attacker_name": attacker.name,
+            "defender_id": defender.id,
+            "defender_name": defender.name,
+            "attacker_hp_before": attacker.hp,
+            "attacker_str": attacker.strength,
+            "attacker_def": attacker.defense,
+            "defender_hp_before": defender.hp,
+            "defender_str": defender.strength,
+            "defender_def": defender.defense,
+            "combat_rounds": [],
+            "total_rounds": result.total_rounds,
+            "winner_id": result.winner.id,
+            "loser_id": result.loser.id,
+            "attacker_hp_after": result.attacker_hp_after,
+            "defender_hp_after": result.defender_hp_after,
+            "loser_removed": loser_removed,
+            "scene_impact": scene_impact or {},
+            "occurred_at": int(time.time()),
+        }
+        _stage(state, combat=combat)
+        _publish(state, "combat", combat)
+    if loser_removed:
+        remove_npc(session_id, result.loser.id)
+    return result
+
+def record_dice(session_id, dice_result):
+    """记录骰子结果（core.dice.roll的返回值）"""
+    with _locked(session_id) as state:
+        state.dice_triggered = True
+        state.dice_result = dice_result
+        _stage(state)
+        data = state.to_dict()
+        _publish(state, "dice", {"dice_result": dice_result, "session": data})
+    return data
+
+def end_session(session_id, status=SessionStatus.COMPLETED, final_result=None):
+    """结束会话：同步刷新缓冲区后从内存中移除"""
+    with _locked(session_id) as state:
+        state.status = SessionStatus(status)
+        state.final_result = final_result
+        state.ended_at = int(time.time())
+        state.waiting_for_player = False
+        _stage(state)
+        data = state.to_dict()
+    flush()
+    with _registry_lock:
+        _sessions.pop(session_id, None)
+    with _flush_lock:
+        _persisted.difference_update([state.id, *state.round_ids])
+    dialogue_context.discard(state.id)
+    _publish(state, "session_end", data)
+    pubsub.broker.close_topic(state.id)
+    return data
+
+def evict_idle(ttl=None):
+    """
+    把空闲超过ttl秒（默认DIALOGUE_IDLE_TTL）的会话刷新落库后移出内存，返回移出的会话ID
+    仍有SSE/WebSocket订阅者的会话不移出（观战客户端不因会话进展缓慢而断开），重新开始计时；
+    会话在数据库中保持进行中，get_session再次访问时从数据库恢复；刷新失败时抛出SQLAlchemyError，不移出任何会话
+    """
+    ttl = IDLE_TTL if ttl is None else ttl
+    now = time.monotonic()
+    with _registry_lock:
+        idle = [state for state in _sessions.values() if now - state.last_activity >= ttl]
+    unwatched = []
+    for state in idle:
+        if pubsub.broker.subscriber_count(state.id):
+            with state.lock:
+                state.last_activity = now
+        else:
+            unwatched.append(state)
+    idle = unwatched
+    if not idle:
+        return []
+    flush()
+
+    evicted = []
+    for state in idle:
+        with state.lock:
+            # 刷新期间有新的活动或新的订阅者则保留
+            if now - state.last_activity < ttl or pubsub.broker.subscriber_count(state.id):
+                continue
+            with _registry_lock:
+                if _sessions.get(state.id) is not state:
+                    continue
+            # 先清理再从注册表移除：移除后并发的访问会重新加载会话，不能再清掉重新加载的状态
+            with _flush_lock:
+                _persisted.difference_update([state.id, *state.round_ids])
+            dialogue_context.discard(state.id)
+            pubsub.broker.close_topic(state.id)
+            with _registry_lock:
+                _sessions.pop(state.id, None)
+        evicted.append(state.id)
+    if evicted:
+        logger.info(f"空闲对话会话移出内存: {len(evicted)}")
+    return evicted
+
+def active_sessions():
+    with _registry_lock:
+        return list(_sessions.values())
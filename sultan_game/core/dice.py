@@ -0,0 +1,159 @@
+"""
+骰子引擎
+玩家NPC的智力（INT）决定投掷的骰子数量，每个六面骰点数 >= success_face（默认5）算一次成功，
+成功次数达到场景要求（SceneAIConfiguration.success_criteria.dice_required）即判定成功。
+
+成功概率按二项分布精确计算（整数计数，无浮点累积误差）：
+    P(恰好k个成功) = C(n, k) * s^k * (6 - s)^(n - k) / 6^n，s为成功面数
+每个success_face一张表，首次使用时生成 MAX_TABLE_DICE 以内所有骰子数量的 P(成功数 >= k)，之后查表。
+
+投掷使用带种子的 random.Random，结果（含种子）写入 DialogueSession.dice_result，可用 replay 复现
+"""
+
+from functools import lru_cache
+from math import comb
+import random
+import secrets
+import threading
+import time
+
+DICE_FACES = 6
+DEFAULT_SUCCESS_FACE = 5
+# 概率表覆盖的骰子数量（INT 1-20，最多5名玩家NPC，加卡片额外骰子）
+MAX_TABLE_DICE = 128
+
+class DiceError(ValueError):
+    """骰子参数无效"""
+
+def _validate_face(success_face):
+    if not 1 <= success_face <= DICE_FACES:
+        raise DiceError(f"success_face must be between 1 and {DICE_FACES}")
+
+class _ProbabilityTable:
+    """某个success_face下，n个骰子至少k个成功的概率表 rows[n][k]"""
+
+    def __init__(self, success_face, size):
+        successes = DICE_FACES - success_face + 1
+        failures = DICE_FACES - successes
+        self.success_face = success_face
+        self.rows = []
+        for n in range(size + 1):
+            total = DICE_FACES ** n
+            counts = [comb(n, k) * successes ** k * failures ** (n - k) for k in range(n + 1)]
+            # 从高到低累加得到"至少k个成功"的计数，再一次性除以总数
+            row = [0.0] * (n + 2)
+            cumulative = 0
+            for k in range(n, -1, -1):
+                cumulative += counts[k]
+                row[k] = cumulative / total
+            self.rows.append(row)
+
+    def at_least(self, dice_count, required):
+        row = self.rows[dice_count]
+        if required <= 0:
+            return 1.0
+        if required >= len(row):
+            return 0.0
+        return row[required]
+
+    def exactly(self, dice_count):
+        row = self.rows[dice_count]
+        return [row[k] - row[k + 1] for k in range(dice_count + 1)]
+
+_table_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def _table(success_face):
+    return _ProbabilityTable(success_face, MAX_TABLE_DICE)
+
+def get_table(success_face=DEFAULT_SUCCESS_FACE):
+    _validate_face(success_face)
+    with _table_lock:
+        return _table(success_face)
+
+def _exact_at_least(dice_count, required, success_face):
+    """超出概率表范围时直接计算"""
+    successes = DICE_FACES - success_face + 1
+    failures = DICE_FACES - successes
+    count = sum(comb(dice_count, k) * successes ** k * failures ** (dice_count - k)
+                for k in range(max(required, 0), dice_count + 1))
+    return count / DICE_FACES ** dice_count
+
+def success_probability(dice_count, required, success_face=DEFAULT_SUCCESS_FACE, min_successes=0):
+    """
+    n个骰子至少required个成功的概率
+    min_successes: 保底成功数（如"命运骰子：保证至少2个成功"）
+    """
+    if dice_count < 0:
+        raise DiceError("dice_count must not be negative")
+    _validate_face(success_face)
+    if required <= min_successes:
+        return 1.0
+    if dice_count > MAX_TABLE_DICE:
+        return _exact_at_least(dice_count, required, success_face)
+    return get_table(success_face).at_least(dice_count, required)
+
+def success_distribution(dice_count, success_face=DEFAULT_SUCCESS_FACE):
+    """恰好k个成功的概率列表（k = 0..dice_count）"""
+    if not 0 <= dice_count <= MAX_TABLE_DICE:
+        raise DiceError(f"dice_count must be between 0 and {MAX_TABLE_DICE}")
+    return get_table(success_face).exactly(dice_count)
+
+def odds_table(required, dice_counts, success_face=DEFAULT_SUCCESS_FACE, min_successes=0):
+    """按骰子数量列出成功概率，供管理后台展示"""
+    return [
+        {"dice_count": n, "probability": round(success_probability(n, required, success_face, min_successes), 6)}
+        for n in dice_counts
+    ]
+
+def scene_dice_settings(success_criteria):
+    """从SceneAIConfiguration.success_criteria读取骰子要求"""
+    criteria = success_criteria or {}
+    return {
+        "required": int(criteria.get("dice_required", 0) or 0),
+        "success_face": int(criteria.get("dice_success_face", DEFAULT_SUCCESS_FACE) or DEFAULT_SUCCESS_FACE),
+    }
+
+def roll(dice_count, required, success_face=DEFAULT_SUCCESS_FACE, seed=None, min_successes=0):
+    """
+    投掷骰子；seed为空时生成随机种子。返回可直接写入DialogueSession.dice_result的字典
+    """
+    if not 0 <= dice_count <= MAX_TABLE_DICE:
+        raise DiceError(f"dice_count must be between 0 and {MAX_TABLE_DICE}")
+    _validate_face(success_face)
+    if seed is None:
+        seed = secrets.randbits(53)  # 保持在JSON/JavaScript整数精度范围内
+
+    rng = random.Random(seed)
+    faces = [rng.randint(1, DICE_FACES) for _ in range(dice_count)]
+    rolled_successes = sum(1 for face in faces if face >= success_face)
+    successes = max(rolled_successes, min_successes)
+    return {
+        "seed": seed,
+        "dice_count": dice_count,
+        "success_face": success_face,
+        "required": required,
+        "min_successes": min_successes,
+        "faces": faces,
+        "successes": successes,
+        "success": successes >= required,
+        "probability": round(success_probability(dice_count, required, success_face, min_successes), 6),
+        "rolled_at": int(time.time())
+    }
+
+def replay(dice_result):
+    """用记录中的种子和参数重新投掷，结果应与记录一致"""
+    return roll(
+        dice_result["dice_count"], dice_result["required"],
+        success_face=dice_result.get("success_face", DEFAULT_SUCCESS_FACE),
+        seed=dice_result["seed"],
+        min_successes=dice_result.get("min_successes", 0)
+    )
+
+def verify(dice_result):
+    """校验记录的骰子结果是否与种子复现的结果一致（参数无效的记录视为不一致）"""
+    try:
+        replayed = replay(dice_result)
+    except DiceError:
+        return False
+    return replayed["faces"] == dice_result.get("faces") and replayed["success"] == dice_result.get("success")
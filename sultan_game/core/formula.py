@@ -0,0 +1,256 @@
+"""
+安全公式引擎
+用于SceneRequirement.dynamic_formula、SceneRewardExtended.dynamic_reward_formula和CardEffect.effect_formula。
+公式用ast解析后逐节点按白名单校验、改写为只读取变量字典的表达式，再编译成函数（不对公式文本使用eval/exec），
+按公式文本缓存；
+只支持算术、比较、布尔运算、条件表达式、白名单函数，以及从属性字典读取变量（如 npc.strength）
+
+用法:
+    formula = compile_formula("max(10, npc.strength * 1.5) if day > 3 else 5")
+    formula.evaluate({"npc": {"strength": 12}, "day": 4})   # 18.0
+    evaluate_formula("strength + 2", {"strength": 5})        # 7
+"""
+
+from functools import lru_cache
+import ast
+import math
+import operator
+import os
+import types
+
+# 公式最大长度和最大节点数，防止构造超大表达式
+MAX_FORMULA_LENGTH = int(os.getenv("FORMULA_MAX_LENGTH", "500"))
+MAX_FORMULA_NODES = int(os.getenv("FORMULA_MAX_NODES", "200"))
+# 幂运算指数上限，防止 9**9**9 之类的计算耗尽CPU/内存
+MAX_POWER_EXPONENT = 100
+# round的小数位数上限，round(1, -10**8)会计算10**(10**8)
+MAX_ROUND_DIGITS = 15
+# 编译缓存的公式数量
+FORMULA_CACHE_SIZE = int(os.getenv("FORMULA_CACHE_SIZE", "4096"))
+
+class FormulaError(ValueError):
+    """公式语法不支持或求值失败"""
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+def _round(value, ndigits=None):
+    if ndigits is not None and abs(ndigits) > MAX_ROUND_DIGITS:
+        raise FormulaError(f"round() ndigits must be between -{MAX_ROUND_DIGITS} and {MAX_ROUND_DIGITS}")
+    return round(value, ndigits)
+
+def _require_numbers(*values):
+    # 只允许数值运算：字符串/列表重复（"x" * 10**9、[0] * 10**9）和字符串格式化（"%0999999999d" % 1）会耗尽内存
+    for value in values:
+        if not isinstance(value, (int, float)):
+            raise FormulaError(f"Unsupported operand type: {type(value).__name__}")
+
+FUNCTIONS = {
+    "min": min,
+    "max": max,
+    "abs": abs,
+    "round": _round,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "sqrt": math.sqrt,
+    "clamp": _clamp,
+}
+
+def _power(base, exponent):
+    _require_numbers(base, exponent)
+    if abs(exponent) > MAX_POWER_EXPONENT:
+        raise FormulaError(f"Exponent too large: {exponent}")
+    if isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1 and exponent * math.log2(abs(base)) > 1024:
+        raise FormulaError("Result too large")
+    return operator.pow(base, exponent)
+
+def _numeric(function):
+    """包装二元算术运算：操作数必须是数值，不允许字符串拼接/格式化和序列重复"""
+    def checked(left, right):
+        _require_numbers(left, right)
+        return function(left, right)
+    return checked
+
+BINARY_OPERATORS = {
+    ast.Add: _numeric(operator.add),
+    ast.Sub: _numeric(operator.sub),
+    ast.Mult: _numeric(operator.mul),
+    ast.Div: _numeric(operator.truediv),
+    ast.FloorDiv: _numeric(operator.floordiv),
+    ast.Mod: _numeric(operator.mod),
+    ast.Pow: _power,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+}
+
+COMPARE_OPERATORS = {
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+class Formula:
+    """编译后的公式，可重复求值"""
+    __slots__ = ("source", "variables", "_evaluate")
+
+    def __init__(self, source, variables, evaluate):
+        self.source = source
+        self.variables = variables  # 公式引用的变量路径，如 ("npc", "strength")
+        self._evaluate = evaluate
+
+    def evaluate(self, context):
+        """用变量字典求值，缺少变量或运算出错时抛出FormulaError"""
+        try:
+            return self._evaluate(context)
+        except FormulaError:
+            raise
+        except KeyError as e:
+            raise FormulaError(f"Unknown variable: {e.args[0]}")
+        except (ArithmeticError, TypeError, ValueError) as e:
+            raise FormulaError(f"Cannot evaluate '{self.source}': {e}")
+
+    def __repr__(self):
+        return f"Formula({self.source!r})"
+
+# 编译后函数的全局命名空间：没有内建函数，只有白名单函数和受限运算
+_GLOBALS = {"__builtins__": {}}
+_GLOBALS.update({f"_op_{op.__name__}": function for op, function in BINARY_OPERATORS.items()})
+_GLOBALS.update({f"_fn_{name}": function for name, function in FUNCTIONS.items()})
+_CONTEXT = "ctx"
+
+class _Compiler:
+    """
+    校验ast并改写为只访问ctx字典的表达式：变量 -> ctx["name"]，npc.strength -> ctx["npc"]["strength"]，
+    函数 -> 白名单函数，算术运算 -> 只接受数值操作数（幂运算另有上限检查）的函数；任何不在白名单中的节点都会被拒绝
+    """
+
+    def __init__(self):
+        self.variables = set()
+
+    def compile(self, node):
+        method = getattr(self, f"_compile_{type(node).__name__}", None)
+        if method is None:
+            raise FormulaError(f"Unsupported syntax: {type(node).__name__}")
+        return method(node)
+
+    def _compile_Expression(self, node):
+        return self.compile(node.body)
+
+    def _compile_Constant(self, node):
+        if not isinstance(node.value, (int, float, str)):
+            raise FormulaError(f"Unsupported constant: {node.value!r}")
+        return ast.Constant(node.value)
+
+    def _lookup(self, path):
+        self.variables.add(tuple(path))
+        result = ast.Name(_CONTEXT, ast.Load())
+        for key in path:
+            result = ast.Subscript(result, ast.Constant(key), ast.Load())
+        return result
+
+    def _compile_Name(self, node):
+        if node.id in ("True", "False", "None"):
+            return ast.Constant({"True": True, "False": False, "None": None}[node.id])
+        return self._lookup([node.id])
+
+    def _compile_Attribute(self, node):
+        path = []
+        while isinstance(node, ast.Attribute):
+            if node.attr.startswith("_"):
+                raise FormulaError(f"Unsupported attribute: {node.attr}")
+            path.append(node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name):
+            raise FormulaError("Attribute access is only allowed on variables")
+        path.append(node.id)
+        return self._lookup(path[::-1])
+
+    def _call(self, name, args):
+        return ast.Call(ast.Name(name, ast.Load()), args, [])
+
+    def _compile_BinOp(self, node):
+        if type(node.op) not in BINARY_OPERATORS:
+            raise FormulaError(f"Unsupported operator: {type(node.op).__name__}")
+        left, right = self.compile(node.left), self.compile(node.right)
+        return self._call(f"_op_{type(node.op).__name__}", [left, right])
+
+    def _compile_UnaryOp(self, node):
+        if type(node.op) not in UNARY_OPERATORS:
+            raise FormulaError(f"Unsupported operator: {type(node.op).__name__}")
+        return ast.UnaryOp(node.op, self.compile(node.operand))
+
+    def _compile_BoolOp(self, node):
+        return ast.BoolOp(node.op, [self.compile(value) for value in node.values])
+
+    def _compile_Compare(self, node):
+        for op in node.ops:
+            if type(op) not in COMPARE_OPERATORS:
+                raise FormulaError(f"Unsupported comparison: {type(op).__name__}")
+        return ast.Compare(self.compile(node.left), node.ops, [self.compile(c) for c in node.comparators])
+
+    def _compile_IfExp(self, node):
+        return ast.IfExp(self.compile(node.test), self.compile(node.body), self.compile(node.orelse))
+
+    def _compile_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise FormulaError(f"Unsupported function: {ast.unparse(node.func)}")
+        if node.keywords:
+            raise FormulaError("Keyword arguments are not supported")
+        return self._call(f"_fn_{node.func.id}", [self.compile(arg) for arg in node.args])
+
+    def build(self, tree):
+        """生成 ctx -> 值 的函数（只编译校验后的ast，不对公式文本使用eval/exec）"""
+        body = self.compile(tree)
+        arguments = ast.arguments(
+            posonlyargs=[], args=[ast.arg(_CONTEXT)], kwonlyargs=[], kw_defaults=[], defaults=[]
+        )
+        module = ast.fix_missing_locations(ast.Expression(ast.Lambda(arguments, body)))
+        code = compile(module, "<formula>", "eval")
+        function_code = next(const for const in code.co_consts if isinstance(const, types.CodeType))
+        return types.FunctionType(function_code, _GLOBALS)
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def compile_formula(source: str) -> Formula:
+    """解析并编译公式（按公式文本缓存），不支持的语法抛出FormulaError"""
+    if not isinstance(source, str) or not source.strip():
+        raise FormulaError("Formula is empty")
+    if len(source) > MAX_FORMULA_LENGTH:
+        raise FormulaError(f"Formula longer than {MAX_FORMULA_LENGTH} characters")
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as e:
+        raise FormulaError(f"Invalid formula syntax: {e.msg}")
+    if sum(1 for _ in ast.walk(tree)) > MAX_FORMULA_NODES:
+        raise FormulaError(f"Formula has more than {MAX_FORMULA_NODES} nodes")
+
+    compiler = _Compiler()
+    evaluate = compiler.build(tree)
+    if not compiler.variables:
+        # 常量公式在编译时求值
+        try:
+            value = evaluate({})
+        except FormulaError:
+            raise
+        except (ArithmeticError, TypeError, ValueError) as e:
+            raise FormulaError(f"Cannot evaluate '{source}': {e}")
+        evaluate = lambda context: value
+    return Formula(source, frozenset(compiler.variables), evaluate)
+
+def evaluate_formula(source: str, context: dict):
+    """编译（命中缓存时跳过）并求值"""
+    return compile_formula(source).evaluate(context)
+
+def validate_formula(source: str):
+    """校验公式，返回错误信息；有效时返回None"""
+    try:
+        compile_formula(source)
+    except FormulaError as e:
+        return str(e)
+    return None
@@ -0,0 +1,405 @@
+"""
+大模型调用客户端
+使用OpenAI兼容的 /chat/completions 接口，地址由 LLM_BASE_URL 配置（开发和压测时指向本地模拟服务）。
+默认地址 http://127.0.0.1:8100/v1 是 benchmarks/stub_llm.py 的默认端口，与后端自身的端口（PORT=8001）错开。
+传入 on_delta 时以流式方式请求，每收到一段文本就回调一次，用于推送AI增量输出。
+
+每个提供方（按 base_url + API key 区分）共用一个保持长连接的 httpx.AsyncClient，调用经过：
+    熔断检查 -> 令牌桶限流 -> 并发上限 -> 请求（429/5xx/网络错误按抖动退避重试）
+AIConfig.model_config 中可按提供方配置（未配置时取环境变量默认值）：
+    provider             提供方名称（指标中显示，默认为base_url）
+    base_url             接口地址
+    api_key_env          保存API key的环境变量名
+    max_concurrency      同时进行的请求数上限
+    requests_per_minute  令牌桶速率（0为不限），burst为桶容量
+    max_retries          重试次数
+多个配置指向同一提供方时，并发上限和速率以最近一次调用的配置为准。
+流式请求已推送过增量文本后不再重试，避免重复输出。
+
+客户端随应用生命周期创建和关闭（main.py 的 lifespan），get_metrics() 返回连接池和排队情况。
+"""
+
+from collections import deque
+import httpx
+import asyncio
+import json
+import os
+import random
+import time
+import weakref
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://127.0.0.1:8100/v1")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "")
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+
+# 连接池
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))  # 秒
+
+# 并发、限流、重试和熔断的默认值
+DEFAULT_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))  # 0为不限
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))  # 秒
+RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))  # 秒
+BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))  # 连续失败次数
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # 熔断后多久放行试探请求（秒）
+
+# 透传给接口的模型参数（AIConfig.model_config中的其他键只在本地使用）
+MODEL_PARAMETERS = ("temperature", "max_tokens", "top_p", "presence_penalty", "frequency_penalty", "stop", "seed")
+
+class LLMError(RuntimeError):
+    """模型接口返回错误或响应格式不正确"""
+
+    def __init__(self, message, status_code=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+class CircuitOpenError(LLMError):
+    """提供方处于熔断状态，请求未发出"""
+
+class Completion:
+    __slots__ = ("text", "model", "tokens_used", "finish_reason", "attempts")
+
+    def __init__(self, text, model=None, tokens_used=None, finish_reason=None, attempts=1):
+        self.text = text
+        self.model = model
+        self.tokens_used = tokens_used
+        self.finish_reason = finish_reason
+        self.attempts = attempts
+
+class _Limiter:
+    """可调整上限的并发限制（先到先得），记录排队数"""
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                if future in self._waiters:
+                    self._waiters.remove(future)
+            else:
+                # 已分配到名额但调用方被取消
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def resize(self, limit):
+        self.limit = max(1, limit)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.active < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+class _TokenBucket:
+    """令牌桶限流，rate为每秒令牌数"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.waiting = 0
+        self._updated = time.monotonic()
+
+    def configure(self, rate, capacity):
+        self._refill()
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        while self.rate > 0:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            self.waiting += 1
+            try:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+            finally:
+                self.waiting -= 1
+
+class _CircuitBreaker:
+    """
+    连续失败BREAKER_THRESHOLD次后熔断，BREAKER_COOLDOWN秒后放行一个试探请求（half_open），
+    试探成功恢复，失败继续熔断
+    """
+
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+                return False
+            self.state = "half_open"
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record(self, ok):
+        """ok: True成功，False失败，None不计（如429、调用方取消）"""
+        self._probing = False
+        if ok:
+            self.state = "closed"
+            self.failures = 0
+        elif ok is False:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= BREAKER_THRESHOLD:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def retry_in(self):
+        if self.state != "open":
+            return 0.0
+        return max(0.0, BREAKER_COOLDOWN - (time.monotonic() - self.opened_at))
+
+class Provider:
+    """一个提供方在一个事件循环中的连接池、并发限制、限流和熔断状态"""
+
+    def __init__(self, name, base_url, api_key):
+        self.name = name
+        self.base_url = base_url
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(
+            base_url=base_url, headers=headers, timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                keepalive_expiry=KEEPALIVE_EXPIRY)
+        )
+        self.limiter = _Limiter(DEFAULT_CONCURRENCY)
+        self.bucket = _TokenBucket(DEFAULT_REQUESTS_PER_MINUTE / 60, 1.0)
+        self.breaker = _CircuitBreaker()
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def configure(self, settings):
+        limit = int(settings.get("max_concurrency", DEFAULT_CONCURRENCY))
+        if limit != self.limiter.limit:
+            self.limiter.resize(limit)
+        per_minute = float(settings.get("requests_per_minute", DEFAULT_REQUESTS_PER_MINUTE))
+        burst = float(settings.get("burst", max(1.0, per_minute / 60)))
+        if per_minute / 60 != self.bucket.rate or burst != self.bucket.capacity:
+            self.bucket.configure(per_minute / 60, burst)
+
+    async def request(self, messages, settings, on_delta):
+        """单次请求（不重试），占用并发名额直到流式响应读完"""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(
+                f"LLM provider {self.name} circuit is open, retry in {self.breaker.retry_in():.0f}s",
+                retryable=False
+            )
+        outcome = None
+        try:
+            await self.bucket.acquire()
+            await self.limiter.acquire()
+            try:
+                self.requests += 1
+                completion = await _send(self.client, messages, settings, on_delta)
+            finally:
+                self.limiter.release()
+            outcome = True
+            return completion
+        except LLMError as e:
+            self.failures += 1
+            # 4xx说明提供方可用；429不计入熔断，只由重试退避
+            if e.status_code is not None and e.status_code < 500:
+                outcome = None if e.status_code == 429 else True
+            elif e.retryable:
+                outcome = False
+            raise
+        finally:
+            self.breaker.record(outcome)
+
+    def metrics(self):
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", ()))
+        return {
+            "provider": self.name,
+            "base_url": self.base_url,
+            "in_flight": self.limiter.active,
+            "max_concurrency": self.limiter.limit,
+            "queued": self.limiter.waiting,
+            "rate_limited": self.bucket.waiting,
+            "requests_per_minute": round(self.bucket.rate * 60, 2),
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "pool": {
+                "connections": len(connections),
+                "idle": sum(1 for connection in connections if connection.is_idle()),
+                "waiting": len(getattr(pool, "_requests", ())) if pool is not None else 0,
+                "max_connections": MAX_CONNECTIONS,
+            },
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+# AsyncClient绑定创建它的事件循环，按事件循环各保留一组提供方
+_providers = weakref.WeakKeyDictionary()
+
+def _provider_key(settings):
+    base_url = settings.get("base_url") or LLM_BASE_URL
+    api_key = os.getenv(settings["api_key_env"], "") if settings.get("api_key_env") else LLM_API_KEY
+    return base_url, api_key
+
+def get_provider(settings=None):
+    settings = settings or {}
+    providers = _providers.setdefault(asyncio.get_running_loop(), {})
+    key = _provider_key(settings)
+    provider = providers.get(key)
+    if provider is None or provider.client.is_closed:
+        provider = providers[key] = Provider(settings.get("provider") or key[0], *key)
+    provider.configure(settings)
+    return provider
+
+def get_client(settings=None):
+    return get_provider(settings).client
+
+def start():
+    """应用启动时创建默认提供方的连接池（需在事件循环中调用）"""
+    get_provider()
+
+async def aclose():
+    """关闭当前事件循环中的所有连接池"""
+    providers = _providers.pop(asyncio.get_running_loop(), {})
+    await asyncio.gather(*(provider.aclose() for provider in providers.values()), return_exceptions=True)
+
+def get_metrics():
+    return [provider.metrics() for providers in list(_providers.values()) for provider in list(providers.values())]
+
+def _payload(messages, settings, stream):
+    payload = {"model": settings.get("model", DEFAULT_MODEL), "messages": messages, "stream": stream}
+    for key in MODEL_PARAMETERS:
+        if key in settings:
+            payload[key] = settings[key]
+    if stream:
+        payload["stream_options"] = {"include_usage": True}
+    return payload
+
+def _retry_after(response):
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+def _check(response):
+    if response.status_code >= 400:
+        status = response.status_code
+        raise LLMError(f"LLM request failed with status {status}", status_code=status,
+                       retryable=status == 429 or status >= 500, retry_after=_retry_after(response))
+
+async def _send(client, messages, settings, on_delta):
+    try:
+        if on_delta is None:
+            response = await client.post("/chat/completions", json=_payload(messages, settings, False))
+            _check(response)
+            data = response.json()
+            choice = data["choices"][0]
+            return Completion(choice["message"]["content"] or "", data.get("model"),
+                              (data.get("usage") or {}).get("total_tokens"), choice.get("finish_reason"))
+
+        parts = []
+        model = tokens_used = finish_reason = None
+        async with client.stream("POST", "/chat/completions", json=_payload(messages, settings, True)) as response:
+            _check(response)
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                model = chunk.get("model", model)
+                if chunk.get("usage"):
+                    tokens_used = chunk["usage"].get("total_tokens")
+                for choice in chunk.get("choices") or ():
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        on_delta(delta)
+                    finish_reason = choice.get("finish_reason") or finish_reason
+        return Completion("".join(parts), model, tokens_used, finish_reason)
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise LLMError(f"Invalid LLM response: {e}") from e
+    except httpx.HTTPError as e:
+        raise LLMError(f"LLM request error: {type(e).__name__}: {e}", retryable=True) from e
+
+def backoff(attempt, retry_after=None):
+    """第attempt次重试前的等待时间：Retry-After优先，否则为全抖动指数退避"""
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+async def complete(messages, settings=None, on_delta=None):
+    """
+    调用模型，返回Completion
+    messages: [{"role": "system"|"user"|"assistant", "content": "..."}]
+    settings: AIConfig.model_config（model/temperature/max_tokens及上述提供方配置）
+    """
+    settings = settings or {}
+    provider = get_provider(settings)
+    max_retries = int(settings.get("max_retries", MAX_RETRIES))
+    streamed = False
+
+    def forward(delta):
+        nonlocal streamed
+        streamed = True
+        on_delta(delta)
+
+    attempt = 0
+    while True:
+        try:
+            completion = await provider.request(messages, settings, forward if on_delta else None)
+            completion.attempts = attempt + 1
+            return completion
+        except LLMError as e:
+            if not e.retryable or streamed or attempt >= max_retries:
+                raise
+            delay = backoff(attempt, e.retry_after)
+        attempt += 1
+        provider.retries += 1
+        await asyncio.sleep(delay)
@@ -0,0 +1,268 @@
+"""
+日志文件读取模块
+从文件末尾按块向前读取最后N行，以及基于字节偏移量的增量读取，
+读取开销只与返回的行数有关，与日志文件大小无关；
+以及基于分钟索引的结构化日志检索
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+# 每次向前读取的块大小
+BLOCK_SIZE = 64 * 1024
+
+def _decode(raw_lines):
+    return [line.decode("utf-8", errors="replace").rstrip("\r") for line in raw_lines]
+
+def tail_lines(path, lines, block_size=BLOCK_SIZE):
+    """
+    读取文件最后lines行
+    返回(行列表, 文件末尾的字节偏移量)，偏移量可作为下次增量读取的since参数
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        if lines <= 0 or end == 0:
+            return [], end
+        
+        # 忽略文件末尾的换行符，避免多算一行空行
+        position = end
+        f.seek(end - 1)
+        if f.read(1) == b"\n":
+            position -= 1
+        
+        chunks = []
+        newline_count = 0
+        while position > 0 and newline_count < lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            chunk = f.read(read_size)
+            chunks.append(chunk)
+            newline_count += chunk.count(b"\n")
+        
+        # 末尾换行符已被排除，按换行拆分后最后lines段都是完整的行
+        raw_lines = b"".join(reversed(chunks)).split(b"\n")
+        return _decode(raw_lines[-lines:]), end
+
+def read_since(path, offset, lines):
+    """
+    从字节偏移量offset开始向后读取最多lines个完整行（用于增量轮询）
+    返回(行列表, 下次读取的偏移量)
+    如果offset超过文件大小（文件被轮转或截断），则从文件开头读取
+    """
+    path = Path(path)
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        if offset < 0 or offset > end:
+            offset = 0
+        f.seek(offset)
+        
+        result = []
+        next_offset = offset
+        while len(result) < lines:
+            line = f.readline()
+            # 只返回完整的行，未写完的最后一行留到下次读取
+            if not line or not line.endswith(b"\n"):
+                break
+            result.append(line[:-1])
+            next_offset += len(line)
+        
+        return _decode(result), next_offset
+
+# === 结构化日志检索 ===
+# JSON Lines日志（sultan_game_*.jsonl，含轮转文件）旁维护按分钟分桶的偏移量索引：
+# 每个分钟桶记录字节范围、各级别条数、出现的日志器和状态码。
+# 索引只对文件新增部分做增量扫描，检索时只读取命中的分钟桶
+
+INDEX_DIR_NAME = ".index"
+INDEX_VERSION = 1
+
+# 同一进程内串行更新索引
+_index_lock = threading.Lock()
+
+def _index_path(log_file):
+    log_file = Path(log_file)
+    return log_file.parent / INDEX_DIR_NAME / f"{log_file.name}.idx.json"
+
+def _load_index(log_file, stat):
+    """读取索引文件，文件被替换（轮转）或截断时返回空索引"""
+    index_file = _index_path(log_file)
+    if index_file.exists():
+        try:
+            with open(index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if (index.get("version") == INDEX_VERSION and index.get("inode") == stat.st_ino
+                    and index.get("indexed_bytes", 0) <= stat.st_size):
+                return index
+        except (OSError, ValueError):
+            pass
+    return {"version": INDEX_VERSION, "inode": stat.st_ino, "indexed_bytes": 0,
+            "min_ts": None, "max_ts": None, "minutes": {}}
+
+def _save_index(log_file, index):
+    index_file = _index_path(log_file)
+    index_file.parent.mkdir(exist_ok=True)
+    tmp_file = index_file.with_suffix(".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_file, index_file)
+
+def update_index(log_file):
+    """增量更新日志文件的分钟索引，只扫描上次索引之后新增的完整行"""
+    log_file = Path(log_file)
+    with _index_lock:
+        stat = log_file.stat()
+        index = _load_index(log_file, stat)
+        offset = index["indexed_bytes"]
+        if offset == stat.st_size:
+            return index
+        
+        minutes = index["minutes"]
+        with open(log_file, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break
+                start = offset
+                offset += len(raw)
+                try:
+                    entry = json.loads(raw)
+                    ts = float(entry["ts"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                
+                bucket = minutes.get(str(int(ts // 60)))
+                if bucket is None:
+                    bucket = {"start": start, "end": offset, "levels": {}, "loggers": [], "status": []}
+                    minutes[str(int(ts // 60))] = bucket
+                bucket["start"] = min(bucket["start"], start)
+                bucket["end"] = max(bucket["end"], offset)
+                level = entry.get("level")
+                bucket["levels"][level] = bucket["levels"].get(level, 0) + 1
+                if entry.get("logger") not in bucket["loggers"]:
+                    bucket["loggers"].append(entry.get("logger"))
+                status_code = entry.get("status_code")
+                if status_code is not None and status_code not in bucket["status"]:
+                    bucket["status"].append(status_code)
+                index["min_ts"] = ts if index["min_ts"] is None else min(index["min_ts"], ts)
+                index["max_ts"] = ts if index["max_ts"] is None else max(index["max_ts"], ts)
+        
+        index["indexed_bytes"] = offset
+        _save_index(log_file, index)
+        return index
+
+def _bucket_matches(bucket, levels, logger_name, status_code):
+    if levels and not any(bucket["levels"].get(level) for level in levels):
+        return False
+    if logger_name and not any(
+        name == logger_name or name.startswith(logger_name + ".") for name in bucket["loggers"]
+    ):
+        return False
+    if status_code is not None and status_code not in bucket["status"]:
+        return False
+    return True
+
+def _entry_matches(entry, levels, logger_name, url, status_code, start_time, end_time):
+    if levels and entry.get("level") not in levels:
+        return False
+    if logger_name:
+        name = entry.get("logger", "")
+        if name != logger_name and not name.startswith(logger_name + "."):
+            return False
+    if url and url not in (entry.get("url") or ""):
+        return False
+    if status_code is not None and entry.get("status_code") != status_code:
+        return False
+    if start_time is not None and entry["ts"] < start_time:
+        return False
+    if end_time is not None and entry["ts"] > end_time:
+        return False
+    return True
+
+def _merge_ranges(ranges):
+    """合并重叠的字节范围（多线程写入时相邻分钟桶可能交错）"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def search_logs(log_dir, lines=100, level=None, logger_name=None, url=None,
+                status_code=None, start_time=None, end_time=None, pattern="sultan_game_*.jsonl*"):
+    """
+    在结构化日志（含轮转文件）中按条件检索
+    level: 最低级别（如 WARNING 表示 WARNING 及以上）
+    logger_name: 日志器名称，包含其子日志器
+    url: URL子串
+    start_time/end_time: Unix时间戳（秒）
+    返回最近的lines条匹配记录，按时间先后排列
+    """
+    levels = None
+    if level:
+        threshold = logging.getLevelName(level.upper())
+        if not isinstance(threshold, int):
+            raise ValueError(f"Unknown log level: {level}")
+        levels = {name for name in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+                  if logging.getLevelName(name) >= threshold}
+    start_minute = int(start_time // 60) if start_time is not None else None
+    end_minute = int(end_time // 60) if end_time is not None else None
+    
+    # 清理已被轮转删除的日志文件的索引
+    log_files = list(Path(log_dir).glob(pattern))
+    index_dir = Path(log_dir) / INDEX_DIR_NAME
+    if index_dir.exists():
+        live_names = {f"{log_file.name}.idx.json" for log_file in log_files}
+        for index_file in index_dir.glob("*.idx.json"):
+            if index_file.name not in live_names:
+                index_file.unlink(missing_ok=True)
+    
+    # 按最新时间从近到远处理文件，凑够lines条后停止
+    indexed_files = []
+    for log_file in log_files:
+        index = update_index(log_file)
+        if index["max_ts"] is None:
+            continue
+        if start_time is not None and index["max_ts"] < start_time:
+            continue
+        if end_time is not None and index["min_ts"] > end_time:
+            continue
+        indexed_files.append((index["max_ts"], log_file, index))
+    indexed_files.sort(key=lambda item: item[0], reverse=True)
+    
+    results = []
+    for _, log_file, index in indexed_files:
+        ranges = []
+        for minute, bucket in index["minutes"].items():
+            minute = int(minute)
+            if start_minute is not None and minute < start_minute:
+                continue
+            if end_minute is not None and minute > end_minute:
+                continue
+            if _bucket_matches(bucket, levels, logger_name, status_code):
+                ranges.append((bucket["start"], bucket["end"]))
+        
+        with open(log_file, "rb") as f:
+            for start, end in reversed(_merge_ranges(ranges)):
+                f.seek(start)
+                for raw in f.read(end - start).splitlines():
+                    try:
+                        entry = json.loads(raw)
+                    except ValueError:
+                        continue
+                    if _entry_matches(entry, levels, logger_name, url, status_code, start_time, end_time):
+                        results.append(entry)
+                if len(results) >= lines:
+                    break
+        if len(results) >= lines:
+            break
+    
+    results.sort(key=lambda entry: entry["ts"])
+    return results[-lines:] if lines > 0 else []
@@ -3,9 +3,14 @@
 提供完善的日志记录功能，包括文件输出和控制台输出
 """
 
+import atexit
+import copy
+import json
 import logging
 import logging.handlers
 import os
+import queue
+import threading
 from pathlib import Path
 import sys
 from datetime import datetime
@@ -18,10 +23,120 @@ LOG_DIR.mkdir(exist_ok=True)
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# 结构化日志（JSON Lines）中额外记录的字段，通过logging的extra参数传入
+STRUCTURED_FIELDS = ("method", "url", "status_code", "response_time", "db_queries", "db_time")
+
+class JsonLineFormatter(logging.Formatter):
+    """JSON Lines格式器，每条日志一行JSON，供/api/logs结构化检索使用"""
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage()
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        # 经过队列的记录只保留格式化后的异常文本（exc_text），见BoundedQueueHandler.prepare
+        exception = self.formatException(record.exc_info) if record.exc_info else record.exc_text
+        if exception:
+            entry["exception"] = exception
+        return json.dumps(entry, ensure_ascii=False)
+
+# 异步日志队列配置
+# 所有处理器（控制台和文件）都放在QueueListener后台线程中执行，
+# 请求处理线程/事件循环只负责把日志记录放入有界队列
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_POLICY = os.getenv("LOG_QUEUE_POLICY", "drop")  # drop: 队列满时直接丢弃 | block: 等待后再丢弃
+LOG_QUEUE_BLOCK_TIMEOUT = float(os.getenv("LOG_QUEUE_BLOCK_TIMEOUT", "0.05"))  # 秒
+
+# 当前运行中的队列监听器
+_queue_listeners = []
+_exception_formatter = logging.Formatter()
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    有界队列日志处理器
+    队列满时按策略处理：drop直接丢弃，block最多等待LOG_QUEUE_BLOCK_TIMEOUT秒后丢弃；
+    ERROR及以上级别的日志总是按block策略等待。丢弃的记录按级别计数
+    """
+    def __init__(self, queue, policy=LOG_QUEUE_POLICY, block_timeout=LOG_QUEUE_BLOCK_TIMEOUT):
+        super().__init__(queue)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.dropped = {}
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        """
+        入队前合并消息参数，并把异常格式化为exc_text（traceback对象不跨线程保留）
+        默认实现会把异常拼进message并清空异常信息，结构化日志就无法单独记录exception字段
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.policy == "block" or record.levelno >= logging.ERROR:
+                self.queue.put(record, block=True, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+
+def _start_queue_listener(target_logger, handlers):
+    """为日志器挂载有界队列处理器，并启动后台QueueListener执行实际的处理器"""
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = BoundedQueueHandler(log_queue)
+    target_logger.addHandler(queue_handler)
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _queue_listeners.append((target_logger.name, queue_handler, listener))
+
+def stop_logging():
+    """停止后台日志线程，处理完队列中剩余的日志并关闭文件"""
+    # 先停止所有监听线程再关闭处理器，结构化日志处理器由多个监听线程共享
+    handlers = []
+    while _queue_listeners:
+        _, _, listener = _queue_listeners.pop()
+        listener.stop()
+        handlers.extend(h for h in listener.handlers if h not in handlers)
+    for handler in handlers:
+        handler.close()
+
+def get_logging_stats():
+    """获取日志队列状态：队列长度和丢弃计数"""
+    return {
+        name: {
+            "queue_size": queue_handler.queue.qsize(),
+            "queue_capacity": LOG_QUEUE_SIZE,
+            "policy": queue_handler.policy,
+            "dropped": dict(queue_handler.dropped)
+        }
+        for name, queue_handler, _ in _queue_listeners
+    }
+
 def setup_logging(log_level=logging.INFO):
     """
     设置日志配置
+    所有处理器都在后台线程中运行，日志调用方只做入队操作
     """
+    # 停止之前的日志线程
+    stop_logging()
+    
     # 创建主日志器
     logger = logging.getLogger()
     logger.setLevel(log_level)
@@ -37,7 +152,6 @@ def setup_logging(log_level=logging.INFO):
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
     
     # 2. 文件处理器 - 所有日志
     today = datetime.now().strftime("%Y-%m-%d")
@@ -51,7 +165,6 @@ def setup_logging(log_level=logging.INFO):
     )
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
     
     # 3. 错误日志文件处理器
     error_log_file = LOG_DIR / f"error_{today}.log"
@@ -64,9 +177,23 @@ def setup_logging(log_level=logging.INFO):
     )
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(formatter)
-    logger.addHandler(error_handler)
     
-    # 4. API请求日志处理器
+    # 4. 结构化日志文件处理器（JSON Lines，包含API日志，供检索使用）
+    # 同一个处理器实例由根日志器和API日志器的监听线程共享，写入由处理器自身的锁串行化
+    structured_log_file = LOG_DIR / f"sultan_game_{today}.jsonl"
+    structured_handler = logging.handlers.TimedRotatingFileHandler(
+        structured_log_file,
+        when='D',
+        interval=1,
+        backupCount=30,
+        encoding='utf-8'
+    )
+    structured_handler.setLevel(logging.DEBUG)
+    structured_handler.setFormatter(JsonLineFormatter())
+    
+    _start_queue_listener(logger, [console_handler, file_handler, error_handler, structured_handler])
+    
+    # 5. API请求日志处理器
     api_log_file = LOG_DIR / f"api_{today}.log"
     api_handler = logging.handlers.TimedRotatingFileHandler(
         api_log_file,
@@ -80,7 +207,9 @@ def setup_logging(log_level=logging.INFO):
     
     # 为API日志创建专门的日志器
     api_logger = logging.getLogger("api")
-    api_logger.addHandler(api_handler)
+    for handler in api_logger.handlers[:]:
+        api_logger.removeHandler(handler)
+    _start_queue_listener(api_logger, [api_handler, structured_handler])
     api_logger.setLevel(logging.INFO)
     api_logger.propagate = False  # 不传播到根日志器
     
@@ -92,17 +221,35 @@ def get_logger(name):
     """
     return logging.getLogger(name)
 
-def log_api_request(method, url, status_code, response_time=None, error=None):
+def log_api_request(method, url, status_code, response_time=None, error=None, query_stats=None):
     """
     记录API请求日志
+    query_stats: core.database.RequestQueryStats，附带本次请求的SQL语句数、数据库耗时和慢查询数
     """
     api_logger = logging.getLogger("api")
     
+    db_info = ""
+    if query_stats is not None:
+        db_info = f" - db: {query_stats.count} queries {query_stats.total_time:.3f}s"
+        if query_stats.slow_statements:
+            db_info += f" ({len(query_stats.slow_statements)} slow)"
+    
+    # 结构化字段，写入JSON Lines日志用于按URL/状态码检索
+    extra = {
+        "method": method,
+        "url": url,
+        "status_code": status_code,
+        "response_time": response_time
+    }
+    if query_stats is not None:
+        extra["db_queries"] = query_stats.count
+        extra["db_time"] = query_stats.total_time
+    
     if error:
-        api_logger.error(f"{method} {url} - {status_code} - ERROR: {error}")
+        api_logger.error(f"{method} {url} - {status_code}{db_info} - ERROR: {error}", extra=extra)
     else:
         time_info = f" - {response_time:.3f}s" if response_time else ""
-        api_logger.info(f"{method} {url} - {status_code}{time_info}")
+        api_logger.info(f"{method} {url} - {status_code}{time_info}{db_info}", extra=extra)
 
 def log_database_operation(operation, table, record_id=None, error=None):
     """
@@ -116,4 +263,5 @@ def log_database_operation(operation, table, record_id=None, error=None):
         db_logger.info(f"DB {operation} {table} ID:{record_id} - SUCCESS")
 
 # 初始化日志系统
-setup_logging()
\ No newline at end of file
+setup_logging()
+atexit.register(stop_logging)
\ No newline at end of file
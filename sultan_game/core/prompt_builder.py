@@ -0,0 +1,205 @@
+"""
+AI智能体提示词组装
+静态层按 (场景, 智能体, NPC) 编译一次并缓存，每次调用只插入本轮的对话上下文：
+    AIConfig.system_prompt / base_prompt
+    -> SceneAIConfiguration.narrator_prompt（旁白）/ scene_specific_instructions
+    -> SceneAIConfig.scene_specific_config 覆盖（system_prompt / base_prompt / instructions / variables）
+    -> NPC人设（personality_traits / personality_description / speaking_style / dialogue_goals）
+
+提示词中的 {name} 占位符（与游戏设计文档中的模板一致）：场景、NPC、阈值等静态变量在编译时替换，
+其余（dialogue_history、last_utterance、round_number 等）在调用时从上下文取值，缺省为空。
+只匹配 {标识符}，提示词中的JSON示例不受影响。
+
+AIConfig的version/updated_at或场景覆盖配置变化时自动重新编译；ai_configs、scenes、npcs的更新接口
+会主动清除对应缓存。
+"""
+
+from collections import OrderedDict
+from models import AIType, Scene, SceneAIConfiguration, NPC
+import json
+import re
+import threading
+
+MAX_TEMPLATES = 4096
+
+PLACEHOLDER = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+# 未在模板中引用对话历史时，用户消息末尾的默认要求
+DEFAULT_INSTRUCTIONS = {
+    AIType.NARRATOR: "请根据当前情况，给出合适的旁白描述。",
+    AIType.NPC: "请根据你的角色设定，生成一个符合当前情况的回复。",
+    AIType.OPTION_GENERATOR: "请为玩家生成可选的话术，以JSON数组返回。",
+    AIType.EVALUATOR: "请给出评分，以JSON对象返回：story_progress、dialogue_quality、tension_level（0-100），"
+                      "special_flags（列表）、evaluation_result（continue/trigger_dice/high_tension）。",
+}
+
+def _compile_parts(text, variables):
+    """
+    一次扫描替换静态变量，返回文本与运行时占位符交替的列表（偶数下标为文本，奇数下标为占位符名）
+    替换进来的值不再解析占位符
+    """
+    parts = [""]
+    for index, part in enumerate(PLACEHOLDER.split(text)):
+        if index % 2 == 0:
+            parts[-1] += part
+        elif part in variables:
+            parts[-1] += variables[part]
+        else:
+            parts.extend((part, ""))
+    return parts
+
+class PromptTemplate:
+    """编译后的提示词：静态文本与运行时占位符交替的片段"""
+    __slots__ = ("version", "ai_config_id", "speaker_name", "ai_type", "_parts", "_fields")
+
+    def __init__(self, version, ai_config_id, speaker_name, ai_type, parts):
+        self.version = version
+        self.ai_config_id = ai_config_id
+        self.speaker_name = speaker_name
+        self.ai_type = ai_type
+        self._parts = parts
+        self._fields = frozenset(parts[1::2])
+
+    def render(self, context):
+        """返回OpenAI格式的messages"""
+        parts = self._parts
+        system = "".join(
+            parts[index] if index % 2 == 0 else str(context.get(parts[index], ""))
+            for index in range(len(parts))
+        )
+        user = []
+        if "dialogue_history" not in self._fields and context.get("dialogue_history"):
+            user.append(context["dialogue_history"])
+        if context.get("player_turn"):
+            user.append(f"接下来轮到玩家角色 {context['player_turn']} 发言")
+        user.append(DEFAULT_INSTRUCTIONS[self.ai_type])
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": "\n\n".join(user)},
+        ]
+
+_templates = OrderedDict()
+_lock = threading.Lock()
+_generation = 0  # 每次清除缓存加1，编译期间发生清除时不缓存编译结果
+
+def agent_version(agent):
+    """AIConfig版本和场景覆盖配置，任一变化都需要重新编译"""
+    return (agent.version, agent.updated_at, json.dumps(agent.overrides, sort_keys=True, ensure_ascii=False))
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return "、".join(str(item) for item in value)
+    if isinstance(value, dict):
+        return "；".join(f"{key}：{_text(item)}" for key, item in value.items())
+    return str(value)
+
+def _static_variables(scene, scene_config, npc, overrides):
+    variables = {}
+    if scene is not None:
+        variables.update(scene_name=scene.name, scene_background=scene.description or "",
+                         scene_context=f"{scene.name}，{scene.location}" if scene.location else scene.name)
+    if scene_config is not None:
+        thresholds = scene_config.evaluator_thresholds or {}
+        variables.update(dice_threshold=thresholds.get("dice_trigger", ""),
+                         tension_threshold=thresholds.get("tension_trigger", ""))
+    if npc is not None:
+        personality = _text(npc.personality_traits)
+        if npc.personality_description:
+            personality = f"{personality}。{npc.personality_description}" if personality else npc.personality_description
+        variables.update(npc_name=npc.name, npc_role=npc.faction.value if npc.faction else "",
+                         personality=personality, speaking_style=_text(npc.speaking_style),
+                         current_goal=_text(npc.dialogue_goals))
+    variables.update(overrides.get("variables") or {})
+    return {key: _text(value) for key, value in variables.items()}
+
+def compile_template(agent, scene, scene_config, npc=None, speaker_name=None):
+    """把静态层合并为一个模板（不访问数据库）"""
+    overrides = agent.overrides
+    layers = [overrides.get("system_prompt", agent.system_prompt), overrides.get("base_prompt", agent.base_prompt)]
+    if scene_config is not None:
+        if agent.ai_type == AIType.NARRATOR:
+            layers.append(scene_config.narrator_prompt)
+        layers.append(scene_config.scene_specific_instructions)
+    layers.append(overrides.get("instructions"))
+    text = "\n\n".join(layer for layer in layers if layer)
+
+    if npc is not None and "{npc_name}" not in text and "{personality}" not in text:
+        # 模板未使用人设占位符时追加人设段落
+        persona = ["你扮演{npc_name}。", "性格：{personality}"]
+        if npc.speaking_style:
+            persona.append("说话风格：{speaking_style}")
+        if npc.dialogue_goals:
+            persona.append("当前目标：{current_goal}")
+        text = "\n".join([text, "", *persona]) if text else "\n".join(persona)
+
+    parts = _compile_parts(text, _static_variables(scene, scene_config, npc, overrides))
+    if speaker_name is None:
+        speaker_name = npc.name if npc is not None else agent.name
+    return PromptTemplate(agent_version(agent), str(agent.ai_config_id), speaker_name, agent.ai_type, parts)
+
+def get_templates(db, scene_id, requests):
+    """
+    批量获取模板，requests: [(agent, npc_id或None)]，返回 {(agent.id, npc_id): PromptTemplate}
+    只在缓存未命中时查询场景和NPC（最多3次查询）
+    """
+    result = {}
+    missing = []
+    with _lock:
+        generation = _generation
+        for agent, npc_id in requests:
+            key = (scene_id, agent.id, npc_id)
+            template = _templates.get(key)
+            if template is not None and template.version == agent_version(agent):
+                _templates.move_to_end(key)
+                result[(agent.id, npc_id)] = template
+            else:
+                missing.append((agent, npc_id))
+    if not missing:
+        return result
+
+    scene = db.query(Scene).filter(Scene.id == scene_id).first()
+    scene_config = db.query(SceneAIConfiguration).filter(SceneAIConfiguration.scene_id == scene_id).first()
+    npc_ids = {npc_id for _, npc_id in missing if npc_id is not None}
+    npcs = {npc.id: npc for npc in db.query(NPC).filter(NPC.id.in_(npc_ids))} if npc_ids else {}
+
+    compiled = {}
+    for agent, npc_id in missing:
+        npc = npcs.get(npc_id)
+        # NPC不存在时以ID作为发言者名称
+        template = compile_template(agent, scene, scene_config, npc, None if npc or npc_id is None else npc_id)
+        compiled[(scene_id, agent.id, npc_id)] = result[(agent.id, npc_id)] = template
+
+    with _lock:
+        if generation != _generation:
+            return result
+        for key, template in compiled.items():
+            _templates[key] = template
+            _templates.move_to_end(key)
+        while len(_templates) > MAX_TEMPLATES:
+            _templates.popitem(last=False)
+    return result
+
+def _drop(predicate):
+    global _generation
+    with _lock:
+        _generation += 1
+        for key in [key for key, template in _templates.items() if predicate(key, template)]:
+            del _templates[key]
+
+def invalidate(scene_id=None):
+    """清除场景的模板缓存，scene_id为None时全部清除"""
+    if scene_id is None:
+        _drop(lambda key, template: True)
+    else:
+        _drop(lambda key, template: key[0] == scene_id)
+
+def invalidate_config(ai_config_id):
+    """AIConfig更新后清除使用它的模板"""
+    ai_config_id = str(ai_config_id)
+    _drop(lambda key, template: template.ai_config_id == ai_config_id)
+
+def invalidate_npc(npc_id):
+    """NPC人设更新后清除其模板"""
+    _drop(lambda key, template: key[2] == npc_id)
@@ -0,0 +1,161 @@
+"""
+进程内发布/订阅
+按主题（对话会话ID）分发事件，供SSE/WebSocket推送发言和AI输出的增量token。
+
+- publish 是同步、线程安全的，可以在请求线程池、后台线程或事件循环中调用；
+  事件通过订阅者所在事件循环的 call_soon_threadsafe 投递，不阻塞发布方
+- 每个主题保留最近 PUBSUB_HISTORY_SIZE 条事件，断线重连时按 Last-Event-ID 补发
+- 订阅者积压超过 PUBSUB_MAX_PENDING 条时断开（lagged），客户端重连后从历史补发，
+  慢客户端不会拖住发布方或占用无限内存
+"""
+
+from collections import deque
+import asyncio
+import enum
+import json
+import os
+import threading
+
+HISTORY_SIZE = int(os.getenv("PUBSUB_HISTORY_SIZE", "1000"))
+MAX_PENDING = int(os.getenv("PUBSUB_MAX_PENDING", "5000"))
+
+def _json_default(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class Event:
+    """一条事件，id在主题内单调递增"""
+    __slots__ = ("id", "event", "data")
+
+    def __init__(self, id, event, data):
+        self.id = id
+        self.event = event
+        self.data = data
+
+    def to_dict(self):
+        return {"id": self.id, "event": self.event, "data": self.data}
+
+    def json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, default=_json_default)
+
+    def sse(self):
+        """Server-Sent Events 格式"""
+        data = json.dumps(self.data, ensure_ascii=False, default=_json_default)
+        return f"id: {self.id}\nevent: {self.event}\ndata: {data}\n\n"
+
+class Subscription:
+    """一个订阅者，只能在创建它的事件循环中读取"""
+    __slots__ = ("broker", "topic", "loop", "closed", "lagged", "_pending", "_ready")
+
+    def __init__(self, broker, topic, loop):
+        self.broker = broker
+        self.topic = topic
+        self.loop = loop
+        self.closed = False
+        self.lagged = False
+        self._pending = deque()
+        self._ready = asyncio.Event()
+
+    def _deliver(self, event):
+        """在订阅者的事件循环中执行"""
+        if self.closed:
+            return
+        if len(self._pending) >= MAX_PENDING:
+            self.lagged = True
+            self.close()
+            return
+        self._pending.append(event)
+        self._ready.set()
+
+    async def get(self, timeout=None):
+        """等待下一条事件；订阅关闭时返回None，超时抛出asyncio.TimeoutError"""
+        while not self._pending:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        return self._pending.popleft()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._ready.set()
+            self.broker._remove(self)
+
+class Broker:
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.history_size = history_size
+        self._subscribers = {}  # topic -> set(Subscription)
+        self._history = {}      # topic -> deque(Event)
+        self._sequence = {}     # topic -> 最后一个事件id
+        self._lock = threading.Lock()
+
+    def publish(self, topic, event, data):
+        """发布事件，返回Event"""
+        with self._lock:
+            sequence = self._sequence.get(topic, 0) + 1
+            self._sequence[topic] = sequence
+            item = Event(sequence, event, data)
+            history = self._history.get(topic)
+            if history is None:
+                history = self._history[topic] = deque(maxlen=self.history_size)
+            history.append(item)
+            subscribers = list(self._subscribers.get(topic, ()))
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for subscription in subscribers:
+            if subscription.loop is running:
+                subscription._deliver(item)
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, item)
+            except RuntimeError:
+                # 订阅者的事件循环已关闭
+                self._remove(subscription)
+        return item
+
+    def subscribe(self, topic, last_event_id=None):
+        """
+        在当前事件循环中订阅主题
+        last_event_id: 断线重连时传入，先补发历史中id更大的事件
+        """
+        subscription = Subscription(self, topic, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+            if last_event_id is not None:
+                for item in self._history.get(topic, ()):
+                    if item.id > last_event_id:
+                        subscription._pending.append(item)
+        return subscription
+
+    def subscriber_count(self, topic):
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+    def close_topic(self, topic):
+        """主题结束（会话结束）：释放历史，订阅者读完已投递的事件后结束"""
+        with self._lock:
+            subscribers = list(self._subscribers.pop(topic, ()))
+            self._history.pop(topic, None)
+            self._sequence.pop(topic, None)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.close)
+            except RuntimeError:
+                pass
+
+    def _remove(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+broker = Broker()
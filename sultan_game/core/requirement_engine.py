@@ -0,0 +1,300 @@
+"""
+场景进入条件评估引擎
+把场景的SceneRequirement/SceneEntryRequirement编译成检查函数列表（按场景缓存，保存要求时失效），
+玩家状态按批构建（固定5次查询，与玩家数量无关），可一次评估一个玩家对所有场景、或所有玩家对一个场景
+"""
+
+from sqlalchemy import func, select
+from core.formula import compile_formula, FormulaError
+from models import (
+    Scene, SceneRequirement, SceneEntryRequirement, RequirementType, ComparisonOperator,
+    Player, PlayerNPCInstance, NPC, PlayerCard, Card, ScenePlaySession
+)
+import operator
+import threading
+
+# 属性名 -> 队伍属性汇总中的字段（队伍为存活且在队伍中的玩家NPC）
+# 影响力、指挥力、隐秘没有实例级的当前值，取NPC模板上的属性
+PARTY_ATTRIBUTES = {
+    "strength": "strength",
+    "defense": "defense",
+    "intelligence": "intelligence",
+    "charisma": "charisma",
+    "loyalty": "loyalty",
+    "influence": "influence",
+    "command": "command",
+    "stealth": "stealth",
+    "health": "hp",
+}
+
+PARTY_FIELDS = ("count", "strength", "defense", "intelligence", "max_intelligence", "charisma", "loyalty",
+                "influence", "command", "stealth", "hp")
+
+def _contains(actual, required):
+    """in: 集合类实际值须包含全部要求值，标量实际值须在要求列表中"""
+    if isinstance(actual, (set, frozenset)):
+        return set(required if isinstance(required, list) else [required]) <= actual
+    return actual in (required if isinstance(required, (list, tuple, set)) else [required])
+
+def _not_contains(actual, required):
+    if isinstance(actual, (set, frozenset)):
+        return not (set(required if isinstance(required, list) else [required]) & actual)
+    return not _contains(actual, required)
+
+OPERATORS = {
+    ComparisonOperator.GREATER_THAN: operator.gt,
+    ComparisonOperator.GREATER_EQUAL: operator.ge,
+    ComparisonOperator.LESS_THAN: operator.lt,
+    ComparisonOperator.LESS_EQUAL: operator.le,
+    ComparisonOperator.EQUAL: operator.eq,
+    ComparisonOperator.NOT_EQUAL: operator.ne,
+    ComparisonOperator.IN: _contains,
+    ComparisonOperator.NOT_IN: _not_contains,
+}
+
+class PlayerState:
+    """评估用的玩家状态快照"""
+    __slots__ = ("player_id", "reputation", "game_day", "faction_relations", "story_flags",
+                 "party", "npcs", "cards", "completed_scenes", "_formula_context")
+
+    def __init__(self, player_id, reputation=0, game_day=1, faction_relations=None, story_flags=None):
+        self.player_id = player_id
+        self.reputation = reputation or 0
+        self.game_day = game_day or 1
+        self.faction_relations = faction_relations or {}
+        self.story_flags = story_flags or {}
+        self.party = dict.fromkeys(PARTY_FIELDS, 0)
+        self.npcs = set()              # 拥有的NPC（npcs.id 和 业务npc_id）
+        self.cards = {}                # 卡片（cards.id 和 业务card_id）-> 数量
+        self.completed_scenes = set()  # 成功完成的场景（scenes.id 和 业务scene_id）
+        self._formula_context = None
+
+    def formula_context(self):
+        """动态要求公式可用的变量：队伍属性（strength、party.count等）、reputation、game_day、factions、flags"""
+        if self._formula_context is None:
+            context = dict(self.party)
+            context.update({
+                "party": self.party,
+                "reputation": self.reputation,
+                "game_day": self.game_day,
+                "factions": self.faction_relations,
+                "flags": self.story_flags,
+            })
+            self._formula_context = context
+        return self._formula_context
+
+def _value_getter(requirement_type, name):
+    """按要求类型返回从PlayerState取实际值的函数"""
+    if requirement_type == RequirementType.ATTRIBUTE:
+        field = PARTY_ATTRIBUTES.get(name)
+        if field:
+            return lambda state: state.party[field]
+        if name == "reputation":
+            return lambda state: state.reputation
+        if name == "game_day":
+            return lambda state: state.game_day
+        # 没有对应数据的属性按0处理
+        return lambda state: 0
+    if requirement_type == RequirementType.CARD:
+        if name in ("", "cards", None):
+            return lambda state: frozenset(state.cards)
+        return lambda state: state.cards.get(name, 0)
+    if requirement_type == RequirementType.NPC:
+        if name == "count":
+            return lambda state: state.party["count"]
+        return lambda state: state.npcs
+    if requirement_type == RequirementType.RELATIONSHIP:
+        return lambda state: state.faction_relations.get(name, 0)
+    # 道具没有独立的背包表，按剧情标记处理
+    return lambda state: state.story_flags.get(name, 0)
+
+class CompiledRequirements:
+    """
+    编译后的场景进入条件
+    checks: [(检查函数, 是否强制, 提示信息)]
+    """
+    __slots__ = ("scene_id", "checks")
+
+    def __init__(self, scene_id, checks):
+        self.scene_id = scene_id
+        self.checks = checks
+
+    def evaluate(self, state):
+        failed = []
+        warnings = []
+        for check, mandatory, message in self.checks:
+            try:
+                passed = check(state)
+            except (TypeError, ValueError):  # 包括FormulaError
+                passed = False
+            if not passed:
+                (failed if mandatory else warnings).append(message)
+        return {"eligible": not failed, "failed": failed, "warnings": warnings}
+
+def _compile_requirement(requirement):
+    get_value = _value_getter(requirement.requirement_type, requirement.requirement_name)
+    compare = OPERATORS[requirement.operator]
+    required = requirement.required_value
+    message = requirement.error_message or requirement.description or (
+        f"{requirement.requirement_name} {requirement.operator.value} {requirement.required_value}"
+    )
+    mandatory = bool(requirement.is_mandatory)
+    
+    if requirement.is_dynamic and requirement.dynamic_formula:
+        # 动态要求：要求值由公式按玩家状态计算
+        try:
+            formula = compile_formula(requirement.dynamic_formula)
+        except FormulaError as e:
+            return (lambda state: False, mandatory, f"{message}（公式无效: {e}）")
+        return (
+            lambda state: compare(get_value(state), formula.evaluate(state.formula_context())),
+            mandatory, message
+        )
+    return (lambda state: compare(get_value(state), required), mandatory, message)
+
+def _compile_entry_requirement(entry):
+    checks = []
+    if entry.player_reputation_min is not None:
+        checks.append((lambda s, m=entry.player_reputation_min: s.reputation >= m, True,
+                       f"声望需要达到{entry.player_reputation_min}"))
+    if entry.any_npc_int_min is not None:
+        checks.append((lambda s, m=entry.any_npc_int_min: s.party["max_intelligence"] >= m, True,
+                       f"需要一名智力不低于{entry.any_npc_int_min}的NPC"))
+    if entry.total_str_min is not None:
+        checks.append((lambda s, m=entry.total_str_min: s.party["strength"] >= m, True,
+                       f"队伍武力总和需要达到{entry.total_str_min}"))
+    if entry.total_cha_min is not None:
+        checks.append((lambda s, m=entry.total_cha_min: s.party["charisma"] >= m, True,
+                       f"队伍魅力总和需要达到{entry.total_cha_min}"))
+    if entry.game_day_min is not None:
+        checks.append((lambda s, m=entry.game_day_min: s.game_day >= m, True,
+                       f"需要游戏第{entry.game_day_min}天之后"))
+    if entry.min_player_npcs:
+        checks.append((lambda s, m=entry.min_player_npcs: s.party["count"] >= m, True,
+                       f"至少需要{entry.min_player_npcs}名NPC"))
+    for card in entry.required_cards or []:
+        card_id = card.get("card_id") if isinstance(card, dict) else card
+        quantity = card.get("quantity", 1) if isinstance(card, dict) else 1
+        checks.append((lambda s, c=card_id, q=quantity: s.cards.get(c, 0) >= q, True, f"需要卡片{card_id} x{quantity}"))
+    completed = frozenset(entry.completed_scenes or [])
+    if completed:
+        checks.append((lambda s, c=completed: c <= s.completed_scenes, True,
+                       f"需要先完成场景: {', '.join(sorted(completed))}"))
+    for faction, minimum in (entry.faction_relations or {}).items():
+        checks.append((lambda s, f=faction, m=minimum: s.faction_relations.get(f, 0) >= m, True,
+                       f"{faction}关系需要达到{minimum}"))
+    return checks
+
+# scenes.id -> CompiledRequirements
+_cache = {}
+_lock = threading.Lock()
+
+def invalidate(scene_id=None):
+    """场景要求变更时调用；scene_id为None时清空全部缓存"""
+    with _lock:
+        if scene_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(scene_id, None)
+
+def get_compiled(db, scene_ids):
+    """返回{scenes.id: CompiledRequirements}，未缓存的场景用两次查询一起编译"""
+    with _lock:
+        result = {scene_id: _cache[scene_id] for scene_id in scene_ids if scene_id in _cache}
+    missing = [scene_id for scene_id in scene_ids if scene_id not in result]
+    if not missing:
+        return result
+
+    checks = {scene_id: [] for scene_id in missing}
+    requirements = db.query(SceneRequirement).filter(SceneRequirement.scene_id.in_(missing)).order_by(
+        SceneRequirement.priority
+    ).all()
+    for requirement in requirements:
+        checks[requirement.scene_id].append(_compile_requirement(requirement))
+    for entry in db.query(SceneEntryRequirement).filter(SceneEntryRequirement.scene_id.in_(missing)):
+        checks[entry.scene_id].extend(_compile_entry_requirement(entry))
+
+    compiled = {scene_id: CompiledRequirements(scene_id, scene_checks) for scene_id, scene_checks in checks.items()}
+    with _lock:
+        _cache.update(compiled)
+    result.update(compiled)
+    return result
+
+def load_player_states(db, player_ids=None):
+    """
+    批量构建玩家状态：player_ids为None时加载所有活跃玩家
+    固定5次查询（玩家、队伍属性汇总、NPC、卡片、已完成场景）
+    """
+    query = select(Player.id, Player.reputation, Player.game_day, Player.faction_relations, Player.story_flags)
+    query = query.where(Player.id.in_(player_ids)) if player_ids is not None else query.where(Player.is_active == True)
+    states = {row[0]: PlayerState(*row) for row in db.execute(query)}
+    if not states:
+        return states
+    ids = list(states)
+
+    party = db.execute(
+        select(
+            PlayerNPCInstance.player_id,
+            func.count(),
+            func.sum(PlayerNPCInstance.current_strength),
+            func.sum(PlayerNPCInstance.current_defense),
+            func.sum(PlayerNPCInstance.current_intelligence),
+            func.max(PlayerNPCInstance.current_intelligence),
+            func.sum(PlayerNPCInstance.current_charisma),
+            func.sum(PlayerNPCInstance.current_loyalty),
+            func.sum(NPC.influence),
+            func.sum(NPC.command),
+            func.sum(NPC.stealth),
+            func.sum(PlayerNPCInstance.current_hp),
+        ).join(NPC, NPC.id == PlayerNPCInstance.npc_id).where(
+            PlayerNPCInstance.player_id.in_(ids),
+            PlayerNPCInstance.is_alive == True,
+            PlayerNPCInstance.is_in_party == True
+        ).group_by(PlayerNPCInstance.player_id)
+    )
+    for player_id, *values in party:
+        states[player_id].party = dict(zip(PARTY_FIELDS, (value or 0 for value in values)))
+
+    npcs = db.execute(
+        select(PlayerNPCInstance.player_id, NPC.id, NPC.npc_id)
+        .join(NPC, NPC.id == PlayerNPCInstance.npc_id)
+        .where(PlayerNPCInstance.player_id.in_(ids), PlayerNPCInstance.is_alive == True)
+    )
+    for player_id, npc_id, npc_key in npcs:
+        states[player_id].npcs.update((npc_id, npc_key))
+
+    cards = db.execute(
+        select(PlayerCard.player_id, Card.id, Card.card_id, func.sum(PlayerCard.quantity))
+        .join(Card, Card.id == PlayerCard.card_id)
+        .where(PlayerCard.player_id.in_(ids), PlayerCard.quantity > 0)
+        .group_by(PlayerCard.player_id, Card.id, Card.card_id)
+    )
+    for player_id, card_id, card_key, quantity in cards:
+        states[player_id].cards[card_id] = quantity
+        states[player_id].cards[card_key] = quantity
+
+    completed = db.execute(
+        select(ScenePlaySession.player_id, Scene.id, Scene.scene_id)
+        .join(Scene, Scene.id == ScenePlaySession.scene_id)
+        .where(ScenePlaySession.player_id.in_(ids), ScenePlaySession.success_achieved == True)
+        .distinct()
+    )
+    for player_id, scene_id, scene_key in completed:
+        states[player_id].completed_scenes.update((scene_id, scene_key))
+
+    return states
+
+def evaluate_player(db, player_id, scene_ids=None):
+    """一个玩家对多个场景（默认所有活跃场景）的进入条件评估 -> {scenes.id: 结果}"""
+    states = load_player_states(db, [player_id])
+    if player_id not in states:
+        return None
+    if scene_ids is None:
+        scene_ids = list(db.execute(select(Scene.id).where(Scene.is_active == True)).scalars())
+    state = states[player_id]
+    return {scene_id: compiled.evaluate(state) for scene_id, compiled in get_compiled(db, scene_ids).items()}
+
+def evaluate_scene(db, scene_id, player_ids=None):
+    """多个玩家（默认所有活跃玩家）对一个场景的进入条件评估 -> {players.id: 结果}"""
+    compiled = get_compiled(db, [scene_id])[scene_id]
+    return {player_id: compiled.evaluate(state) for player_id, state in load_player_states(db, player_ids).items()}
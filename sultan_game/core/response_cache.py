@@ -0,0 +1,241 @@
+"""
+确定性AI调用的响应缓存
+temperature为0的非流式调用（话术选项、评分）在相同上下文下结果相同，按
+sha256(规范化的messages + 模型参数 + 接口地址) 缓存响应：
+    进程内LRU（RESPONSE_CACHE_SIZE条）-> 可选的SQLite磁盘缓存（RESPONSE_CACHE_DB为文件路径时启用，可跨进程/重启共享）
+缓存条目有TTL（RESPONSE_CACHE_TTL秒，model_config.cache_ttl可按配置覆盖）。
+磁盘缓存每写入RESPONSE_CACHE_PURGE_EVERY条清理一次：删除过期条目，超过RESPONSE_CACHE_DB_MAX_ROWS条时
+删除最早过期的条目。对话引擎的后台线程还会定期调用purge_expired清理两级缓存中的过期条目。
+scene_specific_config.cache / model_config.cache 为false时该配置不使用缓存。
+
+流式调用（旁白、NPC发言）需要推送增量文本，不走缓存。命中、未命中、跳过记录在
+AIResponse.request_context["cache"]。
+"""
+
+from collections import OrderedDict
+from core import llm_client
+from core.logging_config import get_logger
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = get_logger(__name__)
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # 秒
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")  # 为空时只使用进程内缓存
+RESPONSE_CACHE_DB_MAX_ROWS = int(os.getenv("RESPONSE_CACHE_DB_MAX_ROWS", "100000"))
+RESPONSE_CACHE_PURGE_EVERY = int(os.getenv("RESPONSE_CACHE_PURGE_EVERY", "500"))  # 每写入多少条清理一次磁盘缓存
+
+_WHITESPACE = re.compile(r"\s+")
+
+def policy(settings, overrides=None):
+    """
+    返回 "cache"（可缓存）、"bypass"（确定性调用但该配置关闭了缓存）或None（非确定性调用）
+    只有显式设置temperature为0的配置是确定性的
+    """
+    try:
+        deterministic = float(settings.get("temperature", 1)) == 0
+    except (TypeError, ValueError):
+        deterministic = False
+    if not deterministic:
+        return None
+    overrides = overrides or {}
+    return "cache" if overrides.get("cache", settings.get("cache", True)) else "bypass"
+
+def cache_key(messages, settings):
+    """规范化（合并空白）后的messages、透传的模型参数和接口地址的sha256"""
+    normalized = [[message.get("role"), _WHITESPACE.sub(" ", message.get("content") or "").strip()]
+                  for message in messages]
+    params = {key: settings[key] for key in llm_client.MODEL_PARAMETERS if key in settings}
+    material = {
+        "messages": normalized,
+        "model": settings.get("model", llm_client.DEFAULT_MODEL),
+        "params": params,
+        "base_url": settings.get("base_url") or llm_client.LLM_BASE_URL,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def ttl_for(settings):
+    return float(settings.get("cache_ttl", RESPONSE_CACHE_TTL))
+
+def _dump(completion):
+    return {"text": completion.text, "model": completion.model, "finish_reason": completion.finish_reason,
+            "tokens_used": completion.tokens_used}
+
+def _load(data):
+    # 命中时没有消耗token
+    return llm_client.Completion(data["text"], data.get("model"), 0, data.get("finish_reason"), attempts=0)
+
+class _DiskCache:
+    """SQLite磁盘层（在线程中访问）"""
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS response_cache_expires ON response_cache (expires_at)")
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def get(self, key, now):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            with self._lock:
+                self._connection.execute("DELETE FROM response_cache WHERE key = ? AND expires_at <= ?", (key, now))
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, data, expires_at):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(data, ensure_ascii=False), expires_at)
+            )
+            self._puts += 1
+            if self._puts % RESPONSE_CACHE_PURGE_EVERY == 0:
+                self._purge(time.time())
+
+    def purge(self, now):
+        with self._lock:
+            return self._purge(now)
+
+    def _purge(self, now):
+        """删除过期条目，超出行数上限时再删除最早过期的条目，返回删除的数量"""
+        removed = self._connection.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,)).rowcount
+        excess = self._connection.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - RESPONSE_CACHE_DB_MAX_ROWS
+        if excess > 0:
+            removed += self._connection.execute(
+                "DELETE FROM response_cache WHERE key IN "
+                "(SELECT key FROM response_cache ORDER BY expires_at LIMIT ?)", (excess,)
+            ).rowcount
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM response_cache")
+
+_entries = OrderedDict()  # key -> (expires_at, data)
+_lock = threading.Lock()
+_stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "disk_errors": 0}
+_disk = None
+_disk_failed = False
+_disk_lock = threading.Lock()
+
+def _get_disk():
+    global _disk, _disk_failed
+    if not RESPONSE_CACHE_DB or _disk_failed:
+        return None
+    with _disk_lock:
+        if _disk is None and not _disk_failed:
+            try:
+                _disk = _DiskCache(RESPONSE_CACHE_DB)
+            except sqlite3.Error as e:
+                # 磁盘层不可用时只使用进程内缓存
+                _disk_failed = True
+                logger.error(f"打开响应缓存数据库失败 {RESPONSE_CACHE_DB}: {e}")
+        return _disk
+
+def _remember(key, data, expires_at):
+    with _lock:
+        _entries[key] = (expires_at, data)
+        _entries.move_to_end(key)
+        while len(_entries) > RESPONSE_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+def record_bypass():
+    _count("bypassed")
+
+async def get(key):
+    """返回缓存的Completion，未命中返回None"""
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _entries.move_to_end(key)
+                _stats["hits"] += 1
+                return _load(entry[1])
+            del _entries[key]
+
+    disk = _get_disk()
+    if disk is not None:
+        try:
+            found = await asyncio.to_thread(disk.get, key, now)
+        except sqlite3.Error as e:
+            _count("disk_errors")
+            logger.warning(f"读取响应缓存失败: {e}")
+            found = None
+        if found is not None:
+            data, expires_at = found
+            _remember(key, data, expires_at)
+            _count("disk_hits")
+            return _load(data)
+
+    _count("misses")
+    return None
+
+async def put(key, completion, ttl):
+    if ttl <= 0:
+        return
+    data = _dump(completion)
+    expires_at = time.time() + ttl
+    _remember(key, data, expires_at)
+    _count("stores")
+    disk = _get_disk()
+    if disk is not None:
+        try:
+            await asyncio.to_thread(disk.put, key, data, expires_at)
+        except sqlite3.Error as e:
+            _count("disk_errors")
+            logger.warning(f"写入响应缓存失败: {e}")
+
+def purge_expired():
+    """清除进程内和磁盘缓存中的过期条目，返回清除的数量（由对话引擎的后台线程定期调用）"""
+    now = time.time()
+    with _lock:
+        expired = [key for key, (expires_at, _) in _entries.items() if expires_at <= now]
+        for key in expired:
+            del _entries[key]
+    removed = len(expired)
+    disk = _get_disk()
+    if disk is not None:
+        try:
+            removed += disk.purge(now)
+        except sqlite3.Error as e:
+            _count("disk_errors")
+            logger.warning(f"清理响应缓存失败: {e}")
+    return removed
+
+def clear():
+    with _lock:
+        _entries.clear()
+    disk = _get_disk()
+    if disk is not None:
+        disk.clear()
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats, entries=len(_entries), max_entries=RESPONSE_CACHE_SIZE)
+    lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["hits"] + stats["disk_hits"]) / lookups, 3) if lookups else None
+    stats["disk"] = RESPONSE_CACHE_DB or None
+    stats["disk_max_rows"] = RESPONSE_CACHE_DB_MAX_ROWS if RESPONSE_CACHE_DB else None
+    return stats
@@ -0,0 +1,407 @@
+"""
+奖励/掉落结算引擎
+把场景奖励（SceneRewardExtended.reward_cards/reward_npcs、CardReward、PlayerNPCReward、
+SceneReward.success_guaranteed_items/success_random_items）和NPC掉落（GameNPCConfig.random_drops）
+预编译成Walker别名表（Vose算法），每次抽取O(1)：
+
+- 每个奖励条目一张"数量"别名表：未掉落(0) 的概率为 1 - probability，其余概率均分到 min..max 数量上
+- 随机卡片/NPC的候选池一张"物品"别名表：random 等权，rarity_based 按稀有度权重
+
+场景奖励表按场景缓存（保存奖励配置时失效），候选池按筛选条件缓存（卡片/NPC变更时失效）。
+NPC掉落表在NPC变更时失效；GameNPCConfig没有经过API的写入路径，缓存另有REWARD_NPC_CACHE_TTL秒的有效期。
+奖励配置中的概率/数量不是数字时抛出RewardConfigError，动态公式出错或结果不是数字时抛出FormulaError。
+单次结算使用带种子的 random.Random（种子写入结果，可复现），批量模拟使用 numpy 向量化抽取
+"""
+
+from collections import defaultdict
+from core.formula import compile_formula, FormulaError
+from models import (
+    Card, CardRarity, CardCategory, NPC, NPCType, Tier, Faction, GameNPCConfig,
+    SceneReward, SceneRewardExtended, CardReward, PlayerNPCReward
+)
+import numpy as np
+import math
+import os
+import random
+import secrets
+import threading
+import time
+
+# rarity_based抽取时各稀有度的权重
+CARD_RARITY_WEIGHTS = {
+    CardRarity.COMMON: 60,
+    CardRarity.RARE: 25,
+    CardRarity.EPIC: 10,
+    CardRarity.LEGENDARY: 5,
+}
+NPC_TIER_WEIGHTS = {
+    Tier.BRONZE: 60,
+    Tier.SILVER: 25,
+    Tier.GOLD: 10,
+    Tier.LEGENDARY: 5,
+}
+# 批量模拟的最大次数
+MAX_SIMULATION_ROLLS = 1_000_000
+# 单个奖励条目的最大掉落数量（数量别名表按 min..max 逐项构建）
+MAX_REWARD_COUNT = 10_000
+# NPC掉落表的缓存有效期（秒）
+REWARD_NPC_CACHE_TTL = float(os.getenv("REWARD_NPC_CACHE_TTL", "300"))
+
+class RewardConfigError(ValueError):
+    """奖励配置无效（概率、数量不是数字）"""
+
+class AliasTable:
+    """Walker别名表：按权重从outcomes中抽取，构建O(n)，抽取O(1)"""
+    __slots__ = ("outcomes", "probability", "alias", "_np_probability", "_np_alias")
+
+    def __init__(self, outcomes, weights):
+        if len(outcomes) != len(weights) or not outcomes:
+            raise ValueError("outcomes and weights must be non-empty and the same length")
+        total = float(sum(weights))
+        if total <= 0 or any(weight < 0 for weight in weights):
+            raise ValueError("weights must be non-negative with a positive sum")
+
+        n = len(outcomes)
+        scaled = [weight * n / total for weight in weights]
+        probability = [0.0] * n
+        alias = list(range(n))
+        small = [i for i, value in enumerate(scaled) if value < 1]
+        large = [i for i, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probability[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        # 剩余项的概率为1（浮点误差导致的残留也按1处理）
+        for i in small + large:
+            probability[i] = 1.0
+
+        self.outcomes = list(outcomes)
+        self.probability = probability
+        self.alias = alias
+        self._np_probability = np.array(probability)
+        self._np_alias = np.array(alias, dtype=np.int64)
+
+    def sample(self, rng):
+        """抽取一个结果（rng为random.Random）"""
+        i = rng.randrange(len(self.outcomes))
+        return self.outcomes[i] if rng.random() < self.probability[i] else self.outcomes[self.alias[i]]
+
+    def sample_indices(self, size, generator):
+        """批量抽取size个结果的下标（generator为numpy Generator）"""
+        columns = generator.integers(0, len(self.outcomes), size)
+        keep = generator.random(size) < self._np_probability[columns]
+        return np.where(keep, columns, self._np_alias[columns])
+
+def _quantity_table(probability, min_count=1, max_count=None):
+    """掉落数量的别名表：0 的概率为 1 - probability，min..max 均分剩余概率"""
+    try:
+        probability = float(1.0 if probability is None else probability)
+        min_count = max(int(min_count if min_count is not None else 1), 0)
+        max_count = max(int(max_count if max_count is not None else min_count), min_count)
+    except (TypeError, ValueError, OverflowError):
+        raise RewardConfigError(f"Invalid reward probability or count: {probability!r}, {min_count!r}, {max_count!r}")
+    if math.isnan(probability):
+        raise RewardConfigError("Reward probability must be a number")
+    if max_count > MAX_REWARD_COUNT:
+        raise RewardConfigError(f"Reward count must not exceed {MAX_REWARD_COUNT}, got {max_count}")
+    probability = min(max(probability, 0.0), 1.0)
+    counts = list(range(min_count, max_count + 1))
+    share = probability / len(counts)
+    if probability < 1:
+        return AliasTable([0] + counts, [1 - probability] + [share] * len(counts))
+    return AliasTable(counts, [share] * len(counts))
+
+class RewardEntry:
+    """
+    一个奖励条目：先抽数量，再按数量给出固定物品（item_id）或从候选池（pool）抽取
+    pool为候选池的缓存键，抽取时再取别名表，卡片/NPC变更只需重建候选池
+    """
+    __slots__ = ("kind", "item_id", "pool", "quantity", "source")
+
+    def __init__(self, kind, quantity, item_id=None, pool=None, source=None):
+        self.kind = kind
+        self.item_id = item_id
+        self.pool = pool
+        self.quantity = quantity
+        self.source = source
+
+class RewardTable:
+    """编译后的奖励表"""
+    __slots__ = ("entries", "base", "multiplier", "formula")
+
+    def __init__(self, entries, base=None, multiplier=1.0, formula=None):
+        self.entries = entries
+        self.base = base or {}          # 数值奖励，如 {"experience": 100}
+        self.multiplier = multiplier    # performance_multiplier
+        self.formula = formula          # dynamic_reward_formula（编译后）
+
+_scene_cache = {}
+_npc_cache = {}  # npc_id -> (过期时间, RewardTable)
+_pool_cache = {}
+_lock = threading.Lock()
+
+def invalidate(scene_id=None):
+    """场景奖励配置变更时调用；scene_id为None时清空全部场景奖励表"""
+    with _lock:
+        if scene_id is None:
+            _scene_cache.clear()
+        else:
+            _scene_cache.pop(scene_id, None)
+
+def invalidate_npc(npc_id=None):
+    """NPC掉落配置变更时调用"""
+    with _lock:
+        if npc_id is None:
+            _npc_cache.clear()
+        else:
+            _npc_cache.pop(npc_id, None)
+
+def invalidate_pools():
+    """卡片/NPC新增、修改、删除时调用，随机候选池下次抽取时重建"""
+    with _lock:
+        _pool_cache.clear()
+
+def _enum_value(enum_class, value):
+    if value is None or value == "":
+        return None
+    try:
+        return enum_class(value)
+    except ValueError:
+        return None
+
+def _build_pool(db, pool):
+    kind, selection, filters = pool
+    filters = dict(filters)
+    if kind == "card":
+        query = db.query(Card.id, Card.rarity).filter(Card.is_active == True)
+        rarity = _enum_value(CardRarity, filters.get("rarity"))
+        category = _enum_value(CardCategory, filters.get("category"))
+        if rarity:
+            query = query.filter(Card.rarity == rarity)
+        if category:
+            query = query.filter(Card.category == category)
+        rows = query.order_by(Card.id).all()
+        weights = CARD_RARITY_WEIGHTS
+    else:
+        query = db.query(NPC.id, NPC.tier).filter(NPC.is_active == True, NPC.npc_type == NPCType.PLAYER_NPC)
+        faction = _enum_value(Faction, filters.get("faction"))
+        tier = _enum_value(Tier, filters.get("rarity"))
+        if faction:
+            query = query.filter(NPC.faction == faction)
+        if tier:
+            query = query.filter(NPC.tier == tier)
+        rows = query.order_by(NPC.id).all()
+        weights = NPC_TIER_WEIGHTS
+    if not rows:
+        return None
+    if selection == "rarity_based":
+        return AliasTable([row[0] for row in rows], [weights.get(row[1], 1) for row in rows])
+    return AliasTable([row[0] for row in rows], [1] * len(rows))
+
+def _get_pool(db, pool):
+    with _lock:
+        if pool in _pool_cache:
+            return _pool_cache[pool]
+    table = _build_pool(db, pool)
+    with _lock:
+        _pool_cache[pool] = table
+    return table
+
+def _item_entries(items, source, default_probability):
+    """JSON物品列表 -> 条目，兼容 type/item_type、item_id/card_id/npc_id 写法"""
+    entries = []
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        kind = item.get("type") or item.get("item_type") or ("npc" if "npc_id" in item else "card")
+        item_id = item.get("item_id") or item.get("card_id") or item.get("npc_id")
+        if not item_id:
+            continue
+        try:
+            quantity = int(item.get("quantity", 1) or 1)
+        except (TypeError, ValueError):
+            raise RewardConfigError(f"Invalid reward quantity for {item_id}: {item.get('quantity')!r}")
+        probability = item.get("probability", default_probability(item_id))
+        entries.append(RewardEntry(kind, _quantity_table(probability, quantity, quantity), item_id=item_id, source=source))
+    return entries
+
+def _card_reward_entry(row):
+    quantity = _quantity_table(row.probability, row.min_card_count, row.max_card_count)
+    if row.card_selection_type == "specific":
+        return RewardEntry("card", quantity, item_id=row.specific_card_id, source="card_rewards")
+    filters = (("category", row.card_category_filter), ("rarity", row.card_rarity_filter))
+    return RewardEntry("card", quantity, pool=("card", row.card_selection_type, filters), source="card_rewards")
+
+def _npc_reward_entry(row):
+    quantity = _quantity_table(row.probability, row.min_npc_count, row.max_npc_count)
+    if row.npc_selection_type == "specific":
+        return RewardEntry("player_npc", quantity, item_id=row.specific_npc_id, source="npc_rewards")
+    if row.npc_selection_type == "player_choice":
+        # 由玩家从候选池中选择，结算只给出可选数量
+        return RewardEntry("npc_choice", quantity, source="npc_rewards")
+    filters = (("faction", row.npc_faction_filter), ("rarity", row.npc_rarity_filter))
+    return RewardEntry("npc", quantity, pool=("npc", row.npc_selection_type, filters), source="npc_rewards")
+
+def compile_scene_rewards(db, scene_id):
+    """编译场景奖励表（未缓存时固定4次查询）"""
+    extended = db.query(SceneRewardExtended).filter(SceneRewardExtended.scene_id == scene_id).first()
+    legacy = db.query(SceneReward).filter(SceneReward.scene_id == scene_id).first()
+
+    entries = []
+    base = {}
+    multiplier = 1.0
+    formula = None
+    if legacy:
+        base = {
+            "attribute_points": legacy.success_attribute_points or 0,
+            "experience": legacy.success_experience or 0,
+            "reputation": legacy.success_reputation or 0,
+            "gold": legacy.success_gold or 0,
+        }
+        entries += _item_entries(legacy.success_guaranteed_items, "guaranteed_items", lambda item_id: 1.0)
+        entries += _item_entries(legacy.success_random_items, "random_items", lambda item_id: 1.0)
+    if extended:
+        # 扩展奖励配置的数值优先
+        base = {
+            "attribute_points": extended.success_attribute_points or 0,
+            "experience": extended.success_experience or 0,
+            "reputation": extended.success_reputation or 0,
+            "gold": extended.success_gold or 0,
+        }
+        card_probability = extended.card_reward_probability or {}
+        entries += _item_entries(
+            [{"type": "card", **item} for item in extended.reward_cards or [] if isinstance(item, dict)],
+            "reward_cards", lambda item_id: card_probability.get(item_id, 1.0)
+        )
+        entries += _item_entries(
+            [{"type": "player_npc", **item} for item in extended.reward_npcs or [] if isinstance(item, dict)],
+            "reward_npcs", lambda item_id: 1.0
+        )
+        entries += [_card_reward_entry(row) for row in db.query(CardReward).filter(
+            CardReward.scene_reward_id == extended.id).order_by(CardReward.id)]
+        entries += [_npc_reward_entry(row) for row in db.query(PlayerNPCReward).filter(
+            PlayerNPCReward.scene_reward_id == extended.id).order_by(PlayerNPCReward.id)]
+        multiplier = extended.performance_multiplier if extended.performance_multiplier is not None else 1.0
+        if extended.dynamic_reward_formula:
+            formula = compile_formula(extended.dynamic_reward_formula)
+    return RewardTable(entries, base, multiplier, formula)
+
+def get_scene_table(db, scene_id):
+    with _lock:
+        if scene_id in _scene_cache:
+            return _scene_cache[scene_id]
+    table = compile_scene_rewards(db, scene_id)
+    with _lock:
+        _scene_cache[scene_id] = table
+    return table
+
+def get_npc_table(db, npc_id):
+    """NPC战败掉落表（GameNPCConfig）"""
+    now = time.monotonic()
+    with _lock:
+        cached = _npc_cache.get(npc_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+    config = db.query(GameNPCConfig).filter(GameNPCConfig.npc_id == npc_id).first()
+    entries, base = [], {}
+    if config:
+        base = {"attribute_points": config.attribute_points_drop or 0}
+        entries += _item_entries(config.guaranteed_drops, "guaranteed_drops", lambda item_id: 1.0)
+        entries += _item_entries(config.random_drops, "random_drops", lambda item_id: 1.0)
+    table = RewardTable(entries, base)
+    with _lock:
+        _npc_cache[npc_id] = (now + REWARD_NPC_CACHE_TTL, table)
+    return table
+
+def _multiplier(table, context):
+    """performance_multiplier x 动态公式结果（公式用context求值，缺少context时不计算）"""
+    multiplier = table.multiplier
+    if table.formula is not None and context is not None:
+        value = table.formula.evaluate(context)
+        if not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise FormulaError(f"Dynamic reward formula must return a finite number, got {value!r}")
+        multiplier *= value
+    return multiplier
+
+def roll(db, table, seed=None, context=None):
+    """
+    结算一次奖励；seed为空时生成随机种子
+    context: dynamic_reward_formula的求值变量，公式出错时抛出FormulaError
+    """
+    if seed is None:
+        seed = secrets.randbits(53)
+    rng = random.Random(seed)
+    multiplier = _multiplier(table, context)
+    granted = defaultdict(int)
+    for entry in table.entries:
+        quantity = entry.quantity.sample(rng)
+        if not quantity:
+            continue
+        if entry.pool is None:
+            granted[(entry.kind, entry.item_id)] += quantity
+            continue
+        pool = _get_pool(db, entry.pool)
+        if pool is None:
+            continue
+        for _ in range(quantity):
+            granted[(entry.kind, pool.sample(rng))] += 1
+
+    items = [{"type": kind, "item_id": item_id, "quantity": quantity}
+             for (kind, item_id), quantity in granted.items()]
+    return {
+        "seed": seed,
+        "multiplier": multiplier,
+        **{key: int(round(value * multiplier)) for key, value in table.base.items()},
+        "items": items
+    }
+
+def simulate(db, table, rolls, seed=None, context=None):
+    """
+    批量模拟rolls次结算，返回每个物品的掉落率（至少获得1个的比例）和平均数量
+    """
+    rolls = max(min(int(rolls), MAX_SIMULATION_ROLLS), 1)
+    generator = np.random.default_rng(seed)
+    totals = defaultdict(int)
+    dropped = {}  # (类型, 物品) -> 每次结算是否获得的布尔数组
+    roll_ids = np.arange(rolls)
+
+    def record(key, roll_indices, count):
+        totals[key] += count
+        if key not in dropped:
+            dropped[key] = np.zeros(rolls, dtype=bool)
+        dropped[key][roll_indices] = True
+
+    for entry in table.entries:
+        quantities = np.asarray(entry.quantity.outcomes)[entry.quantity.sample_indices(rolls, generator)]
+        if entry.pool is None:
+            record((entry.kind, entry.item_id), quantities > 0, int(quantities.sum()))
+            continue
+        pool = _get_pool(db, entry.pool)
+        if pool is None or not quantities.any():
+            continue
+        # 每个抽到的物品归属的结算序号
+        owners = np.repeat(roll_ids, quantities)
+        drawn = pool.sample_indices(owners.size, generator)
+        order = np.argsort(drawn, kind="stable")
+        indices, starts = np.unique(drawn[order], return_index=True)
+        for index, group in zip(indices, np.split(owners[order], starts[1:])):
+            record((entry.kind, pool.outcomes[index]), group, int(group.size))
+
+    multiplier = _multiplier(table, context)
+    items = []
+    for (kind, item_id), total in totals.items():
+        items.append({
+            "type": kind,
+            "item_id": item_id,
+            "drop_rate": round(float(dropped[(kind, item_id)].mean()), 6),
+            "mean_quantity": round(total / rolls, 6)
+        })
+    items.sort(key=lambda item: -item["drop_rate"])
+    return {
+        "rolls": rolls,
+        "multiplier": multiplier,
+        **{key: int(round(value * multiplier)) for key, value in table.base.items()},
+        "items": items
+    }
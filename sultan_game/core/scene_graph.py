@@ -0,0 +1,242 @@
+"""
+场景前置关系图索引
+scene_prerequisites表保存“前置场景 -> 场景”的边，进程内维护正反邻接表；
+一次查询校验整个前置场景列表并拒绝成环，解锁/祖先查询为O(边数)，不访问数据库
+经API写入的变更在事务提交后同步到索引；其他进程或直接改库的变更在 SCENE_GRAPH_RESYNC_SECONDS 秒内重新加载后生效
+"""
+
+from sqlalchemy import Text, delete, event, func, insert, select, type_coerce
+from core.database import SessionLocal
+from models import Scene, ScenePrerequisite
+import os
+import threading
+import time
+
+# 定期从数据库重新加载索引的间隔（秒）
+SCENE_GRAPH_RESYNC_SECONDS = int(os.getenv("SCENE_GRAPH_RESYNC_SECONDS", "3600"))
+
+class PrerequisiteError(ValueError):
+    """前置场景列表无效（场景不存在或形成环）"""
+
+_lock = threading.RLock()
+_loaded = False
+_loaded_at = 0.0
+_keys = {}           # scenes.id -> 业务scene_id
+_prerequisites = {}  # scenes.id -> {前置scenes.id}
+_unlocks = {}        # scenes.id -> {以它为前置的scenes.id}
+
+def _set_edges(scene_id, prerequisite_ids):
+    """替换内存中某个场景的前置边（调用方持有_lock）"""
+    for prerequisite_id in _prerequisites.pop(scene_id, ()):
+        dependents = _unlocks.get(prerequisite_id)
+        if dependents:
+            dependents.discard(scene_id)
+    if prerequisite_ids:
+        _prerequisites[scene_id] = set(prerequisite_ids)
+        for prerequisite_id in prerequisite_ids:
+            _unlocks.setdefault(prerequisite_id, set()).add(scene_id)
+
+def rebuild_edges(db):
+    """根据scenes.prerequisite_scenes重建scene_prerequisites表（未提交）"""
+    scenes = db.execute(select(Scene.id, Scene.scene_id, Scene.prerequisite_scenes)).all()
+    ids = {scene_key: scene_id for scene_id, scene_key, _ in scenes}
+    rows = [
+        {"scene_id": scene_id, "prerequisite_id": ids[key]}
+        for scene_id, _, keys in scenes
+        for key in dict.fromkeys(keys or [])
+        if key in ids and ids[key] != scene_id
+    ]
+    db.execute(delete(ScenePrerequisite))
+    if rows:
+        db.execute(insert(ScenePrerequisite), rows)
+    return len(rows)
+
+def load(db=None):
+    """从数据库加载整个图（两次查询）"""
+    global _loaded, _loaded_at
+    session = db or SessionLocal()
+    try:
+        edges = session.execute(select(ScenePrerequisite.scene_id, ScenePrerequisite.prerequisite_id)).all()
+        keys = dict(session.execute(select(Scene.id, Scene.scene_id)).all())
+    finally:
+        if db is None:
+            session.close()
+
+    with _lock:
+        _keys.clear()
+        _keys.update(keys)
+        _prerequisites.clear()
+        _unlocks.clear()
+        for scene_id, prerequisite_id in edges:
+            _prerequisites.setdefault(scene_id, set()).add(prerequisite_id)
+            _unlocks.setdefault(prerequisite_id, set()).add(scene_id)
+        _loaded = True
+        _loaded_at = time.time()
+
+def initialize():
+    """
+    启动时调用：边表为空但已有前置数据时（create_all新建表的旧数据库）先回填，再加载索引
+    """
+    session = SessionLocal()
+    try:
+        if session.execute(select(func.count()).select_from(ScenePrerequisite)).scalar() == 0 and session.execute(
+            select(func.count()).select_from(Scene).where(
+                type_coerce(Scene.prerequisite_scenes, Text).notin_(["[]", ""])
+            )
+        ).scalar():
+            rebuild_edges(session)
+            session.commit()
+        load(session)
+    finally:
+        session.close()
+
+def invalidate():
+    """丢弃内存索引，下次查询时重新加载（绕过set_prerequisites写入时调用）"""
+    global _loaded
+    with _lock:
+        _loaded = False
+
+def _ensure_loaded(db=None):
+    if not _loaded or time.time() - _loaded_at > SCENE_GRAPH_RESYNC_SECONDS:
+        load(db)
+
+def _descendants(scene_id):
+    """所有直接或间接以scene_id为前置的场景（调用方持有_lock）"""
+    seen = set()
+    stack = [scene_id]
+    while stack:
+        for dependent in _unlocks.get(stack.pop(), ()):
+            if dependent not in seen:
+                seen.add(dependent)
+                stack.append(dependent)
+    return seen
+
+def resolve_prerequisites(db, scene_id, prerequisite_keys):
+    """
+    校验前置场景列表并返回对应的scenes.id列表
+    一次IN查询确认所有业务scene_id存在，再在内存图上检查是否成环
+    """
+    keys = list(dict.fromkeys(prerequisite_keys or []))
+    if not keys:
+        return []
+
+    found = dict(db.execute(select(Scene.scene_id, Scene.id).where(Scene.scene_id.in_(keys))).all())
+    for key in keys:
+        if key not in found:
+            raise PrerequisiteError(f"Prerequisite scene '{key}' not found")
+
+    _ensure_loaded(db)
+    with _lock:
+        if scene_id in found.values():
+            raise PrerequisiteError("Scene cannot be its own prerequisite")
+        descendants = _descendants(scene_id)
+        for key in keys:
+            if found[key] in descendants:
+                raise PrerequisiteError(
+                    f"Prerequisite scene '{key}' depends on this scene, which would create a cycle"
+                )
+    return [found[key] for key in keys]
+
+def set_prerequisites(db, scene, prerequisite_keys):
+    """
+    校验并保存场景的前置场景列表，同步更新scene_prerequisites表（随会话提交）
+    内存索引在事务提交后更新，回滚则丢弃
+    """
+    keys = list(dict.fromkeys(prerequisite_keys or []))
+    prerequisite_ids = resolve_prerequisites(db, scene.id, keys)
+    scene.prerequisite_scenes = keys
+
+    db.execute(delete(ScenePrerequisite).where(ScenePrerequisite.scene_id == scene.id))
+    if prerequisite_ids:
+        db.execute(insert(ScenePrerequisite), [
+            {"scene_id": scene.id, "prerequisite_id": prerequisite_id} for prerequisite_id in prerequisite_ids
+        ])
+
+    pending = db.info.setdefault("scene_graph_pending", {})
+    pending[scene.id] = (scene.scene_id, dict(zip(prerequisite_ids, keys)))
+
+def add_new_scene_edges(db, scenes):
+    """
+    为新插入的场景批量写入前置边（批量导入使用，随会话提交）
+    scenes: [(scenes.id, 业务scene_id, {前置scenes.id: 前置业务scene_id})]
+    新场景还没有依赖它的场景，只要前置均已存在就不会成环
+    """
+    rows = [
+        {"scene_id": scene_id, "prerequisite_id": prerequisite_id}
+        for scene_id, _, prerequisites in scenes
+        for prerequisite_id in prerequisites
+    ]
+    if rows:
+        db.execute(insert(ScenePrerequisite), rows)
+    pending = db.info.setdefault("scene_graph_pending", {})
+    for scene_id, scene_key, prerequisites in scenes:
+        pending[scene_id] = (scene_key, prerequisites)
+
+def _scene_refs(scene_ids):
+    return [{"id": scene_id, "scene_id": _keys.get(scene_id)} for scene_id in scene_ids]
+
+def get_prerequisites(scene_id, db=None):
+    """直接前置场景"""
+    _ensure_loaded(db)
+    with _lock:
+        return _scene_refs(sorted(_prerequisites.get(scene_id, ()), key=lambda s: _keys.get(s) or s))
+
+def get_unlocks(scene_id, completed=None, db=None):
+    """
+    完成scene_id后解锁的场景
+    completed为已完成场景的列表（业务scene_id，与get_graph一致；也接受scenes.id）时，只返回全部前置均已满足的场景；
+    为None时返回所有直接依赖它的场景
+    """
+    _ensure_loaded(db)
+    with _lock:
+        dependents = _unlocks.get(scene_id, ())
+        if completed is not None:
+            by_key = {key: scene for scene, key in _keys.items()}
+            done = {item if item in _keys else by_key.get(item, item) for item in completed}
+            done.add(scene_id)
+            dependents = [d for d in dependents if _prerequisites.get(d, set()) <= done]
+        return _scene_refs(sorted(dependents, key=lambda s: _keys.get(s) or s))
+
+def get_ancestors(scene_id, db=None):
+    """完整的祖先链，按拓扑顺序排列（前置场景在依赖它的场景之前）"""
+    _ensure_loaded(db)
+    with _lock:
+        order = []
+        visited = {scene_id}
+        stack = [(scene_id, iter(sorted(_prerequisites.get(scene_id, ()))))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(sorted(_prerequisites.get(child, ())))))
+                    break
+            else:
+                stack.pop()
+                if node != scene_id:
+                    order.append(node)
+        return _scene_refs(order)
+
+def get_graph(db=None):
+    """整张前置关系图：{业务scene_id: [前置业务scene_id...]}，只包含有前置的场景"""
+    _ensure_loaded(db)
+    with _lock:
+        return {
+            _keys.get(scene_id, scene_id): sorted(_keys.get(p, p) for p in prerequisite_ids)
+            for scene_id, prerequisite_ids in _prerequisites.items()
+        }
+
+@event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session):
+    pending = session.info.pop("scene_graph_pending", None)
+    if not pending or not _loaded:
+        return
+    with _lock:
+        for scene_id, (scene_key, prerequisite_keys) in pending.items():
+            _keys[scene_id] = scene_key
+            _keys.update(prerequisite_keys)
+            _set_edges(scene_id, prerequisite_keys)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("scene_graph_pending", None)
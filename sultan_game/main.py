@@ -2,9 +2,13 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from api import scenes, npcs, cards, ai_configs, templates
-from core.database import Base, engine
-from core.logging_config import get_logger, log_api_request, setup_logging
+from api import scenes, npcs, cards, ai_configs, templates, batch, combat, dice, dialogue
+from core.database import Base, engine, start_request_query_stats, reset_request_query_stats
+from core.logging_config import get_logger, log_api_request, setup_logging, get_logging_stats
+from core.log_reader import tail_lines, read_since, search_logs
+from core import dashboard, scene_graph, dialogue_engine, llm_client, response_cache
+from contextlib import asynccontextmanager
+from typing import Optional
 import time
 import traceback
 
@@ -16,20 +20,31 @@ logger.info("启动苏丹的游戏后端API系统")
 try:
     Base.metadata.create_all(bind=engine)
     logger.info("数据库表创建/更新成功")
+    scene_graph.initialize()
+    dialogue_engine.start()
 except Exception as e:
     logger.error(f"数据库初始化失败: {e}")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 大模型连接池随应用启动创建、关闭时释放
+    llm_client.start()
+    yield
+    await llm_client.aclose()
+
 # 创建FastAPI应用
 app = FastAPI(
     title="苏丹的游戏 - 后端API",
     description="AI多智能体游戏后端管理系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 添加API请求日志中间件
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()
+    query_stats, query_stats_token = start_request_query_stats()
     
     # 记录请求开始
     logger.info(f"API Request: {request.method} {request.url}")
@@ -38,13 +53,16 @@ async def log_requests(request: Request, call_next):
         response = await call_next(request)
         process_time = time.time() - start_time
         
-        # 记录成功响应
+        # 记录成功响应（附带SQL统计，用于发现N+1查询）
         log_api_request(
             method=request.method,
             url=str(request.url),
             status_code=response.status_code,
-            response_time=process_time
+            response_time=process_time,
+            query_stats=query_stats
         )
+        response.headers["X-DB-Query-Count"] = str(query_stats.count)
+        response.headers["X-DB-Time-Ms"] = f"{query_stats.total_time * 1000:.1f}"
         
         return response
     except Exception as e:
@@ -57,7 +75,8 @@ async def log_requests(request: Request, call_next):
             url=str(request.url),
             status_code=500,
             response_time=process_time,
-            error=error_msg
+            error=error_msg,
+            query_stats=query_stats
         )
         
         logger.error(f"API Error: {request.method} {request.url} - {error_msg}")
@@ -72,6 +91,8 @@ async def log_requests(request: Request, call_next):
                 "timestamp": int(time.time())
             }
         )
+    finally:
+        reset_request_query_stats(query_stats_token)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -91,6 +112,10 @@ app.include_router(npcs.router, prefix="/api")
 app.include_router(cards.router, prefix="/api")
 app.include_router(ai_configs.router, prefix="/api")
 app.include_router(templates.router, prefix="/api")
+app.include_router(batch.router, prefix="/api")
+app.include_router(combat.router, prefix="/api")
+app.include_router(dice.router, prefix="/api")
+app.include_router(dialogue.router, prefix="/api")
 
 # 根路径重定向到管理界面
 @app.get("/")
@@ -105,11 +130,27 @@ async def health_check():
 
 # 日志查看API
 @app.get("/api/logs")
-async def get_logs(log_type: str = "all", lines: int = 100):
+def get_logs(
+    log_type: str = "all",
+    lines: int = 100,
+    since: Optional[int] = None,
+    level: Optional[str] = None,
+    logger_name: Optional[str] = None,
+    url: Optional[str] = None,
+    status_code: Optional[int] = None,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None
+):
     """
     获取日志内容
     log_type: all | error | api
     lines: 返回的行数
+    since: 字节偏移量游标（上次返回的next_offset），传入时返回该位置之后新增的行，用于增量轮询
+    
+    结构化检索（任一条件存在时，在最近30天的JSON Lines日志中按索引检索）:
+    level: 最低日志级别  logger_name: 日志器名称  url: URL子串  status_code: HTTP状态码
+    start_time/end_time: 时间范围（Unix时间戳，秒）
+    同步接口：读取和检索日志文件在线程池中执行，不阻塞事件循环
     """
     from pathlib import Path
     from datetime import datetime
@@ -118,6 +159,29 @@ async def get_logs(log_type: str = "all", lines: int = 100):
     today = datetime.now().strftime("%Y-%m-%d")
     
     try:
+        if any(value is not None for value in (level, logger_name, url, status_code, start_time, end_time)):
+            entries = search_logs(
+                LOG_DIR,
+                lines=lines,
+                level=level,
+                logger_name=logger_name,
+                url=url,
+                status_code=status_code,
+                start_time=start_time,
+                end_time=end_time
+            )
+            logger.info(f"检索日志: {len(entries)} 条")
+            return {
+                "logs": [
+                    f"{entry['time']} - {entry['logger']} - {entry['level']} - "
+                    f"[{entry.get('file')}:{entry.get('line')}] - {entry['message']}"
+                    for entry in entries
+                ],
+                "entries": entries,
+                "total_lines": len(entries),
+                "log_type": "structured"
+            }
+        
         if log_type == "error":
             log_file = LOG_DIR / f"error_{today}.log"
         elif log_type == "api":
@@ -128,17 +192,19 @@ async def get_logs(log_type: str = "all", lines: int = 100):
         if not log_file.exists():
             return {"logs": [], "message": f"Log file not found: {log_file}"}
         
-        # 读取最后N行
-        with open(log_file, 'r', encoding='utf-8') as f:
-            all_lines = f.readlines()
-            recent_lines = all_lines[-lines:] if len(all_lines) > lines else all_lines
+        # 从文件末尾按块读取最后N行，或从游标位置增量读取，不读入整个文件
+        if since is None:
+            recent_lines, next_offset = tail_lines(log_file, lines)
+        else:
+            recent_lines, next_offset = read_since(log_file, since, lines)
         
         logger.info(f"获取日志: {log_type}, {len(recent_lines)} 行")
         return {
             "logs": [line.strip() for line in recent_lines],
             "total_lines": len(recent_lines),
             "log_file": str(log_file),
-            "log_type": log_type
+            "log_type": log_type,
+            "next_offset": next_offset
         }
         
     except Exception as e:
@@ -148,48 +214,13 @@ async def get_logs(log_type: str = "all", lines: int = 100):
 # 仪表板API
 @app.get("/api/dashboard/stats")
 async def get_dashboard_stats():
-    """获取仪表板统计数据"""
-    # TODO: 从数据库获取真实统计数据
-    return {
-        "scenes": 12,
-        "npcs": 45,
-        "cards": 78,
-        "ai_configs": 8,
-        "active_players": 156,
-        "total_sessions": 2340
-    }
+    """获取仪表板统计数据（增量维护的计数，不做COUNT(*)扫描）"""
+    return dashboard.get_stats()
 
 @app.get("/api/dashboard/activities")
-async def get_recent_activities():
+async def get_recent_activities(limit: int = 20):
     """获取最近活动"""
-    # TODO: 从数据库获取真实活动数据
-    current_time = int(time.time())
-    return [
-        {
-            "timestamp": current_time - 3600,
-            "description": "创建了新场景'宰相的试探'",
-            "type": "scene_created",
-            "user": "admin"
-        },
-        {
-            "timestamp": current_time - 7200,
-            "description": "更新了NPC'将军哲巴尔'的配置",
-            "type": "npc_updated", 
-            "user": "admin"
-        },
-        {
-            "timestamp": current_time - 10800,
-            "description": "新增了卡片'贿赂金币'",
-            "type": "card_created",
-            "user": "admin"
-        },
-        {
-            "timestamp": current_time - 14400,
-            "description": "配置了新的AI智能体'政治场景旁白'",
-            "type": "ai_config_created",
-            "user": "admin"
-        }
-    ]
+    return dashboard.get_activities(limit)
 
 # 系统信息API
 @app.get("/api/system/info")
@@ -201,9 +232,15 @@ async def get_system_info():
         "api_status": "running",
         "ai_service_status": "pending_configuration",
         "last_backup": int(time.time()) - 86400,
-        "uptime": 3600  # 秒
+        "uptime": 3600,  # 秒
+        "logging": get_logging_stats()
     }
 
+@app.get("/api/system/llm")
+async def get_llm_metrics():
+    """大模型提供方的连接池、并发排队、限流和熔断状态，以及响应缓存的命中率"""
+    return {"providers": llm_client.get_metrics(), "response_cache": response_cache.get_stats()}
+
 # 配置验证API
 @app.post("/api/validate/config")
 async def validate_config(config_type: str, config_data: dict):
@@ -250,46 +287,6 @@ async def validate_config(config_type: str, config_data: dict):
     
     return validation_results
 
-# 批量操作API
-@app.post("/api/batch/import")
-async def batch_import(import_type: str, data: list):
-    """批量导入数据"""
-    results = {
-        "total": len(data),
-        "success": 0,
-        "failed": 0,
-        "errors": []
-    }
-    
-    for item in data:
-        try:
-            # TODO: 根据import_type处理不同类型的数据导入
-            if import_type == "scenes":
-                # 导入场景
-                pass
-            elif import_type == "npcs":
-                # 导入NPC
-                pass
-            elif import_type == "cards":
-                # 导入卡片
-                pass
-            
-            results["success"] += 1
-        except Exception as e:
-            results["failed"] += 1
-            results["errors"].append(str(e))
-    
-    return results
-
-@app.post("/api/batch/export")
-async def batch_export(export_type: str, filters: dict = None):
-    """批量导出数据"""
-    # TODO: 实现数据导出功能
-    return {
-        "export_url": f"/api/downloads/{export_type}_{int(time.time())}.json",
-        "expires_at": int(time.time()) + 3600
-    }
-
 # 错误处理
 from fastapi.responses import JSONResponse
 
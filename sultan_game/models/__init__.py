@@ -7,7 +7,7 @@ from .card_redesign import (
     PlayerCard, ActiveCardEffect, CardBalanceStandard, CardUsageRecord
 )
 from .scene_redesign import (
-    Scene, SceneCategory, TimeOfDay, SceneStatus,
+    Scene, SceneCategory, TimeOfDay, SceneStatus, ScenePrerequisite,
     SceneEntryRequirement, SceneNPCConfiguration, SceneAIConfiguration,
     SceneReward, SceneDynamicEvent, ScenePlaySession, SceneAnalytics
 )
@@ -17,9 +17,9 @@ from .scene_requirements import (
 )
 
 # 保留的旧模型（用于对话和战斗系统）
-from .dialogue import DialogueSession, DialogueRound, DialogueSpeech
+from .dialogue import DialogueSession, DialogueRound, DialogueSpeech, SessionStatus, SpeakerType
 from .combat import CombatRecord
-from .ai_config import AIConfig, AIType
+from .ai_config import AIConfig, AIType, SceneAIConfig, AISession, AIResponse
 from .template import ConfigTemplate, TemplateType, TemplateCategory
 
 __all__ = [
@@ -36,7 +36,7 @@ __all__ = [
     "PlayerCard", "ActiveCardEffect", "CardBalanceStandard", "CardUsageRecord",
     
     # 场景系统
-    "SceneCategory", "TimeOfDay", "SceneStatus", "SceneEntryRequirement",
+    "SceneCategory", "TimeOfDay", "SceneStatus", "ScenePrerequisite", "SceneEntryRequirement",
     "SceneNPCConfiguration", "SceneAIConfiguration", "SceneReward",
     "SceneDynamicEvent", "ScenePlaySession", "SceneAnalytics",
     
@@ -45,10 +45,10 @@ __all__ = [
     "SceneCardBinding", "SceneRewardExtended", "PlayerNPCReward", "CardReward",
     
     # 对话和战斗系统
-    "DialogueSession", "DialogueRound", "DialogueSpeech", "CombatRecord",
+    "DialogueSession", "DialogueRound", "DialogueSpeech", "SessionStatus", "SpeakerType", "CombatRecord",
     
     # AI配置系统
-    "AIConfig", "AIType",
+    "AIConfig", "AIType", "SceneAIConfig", "AISession", "AIResponse",
     
     # 配置模板系统
     "ConfigTemplate", "TemplateType", "TemplateCategory"
@@ -1,6 +1,6 @@
 from sqlalchemy import Column, Integer, String, Text, JSON, Boolean, ForeignKey, Enum, Float
 from sqlalchemy.orm import relationship
-from core.database import Base
+from core.database import Base, JSONText
 import uuid
 import enum
 
@@ -52,7 +52,7 @@ class Scene(Base):
     
     # 场景展示配置
     card_count = Column(Integer, default=0)  # 折卡数量
-    prerequisite_scenes = Column(Text, default='[]')  # 前置场景列表 (JSON string)
+    prerequisite_scenes = Column(JSONText, default=list)  # 前置场景列表 (JSON string，读取时解码为list)
     days_required = Column(Integer, default=0)  # 天数要求
     
     # 系统字段
@@ -69,6 +69,13 @@ class Scene(Base):
     dynamic_events = relationship("SceneDynamicEvent", back_populates="scene")
     analytics = relationship("SceneAnalytics", back_populates="scene")
 
+class ScenePrerequisite(Base):
+    """场景前置关系边（prerequisite_scenes的规范化索引，由core.scene_graph维护）"""
+    __tablename__ = "scene_prerequisites"
+    
+    scene_id = Column(String(36), ForeignKey("scenes.id"), primary_key=True)
+    prerequisite_id = Column(String(36), ForeignKey("scenes.id"), primary_key=True, index=True)
+
 class SceneEntryRequirement(Base):
     """场景进入条件"""
     __tablename__ = "scene_entry_requirements"
@@ -112,7 +119,7 @@ class SceneNPCConfiguration(Base):
     __tablename__ = "scene_npc_configurations"
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    scene_id = Column(String(36), ForeignKey("scenes.id"), nullable=False)
+    scene_id = Column(String(36), ForeignKey("scenes.id"), nullable=False, index=True)
     npc_id = Column(String(36), ForeignKey("npcs.id"), nullable=False)
     
     # 在场景中的角色
@@ -157,7 +164,8 @@ class SceneAIConfiguration(Base):
     # 格式: {"dice_trigger": 75, "tension_trigger": 85}
     
     success_criteria = Column(JSON, default=dict)
-    # 格式: {"dice_required": 5, "special_condition": "minister_trust>60"}
+    # 格式: {"dice_required": 5, "dice_success_face": 5, "special_condition": "minister_trust>60"}
+    # dice_success_face: 骰子点数 >= 该值算一次成功（默认5）
     
     # 话术生成AI配置
     option_generation_style = Column(JSON, default=dict)
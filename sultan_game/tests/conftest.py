@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 测试使用独立的SQLite数据库，需在导入core.database之前设置
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{Path(tempfile.mkdtemp()) / 'sultan_test.db'}")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,97 @@
+import asyncio
+import time
+import types
+import uuid
+
+import pytest
+
+from core import ai_orchestrator
+from core.ai_orchestrator import AgentConfigError, Orchestrator, Step, resolve_dependencies
+from models import AIType
+
+def _agent(config_id, ai_type, order, npc_id=None, depends_on=None, timeout=1):
+    config = types.SimpleNamespace(
+        id=uuid.uuid4(), config_id=config_id, name=config_id, ai_type=ai_type, system_prompt="", base_prompt="",
+        character_config={"npc_id": npc_id} if npc_id else {}, model_config={}, version=1, updated_at=0,
+    )
+    overrides = {"timeout": timeout}
+    if depends_on is not None:
+        overrides["depends_on"] = depends_on
+    link = types.SimpleNamespace(id=uuid.uuid4(), ai_config=config, scene_specific_config=overrides,
+                                 execution_order=order, is_required=True, trigger_conditions={})
+    return ai_orchestrator.Agent(link)
+
+def _step(npc_turns):
+    step = Step.__new__(Step)
+    step.session_id = str(uuid.uuid4())
+    step.round_id = str(uuid.uuid4())
+    step.round_number = 1
+    step.tension_level = 0
+    step.round_start = False
+    step.scene_npcs = set(npc_turns)
+    step.npc_turns = list(npc_turns)
+    step.player_turn = None
+    return step
+
+def _templates(agents, npc_turns):
+    template = types.SimpleNamespace(speaker_name="NPC", render=lambda context: [{"role": "user", "content": ""}])
+    return {(agent.id, npc_id): template for agent in agents for npc_id in (None, *npc_turns)}
+
+def test_dependency_against_speaking_order_is_ignored():
+    # X负责后发言的n1，Y负责先发言的n2：Y依赖X时，X的发言等Y、Y等X，互相等待
+    dedicated = _agent("npc_x", AIType.NPC, 1, npc_id="n1")
+    generic = _agent("npc_y", AIType.NPC, 2, depends_on=["npc_x"])
+    assignments = {dedicated.id: ["n1"], generic.id: ["n2"]}
+    dependencies = resolve_dependencies([dedicated, generic], assignments, ["n2", "n1"])
+    assert dependencies[generic.id] == []
+    # 与发言顺序一致的依赖保留
+    dependencies = resolve_dependencies([dedicated, generic], assignments, ["n1", "n2"])
+    assert dependencies[generic.id] == [dedicated.id]
+
+def test_circular_depends_on_is_a_config_error():
+    first = _agent("narrator_a", AIType.NARRATOR, 1, depends_on=["narrator_b"])
+    second = _agent("narrator_b", AIType.NARRATOR, 2, depends_on=["narrator_a"])
+    with pytest.raises(AgentConfigError):
+        resolve_dependencies([first, second])
+
+def test_run_finishes_when_depends_on_contradicts_speaking_order():
+    agents = [_agent("npc_x", AIType.NPC, 1, npc_id="n1"), _agent("npc_y", AIType.NPC, 2, depends_on=["npc_x"])]
+    step = _step(["n2", "n1"])
+
+    async def failing_complete(messages, settings, on_delta=None):
+        raise ai_orchestrator.llm_client.LLMError("down")
+
+    async def run():
+        orchestrator = Orchestrator(None, step, agents, _templates(agents, step.npc_turns), failing_complete)
+        await asyncio.wait_for(orchestrator.run(5), 2)
+        return orchestrator
+
+    orchestrator = asyncio.run(run())
+    assert set(orchestrator.results.values()) == {"failed"}
+
+def test_run_times_out_and_cancels_pending_agents():
+    agents = [_agent("narrator", AIType.NARRATOR, 1)]
+    step = _step([])
+    step.round_start = True
+    cancelled = []
+
+    async def hanging_complete(messages, settings, on_delta=None):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        state = types.SimpleNamespace(to_dict=lambda: {})
+        orchestrator = Orchestrator(state, step, agents, _templates(agents, []), hanging_complete)
+        orchestrator.agents[agents[0].id].timeout = 60
+        started = time.perf_counter()
+        await orchestrator.run(0.2)
+        return orchestrator, time.perf_counter() - started
+
+    orchestrator, elapsed = asyncio.run(run())
+    assert elapsed < 2
+    assert orchestrator.results == {agents[0].id: "timeout"}
+    assert cancelled
+    assert not orchestrator.result(0)["ok"]
@@ -0,0 +1,88 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core import dialogue_context, dialogue_engine, pubsub
+from core.database import SessionLocal
+from models import DialogueSession, DialogueSpeech, Player, Scene, SceneCategory, SessionStatus, SpeakerType
+
+import main
+
+@pytest.fixture(scope="module")
+def ids():
+    # 启动应用以建表并启动后台刷新线程
+    with TestClient(main.app):
+        now = int(time.time())
+        player = Player(id=str(uuid.uuid4()), username=f"idle_{uuid.uuid4().hex[:8]}")
+        scene = Scene(id=str(uuid.uuid4()), scene_id=f"idle_{uuid.uuid4().hex[:8]}", name="空闲场景",
+                      category=SceneCategory.MAIN_STORY, is_active=True, created_at=now, updated_at=now)
+        db = SessionLocal()
+        db.add_all([player, scene])
+        db.commit()
+        ids = (player.id, scene.id)
+        db.close()
+        yield ids
+
+def test_evict_idle_releases_memory_and_keeps_session_resumable(ids):
+    player_id, scene_id = ids
+    db = SessionLocal()
+    try:
+        state = dialogue_engine.create_session(db, player_id, scene_id, ["npc_a"], ["npc_b"])
+    finally:
+        db.close()
+    dialogue_engine.add_speech(state.id, SpeakerType.NARRATOR, None, "旁白", "朝堂一片寂静。")
+
+    async def subscribe_and_evict():
+        subscription = pubsub.broker.subscribe(state.id)
+        assert dialogue_engine.evict_idle(ttl=3600) == []
+        # 仍有订阅者（观战客户端）的会话不移出
+        watched = await asyncio.to_thread(dialogue_engine.evict_idle, 0)
+        subscription.close()
+        return watched, await asyncio.to_thread(dialogue_engine.evict_idle, 0)
+
+    watched, evicted = asyncio.run(subscribe_and_evict())
+    assert watched == []
+    assert evicted == [state.id]
+    assert state.id not in {session.id for session in dialogue_engine.active_sessions()}
+    assert dialogue_context.get_memory(state.id) is None
+
+    db = SessionLocal()
+    try:
+        row = db.get(DialogueSession, state.id)
+        assert row.status == SessionStatus.ACTIVE
+        assert row.total_speeches == 1
+    finally:
+        db.close()
+
+    # 再次访问时从数据库恢复
+    restored = dialogue_engine.get_session(state.id)
+    assert restored is not None and restored.total_speeches == 1
+    dialogue_engine.end_session(state.id)
+
+def test_speech_on_evicted_state_is_recorded_on_reloaded_session(ids, monkeypatch):
+    player_id, scene_id = ids
+    db = SessionLocal()
+    try:
+        state = dialogue_engine.create_session(db, player_id, scene_id, ["npc_a"], ["npc_b"])
+    finally:
+        db.close()
+    dialogue_engine.add_speech(state.id, SpeakerType.NARRATOR, None, "旁白", "朝堂一片寂静。")
+    assert dialogue_engine.evict_idle(0) == [state.id]
+
+    # 模拟在移出之前取得状态、移出之后才拿到锁的发言
+    require = dialogue_engine._require
+    stale = iter([state])
+    monkeypatch.setattr(dialogue_engine, "_require", lambda session_id: next(stale, None) or require(session_id))
+    speech = dialogue_engine.add_speech(state.id, SpeakerType.NARRATOR, None, "旁白", "宰相出列。")
+    dialogue_engine.flush()
+
+    db = SessionLocal()
+    try:
+        assert db.get(DialogueSpeech, speech["id"]) is not None
+        assert db.get(DialogueSession, state.id).total_speeches == 2
+    finally:
+        db.close()
+    dialogue_engine.end_session(state.id)
@@ -0,0 +1,17 @@
+import pytest
+
+from core import dice
+
+def test_roll_is_reproducible():
+    result = dice.roll(10, 3, seed=42)
+    assert dice.replay(result)["faces"] == result["faces"]
+    assert dice.verify(result)
+
+@pytest.mark.parametrize("dice_count", [-1, dice.MAX_TABLE_DICE + 1, 10**9])
+def test_roll_rejects_dice_count_out_of_range(dice_count):
+    with pytest.raises(dice.DiceError):
+        dice.roll(dice_count, 3, seed=1)
+
+def test_verify_rejects_out_of_range_record():
+    result = dice.roll(10, 3, seed=42)
+    assert not dice.verify(dict(result, dice_count=10**9))
@@ -0,0 +1,112 @@
+import random
+import time
+
+import pytest
+
+from core.formula import FormulaError, compile_formula, evaluate_formula
+
+def test_arithmetic_and_variables():
+    formula = compile_formula("max(10, npc.strength * 1.5) if day > 3 else 5")
+    assert formula.evaluate({"npc": {"strength": 12}, "day": 4}) == 18.0
+    assert evaluate_formula("round(strength / 3, 2)", {"strength": 5}) == 1.67
+
+@pytest.mark.parametrize("source", ["round(1, -10**8)", "round(1, 16)", "round(x, -100)"])
+def test_round_ndigits_is_bounded(source):
+    started = time.perf_counter()
+    with pytest.raises(FormulaError):
+        evaluate_formula(source, {"x": 1})
+    assert time.perf_counter() - started < 1
+
+@pytest.mark.parametrize("source, context", [
+    ("x * 10**9", {"x": [0]}),
+    ("10**9 * x", {"x": "a"}),
+    ("x ** 2", {"x": [1, 2]}),
+    ("2 ** x", {"x": {"a": 1}}),
+    ("'a' * 3", {}),
+])
+def test_multiply_and_power_reject_non_numbers(source, context):
+    with pytest.raises(FormulaError):
+        evaluate_formula(source, context)
+
+@pytest.mark.parametrize("source, context", [
+    ("'%0500000000d' % 1", {}),
+    ("day % 7", {"day": "%0999999999d"}),
+    ("x + 'a'", {"x": "a"}),
+    ("x // 2", {"x": [1]}),
+    ("x - y", {"x": 1, "y": "a"}),
+])
+def test_arithmetic_rejects_non_numbers(source, context):
+    started = time.perf_counter()
+    with pytest.raises(FormulaError):
+        evaluate_formula(source, context)
+    assert time.perf_counter() - started < 1
+
+def test_power_limits():
+    with pytest.raises(FormulaError):
+        compile_formula("9 ** 9 ** 9")
+    assert evaluate_formula("x ** 2", {"x": True}) == 1
+
+@pytest.mark.parametrize("source", ["__import__('os')", "x.__class__", "[1, 2]", "lambda: 1"])
+def test_unsupported_syntax(source):
+    with pytest.raises(FormulaError):
+        compile_formula(source)
+
+# 模糊测试：随机公式 + 恶意变量值，只允许返回有界结果或抛出FormulaError
+_FUZZ_VALUES = [
+    0, 1, -1, 7, 2 ** 62, -(2 ** 200), 0.5, 1e308, float("inf"), float("nan"), True, None,
+    "", "a", "%0999999999d", "%s%s%s", "x" * 1000, [0], [1, 2], {"a": 1}, {"strength": "%d"},
+]
+_FUZZ_LEAVES = ["1", "2", "0", "-3", "2.5", "1e308", "100", "'a'", "'%0999999999d'", "'%s'", "True", "None",
+                "x", "y", "npc.strength", "npc.name"]
+_FUZZ_BINARY = ["+", "-", "*", "/", "//", "%", "**"]
+_FUZZ_COMPARE = ["<", "<=", ">", ">=", "==", "!="]
+_FUZZ_FUNCTIONS = ["min", "max", "abs", "round", "floor", "ceil", "sqrt", "clamp"]
+
+def _random_formula(rng, depth):
+    if depth <= 0 or rng.random() < 0.2:
+        return rng.choice(_FUZZ_LEAVES)
+    kind = rng.randrange(6)
+    if kind == 0:
+        return f"({_random_formula(rng, depth - 1)} {rng.choice(_FUZZ_BINARY)} {_random_formula(rng, depth - 1)})"
+    if kind == 1:
+        return f"({_random_formula(rng, depth - 1)} {rng.choice(_FUZZ_COMPARE)} {_random_formula(rng, depth - 1)})"
+    if kind == 2:
+        return f"({rng.choice(['-', '+', 'not '])}{_random_formula(rng, depth - 1)})"
+    if kind == 3:
+        args = ", ".join(_random_formula(rng, depth - 1) for _ in range(rng.randint(1, 3)))
+        return f"{rng.choice(_FUZZ_FUNCTIONS)}({args})"
+    if kind == 4:
+        return (f"({_random_formula(rng, depth - 1)} if {_random_formula(rng, depth - 1)} "
+                f"else {_random_formula(rng, depth - 1)})")
+    return f"({_random_formula(rng, depth - 1)} {rng.choice(['and', 'or'])} {_random_formula(rng, depth - 1)})"
+
+def _random_context(rng):
+    return {
+        "x": rng.choice(_FUZZ_VALUES),
+        "y": rng.choice(_FUZZ_VALUES),
+        "npc": {"strength": rng.choice(_FUZZ_VALUES), "name": rng.choice(_FUZZ_VALUES)},
+    }
+
+def _assert_bounded(value):
+    if isinstance(value, int):
+        assert value.bit_length() <= 1024 * 200
+    elif isinstance(value, str):
+        assert len(value) <= 1000
+    elif isinstance(value, (list, dict)):
+        assert len(value) <= 2
+    else:
+        assert value is None or isinstance(value, float)
+
+def test_fuzz_random_formulas_and_hostile_contexts():
+    rng = random.Random(20240613)
+    started = time.perf_counter()
+    for _ in range(3000):
+        source = _random_formula(rng, rng.randint(1, 5))
+        context = _random_context(rng)
+        case_started = time.perf_counter()
+        try:
+            _assert_bounded(evaluate_formula(source, context))
+        except FormulaError:
+            pass
+        assert time.perf_counter() - case_started < 0.5, source
+    assert time.perf_counter() - started < 30
@@ -0,0 +1,54 @@
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core.database import SessionLocal, assert_max_queries
+from models import (
+    Scene, SceneCategory, SceneStatus, SceneNPCConfiguration, NPC, NPCType, Tier, Faction
+)
+
+import main
+
+def _seed(count):
+    """写入count个场景（每个场景配置两个NPC）"""
+    now = int(time.time())
+    run = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    try:
+        for index in range(count):
+            scene = Scene(id=str(uuid.uuid4()), scene_id=f"qc_{run}_{index}", name=f"场景{index}",
+                          category=SceneCategory.MAIN_STORY, status=SceneStatus.ACTIVE, is_active=True,
+                          created_at=now, updated_at=now)
+            db.add(scene)
+            for i in range(2):
+                npc = NPC(id=str(uuid.uuid4()), npc_id=f"qc_{run}_{index}_{i}", name=f"大臣{i}",
+                          npc_type=NPCType.GAME_NPC, tier=Tier.SILVER, faction=Faction.MINISTER,
+                          intelligence=5, strength=30, defense=30, hp_max=100, is_active=True,
+                          created_at=now, updated_at=now)
+                db.add(npc)
+                db.add(SceneNPCConfiguration(id=str(uuid.uuid4()), scene_id=scene.id, npc_id=npc.id))
+        db.commit()
+    finally:
+        db.close()
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.mark.parametrize("path", ["/api/scenes/", "/api/npcs/"])
+def test_list_query_count_does_not_grow_with_rows(client, path):
+    _seed(2)
+    with assert_max_queries(2) as few:
+        response = client.get(path, params={"limit": 500})
+    assert response.status_code == 200
+    small = len(response.json())
+
+    _seed(20)
+    with assert_max_queries(few.count) as many:
+        response = client.get(path, params={"limit": 500})
+    assert response.status_code == 200
+    assert len(response.json()) > small
+    assert many.count == few.count
@@ -0,0 +1,39 @@
+import time
+
+from core import response_cache
+
+def test_disk_cache_purges_expired_and_caps_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_DB_MAX_ROWS", 10)
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_PURGE_EVERY", 5)
+    disk = response_cache._DiskCache(str(tmp_path / "cache.db"))
+    now = time.time()
+    disk.put("expired", {"text": "old"}, now - 1)
+    for index in range(24):
+        disk.put(f"key{index}", {"text": str(index)}, now + 100 + index)
+
+    rows = disk._connection.execute("SELECT key FROM response_cache ORDER BY expires_at").fetchall()
+    assert len(rows) <= 10 + response_cache.RESPONSE_CACHE_PURGE_EVERY
+    assert disk.get("expired", now) is None
+    # 超出上限时先删除最早过期的条目
+    assert disk.get("key23", now) is not None
+    assert disk.get("key0", now) is None
+
+def test_purge_caps_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_DB_MAX_ROWS", 3)
+    disk = response_cache._DiskCache(str(tmp_path / "cache.db"))
+    now = time.time()
+    for index in range(6):
+        disk.put(f"key{index}", {"text": str(index)}, now + 100 + index)
+    assert disk.purge(now) == 3
+    assert [row[0] for row in disk._connection.execute("SELECT key FROM response_cache ORDER BY key")] == \
+        ["key3", "key4", "key5"]
+
+def test_purge_expired_drops_expired_memory_entries(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_DB", "")
+    now = time.time()
+    response_cache._remember("stale", {"text": "old"}, now - 1)
+    response_cache._remember("fresh", {"text": "new"}, now + 100)
+    assert response_cache.purge_expired() >= 1
+    assert "stale" not in response_cache._entries
+    assert "fresh" in response_cache._entries
+    response_cache.clear()
@@ -0,0 +1,25 @@
+import pytest
+
+from core import rewards
+from core.formula import FormulaError, compile_formula
+
+def test_non_numeric_probability_is_a_config_error():
+    with pytest.raises(rewards.RewardConfigError):
+        rewards._item_entries([{"card_id": "c1", "probability": "often"}], "reward_cards", lambda item_id: 1.0)
+    with pytest.raises(rewards.RewardConfigError):
+        rewards._item_entries([{"card_id": "c1", "quantity": "many"}], "reward_cards", lambda item_id: 1.0)
+
+def test_quantity_range_is_bounded():
+    assert len(rewards._quantity_table(1.0, 1, rewards.MAX_REWARD_COUNT).outcomes) == rewards.MAX_REWARD_COUNT
+    with pytest.raises(rewards.RewardConfigError):
+        rewards._quantity_table(1.0, 1, 10 ** 12)
+
+@pytest.mark.parametrize("context", [{"bonus": "high"}, {"bonus": [2]}])
+def test_non_numeric_formula_result_is_a_formula_error(context):
+    table = rewards.RewardTable([], {"experience": 100}, formula=compile_formula("bonus"))
+    with pytest.raises(FormulaError):
+        rewards.roll(None, table, seed=1, context=context)
+
+def test_formula_scales_numeric_rewards():
+    table = rewards.RewardTable([], {"experience": 100}, formula=compile_formula("bonus * 2"))
+    assert rewards.roll(None, table, seed=1, context={"bonus": 1.5})["experience"] == 300